@@ -0,0 +1,58 @@
+#
+# Measures how fast made-up ballot numbers are turned away: count_ballot with the store's Bloom filter of the issued
+# ballots against the cast_ballot transaction that found them missing before, on a store of issued ballots.
+#
+# $ python -m backend.benchmark.ballot_filter_benchmark --voters 20000 --forgeries 5000
+# $ python -m backend.benchmark.ballot_filter_benchmark --voters 20000 --database /tmp/voting.db
+#
+
+import argparse
+import time
+
+import backend.main.api.balloting as balloting
+from backend.benchmark.utils import fresh_store, synthetic_voters, ops_per_second
+from backend.main.objects.ballot import Ballot, generate_ballot_number
+from backend.main.objects.national_id import NationalId
+from backend.main.objects.voter import BallotStatus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the rejection of unknown ballot numbers")
+    parser.add_argument("--voters", type=int, default=20000)
+    parser.add_argument("--forgeries", type=int, default=5000)
+    parser.add_argument("--database", default=None, help="An sqlite file to benchmark on, instead of memory")
+    args = parser.parse_args()
+
+    store = fresh_store(args.database)
+    voters = synthetic_voters(args.voters)
+    store.add_voters(voters)
+    balloting.issue_ballots(voter.national_id for voter in voters)
+    national_id = NationalId.parse(voters[0].national_id)
+    # Authentic numbers that were never issued, which only the filter turns away
+    forged_ballots = [Ballot(generate_ballot_number(national_id), "1", "") for _ in range(args.forgeries)]
+
+    started = time.perf_counter()
+    assert store.might_have_ballot(forged_ballots[0].ballot_number) in (True, False)
+    print("filter of {0} ballots loaded in {1:.1f} ms".format(args.voters, (time.perf_counter() - started) * 1e3))
+
+    false_positives = sum(store.might_have_ballot(ballot.ballot_number) for ballot in forged_ballots)
+    print("false positives: {0} of {1} ({2:.2%})".format(
+        false_positives, args.forgeries, false_positives / args.forgeries))
+
+    def count_without_filter(ballot: Ballot):
+        assert store.cast_ballot(ballot, national_id, lambda voter, comment: comment) != BallotStatus.BALLOT_COUNTED
+
+    def count_with_filter(ballot: Ballot):
+        assert balloting.count_ballot(ballot, national_id) != BallotStatus.BALLOT_COUNTED
+
+    without_filter = ops_per_second(count_without_filter, forged_ballots)
+    with_filter = ops_per_second(count_with_filter, forged_ballots)
+    print("{0:>24} {1:>14}".format("forged ballots", "rejections/s"))
+    print("{0:>24} {1:>14,.0f}".format("cast_ballot transaction", without_filter))
+    print("{0:>24} {1:>14,.0f}".format("Bloom filter", with_filter))
+    print("speedup: {0:.1f}x".format(with_filter / without_filter))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#
+# Measures the throughput of the authenticated ballot numbers: generating them one at a time and in batch, against the
+# AES-EAX numbers they replaced, and verifying them - authentic and forged - against looking them up in the store.
+#
+# $ python -m backend.benchmark.ballot_number_benchmark --count 100000
+#
+
+import argparse
+import time
+import uuid
+
+from Cryptodome.Cipher import AES
+
+from backend.benchmark.utils import fresh_store, ops_per_second
+from backend.main.objects.ballot import generate_ballot_number, generate_ballot_numbers, is_authentic_ballot_number
+from backend.main.objects.national_id import NationalId
+
+
+def legacy_generate_ballot_number(national_id: str) -> bytes:
+    """
+    The former ballot number: national_id + uuid4 encrypted with AES-EAX, throwing the nonce and tag away
+    """
+    return AES.new(b"12345678901234567890123456789012", mode=AES.MODE_EAX).encrypt(
+        (national_id + str(uuid.uuid4())).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ballot number generation and verification")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    national_ids = ["{0:09d}".format(i) for i in range(args.count)]
+
+    started = time.perf_counter()
+    ballot_numbers = generate_ballot_numbers(national_ids)
+    batch_rate = args.count / (time.perf_counter() - started)
+    # One character of the tag changed
+    forged_ballot_numbers = [ballot_number[:-1] + ("B" if ballot_number[-1] == "A" else "A")
+                             for ballot_number in ballot_numbers]
+
+    store = fresh_store()
+    store.add_ballots(list(zip(national_ids, ballot_numbers)))
+    national_id = NationalId.parse(national_ids[0])
+
+    results = [
+        ("legacy EAX generation", ops_per_second(legacy_generate_ballot_number, national_ids)),
+        ("generate_ballot_number", ops_per_second(generate_ballot_number, national_ids)),
+        ("generate_ballot_numbers", batch_rate),
+        ("verify authentic", ops_per_second(is_authentic_ballot_number, ballot_numbers)),
+        ("verify forged", ops_per_second(is_authentic_ballot_number, forged_ballot_numbers)),
+        ("store lookup of forged", ops_per_second(
+            lambda ballot_number: store.count_specified_validated_ballot(national_id, ballot_number),
+            forged_ballot_numbers)),
+    ]
+    assert all(map(is_authentic_ballot_number, ballot_numbers))
+    assert not any(map(is_authentic_ballot_number, forged_ballot_numbers))
+
+    print("ballot numbers: {0}".format(args.count))
+    for label, rate in results:
+        print("{0:<26} {1:12,.0f} /s {2:8.2f} us".format(label, rate, 1e6 / rate))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#
+# Compares the throughput of counting ballots through the original chain of VotingStore calls (one commit per call)
+# with the single-transaction VotingStore.cast_ballot.
+#
+# $ python -m backend.benchmark.count_ballot_benchmark --voters 5000
+#
+
+import argparse
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import BallotStatus, VoterStatus
+from backend.main.store.data_registry import VotingStore
+from backend.main.detection.pii_detection import redact_free_text
+from backend.benchmark.utils import synthetic_voters, ops_per_second
+
+
+def count_ballot_per_call(ballot: Ballot, voter_national_id: str) -> BallotStatus:
+    """
+    The pre-cast_ballot implementation of balloting.count_ballot, kept here as the baseline.
+    """
+    store = VotingStore.get_instance()
+    voter = store.get_voter(voter_national_id)
+    if voter is None:
+        return BallotStatus.VOTER_NOT_REGISTERED
+    if store.is_ballont_to_voter(voter_national_id, ballot.ballot_number) == 0:
+        return BallotStatus.VOTER_BALLOT_MISMATCH
+    if store.is_invalitated_ballot(ballot.ballot_number) > 0:
+        return BallotStatus.INVALID_BALLOT
+    if store.is_existed_ballot(ballot.ballot_number) == 0:
+        return BallotStatus.INVALID_BALLOT
+    if store.count_casted_ballot(voter_national_id) > 0:
+        store.update_status_voter(voter_national_id, str(VoterStatus.FRAUD_COMMITTED.value))
+        store.invalidated_ballot(ballot.ballot_number)
+        return BallotStatus.FRAUD_COMMITTED
+    store.update_status_voter(voter_national_id, str(VoterStatus.BALLOT_COUNTED.value))
+    store.validated_ballot(ballot.ballot_number)
+    comment = redact_free_text(ballot.voter_comments, voter.first_name, voter.last_name, voter.national_id)
+    store.update_content_ballot(ballot.ballot_number, ballot.chosen_candidate_id, comment)
+    return BallotStatus.BALLOT_COUNTED
+
+
+def prepare_election(voter_count: int):
+    """
+    Refreshes the store and returns (national_id, Ballot) pairs, one freshly issued ballot per registered voter.
+    """
+    VotingStore.refresh_instance()
+    registry.register_candidate("Kathryn Collins")
+    candidate_id = registry.get_all_candidates()[0].candidate_id
+    submissions = []
+    for voter in synthetic_voters(voter_count):
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        submissions.append((voter.national_id, Ballot(ballot_number, candidate_id, "Call me at 329 112-4535")))
+    return submissions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ballot counting before and after cast_ballot")
+    parser.add_argument("--voters", type=int, default=5000)
+    args = parser.parse_args()
+
+    submissions = prepare_election(args.voters)
+    before = ops_per_second(lambda item: count_ballot_per_call(item[1], item[0]), submissions)
+
+    submissions = prepare_election(args.voters)
+    after = ops_per_second(lambda item: balloting.count_ballot(item[1], item[0]), submissions)
+
+    print("voters: {0}".format(args.voters))
+    print("per-call store methods:  {0:10.0f} votes/s".format(before))
+    print("cast_ballot transaction: {0:10.0f} votes/s ({1:.1f}x)".format(after, after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#
+# Measures the memory and the construction throughput of the domain objects, against the same classes with a __dict__
+# (as they were before they got __slots__): bytes per object, as allocated, and objects built per second from rows.
+#
+# $ python -m backend.benchmark.domain_objects_benchmark --count 1000000
+#
+
+import argparse
+import time
+import tracemalloc
+
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import MinimalVoter, Voter
+
+
+def with_dict(cls) -> type:
+    """
+    The same class, with a __dict__ per object instead of __slots__
+    """
+    return type(cls.__name__ + "WithDict", (), {"__init__": cls.__init__})
+
+
+def bytes_per_object(cls, rows) -> float:
+    """
+    The memory allocated per object while building one from each row. The rows themselves are allocated beforehand.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [cls(*row) for row in rows]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # The list holding the objects isn't part of them
+    allocated -= len(objects) * 8
+    return allocated / len(rows)
+
+
+def objects_per_second(cls, rows) -> float:
+    started = time.perf_counter()
+    for row in rows:
+        cls(*row)
+    return len(rows) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the memory and construction speed of the domain objects")
+    parser.add_argument("--count", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows_per_class = {
+        Voter: [("First{0}".format(i), "Last{0}".format(i), "{0:09d}".format(i)) for i in range(args.count)],
+        MinimalVoter: [("nonce-tag-first-{0}".format(i), "nonce-tag-last-{0}".format(i), "hash-{0}".format(i))
+                       for i in range(args.count)],
+        Ballot: [("ballot-{0}".format(i), str(i % 8), "") for i in range(args.count)],
+        Candidate: [(str(i), "Candidate {0}".format(i)) for i in range(args.count)],
+    }
+
+    print("{0:>14} {1:>14} {2:>14} {3:>16} {4:>16}".format(
+        "object", "dict bytes", "slots bytes", "dict objects/s", "slots objects/s"))
+    for cls, rows in rows_per_class.items():
+        dict_cls = with_dict(cls)
+        print("{0:>14} {1:>14.1f} {2:>14.1f} {3:>16,.0f} {4:>16,.0f}".format(
+            cls.__name__,
+            bytes_per_object(dict_cls, rows),
+            bytes_per_object(cls, rows),
+            objects_per_second(dict_cls, rows),
+            objects_per_second(cls, rows)))
+
+
+if __name__ == "__main__":
+    main()
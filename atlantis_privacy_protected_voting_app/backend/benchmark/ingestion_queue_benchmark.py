@@ -0,0 +1,69 @@
+#
+# Compares the sustained throughput of counting ballots from many concurrent threads, one transaction per ballot,
+# against the write-behind ingestion queue that commits them in batches. Most telling on an on-disk database, where
+# every commit is a write to the WAL, and with --synchronous FULL also an fsync.
+#
+# $ python -m backend.benchmark.ingestion_queue_benchmark --voters 20000 --threads 64 --database /tmp/voting.db
+#
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.store.connection_manager import FILE_DATABASE_PRAGMAS
+from backend.benchmark.utils import synthetic_voters, fresh_store
+
+
+def prepare_election(voter_count: int, database: str):
+    """
+    Creates a fresh store and returns (Ballot, national_id) pairs, one freshly issued ballot per registered voter.
+    """
+    fresh_store(database)
+    registry.register_candidate("Kathryn Collins")
+    candidate_id = registry.get_all_candidates()[0].candidate_id
+    voters = synthetic_voters(voter_count)
+    registry.register_voters(voters)
+    ballot_numbers = balloting.issue_ballots([voter.national_id for voter in voters])
+    return [(Ballot(ballot_number, candidate_id, "Call me at 329 112-4535"), voter.national_id)
+            for voter, ballot_number in zip(voters, ballot_numbers)]
+
+
+def votes_per_second(submissions, threads: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda submission: balloting.count_ballot(*submission), submissions))
+    return len(submissions) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ballot counting with and without the ingestion queue")
+    parser.add_argument("--voters", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--max-batch-size", type=int, default=512)
+    parser.add_argument("--max-delay", type=float, default=0.0)
+    parser.add_argument("--database", help="sqlite file to run on (deleted first); in memory if not given")
+    parser.add_argument("--synchronous", default=FILE_DATABASE_PRAGMAS["synchronous"],
+                        help="PRAGMA synchronous of the database file: FULL syncs the WAL to disk on every commit")
+    args = parser.parse_args()
+    FILE_DATABASE_PRAGMAS["synchronous"] = args.synchronous
+
+    before = votes_per_second(prepare_election(args.voters, args.database), args.threads)
+
+    submissions = prepare_election(args.voters, args.database)
+    balloting.enable_ballot_ingestion_queue(args.max_batch_size, args.max_delay)
+    try:
+        after = votes_per_second(submissions, args.threads)
+    finally:
+        balloting.disable_ballot_ingestion_queue()
+
+    print("voters: {0}, threads: {1}, database: {2}, synchronous: {3}".format(
+        args.voters, args.threads, args.database or "memory", args.synchronous))
+    print("one transaction per ballot: {0:10.0f} votes/s".format(before))
+    print("ingestion queue:            {0:10.0f} votes/s ({1:.1f}x)".format(after, after / before))
+
+
+if __name__ == "__main__":
+    main()
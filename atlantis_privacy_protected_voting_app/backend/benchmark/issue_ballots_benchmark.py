@@ -0,0 +1,49 @@
+#
+# Compares issuing ballots one at a time through balloting.issue_ballot with the bulk balloting.issue_ballots, with and
+# without a process pool for the ballot-number encryption.
+#
+# $ python -m backend.benchmark.issue_ballots_benchmark --voters 100000 --processes 4
+#
+
+import argparse
+import time
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.benchmark.utils import synthetic_voters, ops_per_second, fresh_store
+
+
+def issue_in_bulk(national_ids, processes) -> float:
+    started = time.perf_counter()
+    ballot_numbers = balloting.issue_ballots(national_ids, processes=processes)
+    elapsed = time.perf_counter() - started
+    assert all(ballot_numbers)
+    return len(ballot_numbers) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks single and bulk ballot issuance")
+    parser.add_argument("--voters", type=int, default=100000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--database", help="sqlite file to benchmark against (deleted first); in memory by default")
+    args = parser.parse_args()
+    voters = synthetic_voters(args.voters)
+    national_ids = [voter.national_id for voter in voters]
+
+    results = []
+    for label, processes in [("issue_ballot", None), ("issue_ballots", None),
+                             ("issue_ballots, {0} processes".format(args.processes), args.processes)]:
+        fresh_store(args.database)
+        registry.register_voters(voters)
+        if label == "issue_ballot":
+            results.append((label, ops_per_second(balloting.issue_ballot, national_ids)))
+        else:
+            results.append((label, issue_in_bulk(national_ids, processes)))
+
+    print("voters: {0}".format(args.voters))
+    for label, rate in results:
+        print("{0:<28} {1:10.0f} ballots/s ({2:.1f}x)".format(label, rate, rate / results[0][1]))
+
+
+if __name__ == "__main__":
+    main()
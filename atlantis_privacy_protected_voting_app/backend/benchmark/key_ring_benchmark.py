@@ -0,0 +1,44 @@
+#
+# Measures what the KeyRing saves on the hot paths: reading a key from the secrets on every use against the cached key,
+# and keying a fresh HMAC for every message against copying the cached HMAC state.
+#
+# $ python -m backend.benchmark.key_ring_benchmark --repetitions 200000
+#
+
+import argparse
+import hmac
+import os
+
+from backend.benchmark.utils import ops_per_second
+from backend.main.objects.ballot import BALLOT_NUMBER_KEY_SECRET_NAME
+from backend.main.store.secret_registry import KEY_RING, get_secret_bytes
+
+
+def copy_cached_hmac(message: bytes) -> bytes:
+    ballot_hmac = KEY_RING.get_hmac(BALLOT_NUMBER_KEY_SECRET_NAME).copy()
+    ballot_hmac.update(message)
+    return ballot_hmac.digest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the KeyRing cache against reading the secrets")
+    parser.add_argument("--repetitions", type=int, default=200000)
+    args = parser.parse_args()
+    messages = [os.urandom(17) for _ in range(args.repetitions)]
+    key = KEY_RING.get_key(BALLOT_NUMBER_KEY_SECRET_NAME)
+    assert copy_cached_hmac(messages[0]) == hmac.digest(key, messages[0], "sha256")
+
+    results = [
+        ("get_secret_bytes", ops_per_second(lambda _: get_secret_bytes(BALLOT_NUMBER_KEY_SECRET_NAME), messages)),
+        ("KEY_RING.get_key", ops_per_second(lambda _: KEY_RING.get_key(BALLOT_NUMBER_KEY_SECRET_NAME), messages)),
+        ("secret + hmac.digest", ops_per_second(
+            lambda message: hmac.digest(get_secret_bytes(BALLOT_NUMBER_KEY_SECRET_NAME), message, "sha256"),
+            messages)),
+        ("cached HMAC state copy", ops_per_second(copy_cached_hmac, messages)),
+    ]
+    for label, rate in results:
+        print("{0:<24} {1:12,.0f} /s {2:8.2f} us".format(label, rate, 1e6 / rate))
+
+
+if __name__ == "__main__":
+    main()
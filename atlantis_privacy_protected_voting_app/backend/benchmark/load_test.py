@@ -0,0 +1,182 @@
+#
+# Load test for the voting backend. Generates N synthetic voters, registers them, issues their ballots and casts the
+# votes - with a share of fraudulent second ballots and of duplicate resubmissions - through the Python API and through
+# the Flask test client. Reports the throughput and the p50/p95/p99 latencies of every operation as JSON, so that the
+# results of two releases can be diffed.
+#
+# $ python -m backend.benchmark.load_test --voters 10000 --fraud-rate 0.05 --duplicate-rate 0.02 --output load.json
+#
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import BallotStatus
+from backend.benchmark.utils import synthetic_voters, fresh_store
+
+COMMENTS = [
+    "",
+    "Public transportation matters to me.",
+    "Call me at 329 112-4535 or mail me at someone@example.com",
+]
+
+
+def percentile(sorted_latencies: Sequence[float], fraction: float) -> float:
+    """
+    The nearest-rank percentile of latencies sorted in increasing order
+    """
+    if not sorted_latencies:
+        return 0.0
+    rank = max(0, min(len(sorted_latencies) - 1, int(round(fraction * len(sorted_latencies) + 0.5)) - 1))
+    return sorted_latencies[rank]
+
+
+def measure(operation: Callable, items: Sequence, concurrency: int = 1) -> Tuple[Dict, List]:
+    """
+    Calls `operation` once per item - from `concurrency` threads - and times every call.
+
+    :returns: The statistics of the calls, and their results in the order of the items
+    """
+    def timed_call(item):
+        started = time.perf_counter()
+        result = operation(item)
+        return result, time.perf_counter() - started
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timed_results = list(executor.map(timed_call, items))
+    else:
+        timed_results = [timed_call(item) for item in items]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in timed_results)
+    statistics = {
+        "count": len(items),
+        "ops_per_second": round(len(items) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+    }
+    return statistics, [result for result, _ in timed_results]
+
+
+def build_submissions(voters, ballot_numbers: List[str], candidate_ids: List[str], fraud_rate: float,
+                      duplicate_rate: float, rng: random.Random) -> List[Tuple[Ballot, str]]:
+    """
+    One ballot per voter, plus a second, freshly issued ballot for `fraud_rate` of the voters and a resubmission of
+    the same ballot for `duplicate_rate` of them. The extra submissions come after the first ones, in random order,
+    and are all expected to be reported as fraud.
+    """
+    first_submissions = [(Ballot(ballot_number, rng.choice(candidate_ids), rng.choice(COMMENTS)), voter.national_id)
+                         for voter, ballot_number in zip(voters, ballot_numbers)]
+    fraudsters = rng.sample(voters, int(len(voters) * fraud_rate))
+    fraud_ballot_numbers = balloting.issue_ballots([voter.national_id for voter in fraudsters])
+    extra_submissions = [(Ballot(ballot_number, rng.choice(candidate_ids), "Voting again"), voter.national_id)
+                         for voter, ballot_number in zip(fraudsters, fraud_ballot_numbers)]
+    extra_submissions.extend(rng.sample(first_submissions, int(len(voters) * duplicate_rate)))
+    rng.shuffle(first_submissions)
+    rng.shuffle(extra_submissions)
+    return first_submissions + extra_submissions
+
+
+def run_election(interface: str, cast: Callable[[Tuple[Ballot, str]], BallotStatus], args) -> Dict:
+    """
+    Runs one full election on a fresh store, casting the votes through `cast`
+    """
+    rng = random.Random(args.seed)
+    fresh_store(args.database)
+    for candidate_number in range(args.candidates):
+        registry.register_candidate("Candidate {0}".format(candidate_number))
+    candidate_ids = [candidate.candidate_id for candidate in registry.get_all_candidates()]
+    voters = synthetic_voters(args.voters)
+
+    operations = {}
+    operations["register_voter"], _ = measure(registry.register_voter, voters, args.concurrency)
+    operations["issue_ballot"], ballot_numbers = measure(
+        lambda voter: balloting.issue_ballot(voter.national_id), voters, args.concurrency)
+    submissions = build_submissions(voters, ballot_numbers, candidate_ids, args.fraud_rate, args.duplicate_rate, rng)
+    operations["count_ballot"], statuses = measure(cast, submissions, args.concurrency)
+    operations["compute_election_winner"], _ = measure(
+        lambda _: balloting.compute_election_winner(), range(args.queries), args.concurrency)
+    operations["get_all_fraudulent_voters"], _ = measure(
+        lambda _: balloting.get_all_fraudulent_voters(), range(args.queries), args.concurrency)
+
+    return {
+        "interface": interface,
+        "operations": operations,
+        "ballot_statuses": dict(sorted(Counter(str(status) for status in statuses).items())),
+    }
+
+
+def flask_cast(client):
+    def cast(submission: Tuple[Ballot, str]) -> str:
+        ballot, voter_national_id = submission
+        response = client.post("/api/count_ballot", json={
+            "ballot_number": ballot.ballot_number,
+            "chosen_candidate_id": ballot.chosen_candidate_id,
+            "voter_comments": ballot.voter_comments,
+            "voter_national_id": voter_national_id,
+        })
+        return json.loads(response.get_json()["status"])
+    return cast
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-tests the voting backend and reports throughput and latencies")
+    parser.add_argument("--voters", type=int, default=10000)
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument("--fraud-rate", type=float, default=0.05,
+                        help="share of voters who cast a second ballot, which must be caught as fraud")
+    parser.add_argument("--duplicate-rate", type=float, default=0.02,
+                        help="share of voters whose ballot is submitted twice")
+    parser.add_argument("--queries", type=int, default=200, help="number of each read-only query to run")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of threads calling each operation")
+    parser.add_argument("--interfaces", nargs="+", choices=["api", "flask"], default=["api", "flask"])
+    parser.add_argument("--database", help="sqlite file to run on (deleted first); in memory if not given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON results to; printed if not given")
+    args = parser.parse_args()
+
+    elections = []
+    if "api" in args.interfaces:
+        elections.append(run_election("api", lambda submission: balloting.count_ballot(*submission).value, args))
+    if "flask" in args.interfaces:
+        # Imported here: importing the Flask app populates the store of its process
+        from backend.main.api.backend_rest_api import app
+        elections.append(run_election("flask", flask_cast(app.test_client()), args))
+
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "parameters": {name: value for name, value in vars(args).items() if name != "output"},
+        "elections": elections,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#
+# Measures VotingStore lookup latency as the electorate grows, with and without the schema indexes.
+# With the indexes in place, latency should stay flat from 10k to 10M voters.
+#
+# $ python -m backend.benchmark.lookup_scaling_benchmark --sizes 10000 100000 1000000
+# $ python -m backend.benchmark.lookup_scaling_benchmark --sizes 10000000 --database /tmp/lookup_scaling.db
+#
+# 10M voters with their ballots take several GB as an in-memory database, so that size is meant to run on a file.
+#
+
+import argparse
+import random
+import time
+
+from backend.benchmark.utils import fresh_store
+from backend.main.objects.ballot import ballot_number_lookup_key
+from backend.main.objects.national_id import national_id_lookup_key
+from backend.main.store.data_registry import VotingStore
+
+INDEXES = ["voter_national_id_idx", "voter_lookup_key_idx", "voter_status_idx", "ballot_key_idx",
+           "ballot_voter_lookup_key_cast_idx"]
+
+
+def populate(store: VotingStore, voter_count: int, batch_size: int = 100000):
+    """
+    Inserts `voter_count` voters with one ballot each, straight through SQL so that set-up time stays reasonable.
+    """
+    for start in range(0, voter_count, batch_size):
+        ids = ["{0:09d}".format(i) for i in range(start, min(start + batch_size, voter_count))]
+        with store._transaction() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO voter (first_name, last_name, national_id, lookup_key, status) VALUES ('F', 'L', ?, ?, 'x')
+                """,
+                ((national_id, national_id_lookup_key(national_id)) for national_id in ids))
+            cursor.executemany(
+                """
+                INSERT INTO ballot (ballot_number, ballot_key, voter_national_id, voter_lookup_key) VALUES (?, ?, ?, ?)
+                """,
+                (("ballot-" + national_id, ballot_number_lookup_key("ballot-" + national_id),
+                  national_id, national_id_lookup_key(national_id)) for national_id in ids))
+
+
+def mean_latency_us(operation, keys) -> float:
+    started = time.perf_counter()
+    for key in keys:
+        operation(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def measure(store: VotingStore, voter_count: int, lookups: int) -> dict:
+    keys = ["{0:09d}".format(random.randrange(voter_count)) for _ in range(lookups)]
+    return {
+        "get_voter": mean_latency_us(store.get_voter, keys),
+        "count_casted_ballot": mean_latency_us(store.count_casted_ballot, keys),
+        "is_existed_ballot": mean_latency_us(lambda key: store.is_existed_ballot("ballot-" + key), keys),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks VotingStore lookup latency against electorate size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--without-indexes", action="store_true",
+                        help="also measure with the indexes dropped (full table scans; slow on large sizes)")
+    parser.add_argument("--database", help="sqlite file to benchmark against (deleted first); in memory by default")
+    args = parser.parse_args()
+
+    print("{0:>10} {1:>10} {2:>16} {3:>20} {4:>18}".format(
+        "voters", "indexes", "get_voter us", "count_casted us", "is_existed us"))
+    for size in args.sizes:
+        store = fresh_store(args.database)
+        populate(store, size)
+        variants = [("yes", args.lookups)]
+        if args.without_indexes:
+            variants.append(("no", max(10, args.lookups // 100)))
+        for label, lookups in variants:
+            if label == "no":
+                for index in INDEXES:
+                    store.connection.execute("DROP INDEX {0}".format(index))
+            result = measure(store, size, lookups)
+            print("{0:>10} {1:>10} {2:>16.1f} {3:>20.1f} {4:>18.1f}".format(
+                size, label, result["get_voter"], result["count_casted_ballot"], result["is_existed_ballot"]))
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
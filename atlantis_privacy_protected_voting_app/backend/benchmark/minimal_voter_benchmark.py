@@ -0,0 +1,50 @@
+#
+# Benchmark for converting Voter objects to MinimalVoter objects: one AES.new(..., MODE_EAX) per name, as before
+# NameCipher, against get_minimal_voter and the batch get_minimal_voters.
+#
+# $ python -m backend.benchmark.minimal_voter_benchmark --voters 100000
+#
+
+import argparse
+import time
+from base64 import b64encode
+
+from Cryptodome.Cipher import AES
+
+from backend.benchmark.utils import synthetic_voters
+from backend.main.objects.voter import MinimalVoter, NAME_ENCRYPTION_KEY, get_minimal_voters, obfuscate_national_id
+
+
+def original_encrypt_name(name: str) -> str:
+    cipher = AES.new(NAME_ENCRYPTION_KEY, mode=AES.MODE_EAX)
+    ciphertext, tag = cipher.encrypt_and_digest(name.encode("utf-8"))
+    return b64encode(cipher.nonce + tag + ciphertext).decode("utf-8")
+
+
+def original_get_minimal_voter(voter) -> MinimalVoter:
+    return MinimalVoter(
+        original_encrypt_name(voter.first_name.strip()),
+        original_encrypt_name(voter.last_name.strip()),
+        obfuscate_national_id(voter.national_id))
+
+
+def timed(label: str, convert, voters):
+    started = time.perf_counter()
+    convert(voters)
+    elapsed = time.perf_counter() - started
+    print("{0:<40} {1:>10.2f} s {2:>14.0f} voters/s".format(label, elapsed, len(voters) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the conversion of voters to minimal voters")
+    parser.add_argument("--voters", type=int, default=100000)
+    args = parser.parse_args()
+
+    voters = synthetic_voters(args.voters)
+    timed("AES.new per name", lambda batch: [original_get_minimal_voter(voter) for voter in batch], voters)
+    timed("get_minimal_voter", lambda batch: [voter.get_minimal_voter() for voter in batch], voters)
+    timed("get_minimal_voters", get_minimal_voters, voters)
+
+
+if __name__ == "__main__":
+    main()
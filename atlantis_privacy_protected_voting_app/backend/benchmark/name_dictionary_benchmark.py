@@ -0,0 +1,54 @@
+#
+# Shows that matching a comment against a NameDictionary takes the same time whatever the number of names in it, and
+# how long building and updating the dictionary takes.
+#
+# $ python -m backend.benchmark.name_dictionary_benchmark --sizes 1000 100000 1000000
+#
+
+import argparse
+import random
+import string
+import time
+
+from backend.main.detection.name_dictionary import NameDictionary
+from backend.benchmark.redaction_benchmark import comment_corpus
+
+
+def random_name(rng: random.Random) -> str:
+    return rng.choice(string.ascii_uppercase) + "".join(rng.choice(string.ascii_lowercase)
+                                                        for _ in range(rng.randint(3, 9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Aho-Corasick name dictionary")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--comments", type=int, default=5000)
+    args = parser.parse_args()
+    rng = random.Random(11)
+    comments = [record[0] for record in comment_corpus(args.comments, 1000)]
+
+    print("{0:>10} {1:>12} {2:>14} {3:>18}".format("names", "build s", "add name us", "match comment us"))
+    for size in args.sizes:
+        names = [random_name(rng) for _ in range(size)]
+        name_dictionary = NameDictionary()
+        started = time.perf_counter()
+        for name in names:
+            name_dictionary.add(name)
+        name_dictionary.find_all("")
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for name in names[:1000]:
+            name_dictionary.add(name + "x")
+        name_dictionary.find_all("")
+        add = (time.perf_counter() - started) / 1000 * 1e6
+
+        started = time.perf_counter()
+        for comment in comments:
+            name_dictionary.find_all(comment)
+        match = (time.perf_counter() - started) / len(comments) * 1e6
+        print("{0:>10} {1:>12.2f} {2:>14.1f} {3:>18.1f}".format(size, build, add, match))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#
+# Sustained load test for name encryption: encrypts and decrypts names in rounds and reports the peak resident memory
+# of the process after each round, which should stay flat.
+#
+# $ python -m backend.benchmark.name_encryption_benchmark --rounds 5 --names 100000
+#
+
+import argparse
+import resource
+import time
+
+from backend.main.objects.voter import encrypt_name, decrypt_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-tests name encryption for memory growth")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--names", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("{0:>6} {1:>14} {2:>16}".format("round", "names/s", "peak RSS KiB"))
+    for round_number in range(1, args.rounds + 1):
+        started = time.perf_counter()
+        for i in range(args.names):
+            assert decrypt_name(encrypt_name("Name{0}".format(i))) == "Name{0}".format(i)
+        rate = args.names / (time.perf_counter() - started)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("{0:>6} {1:>14.0f} {2:>16}".format(round_number, rate, peak_rss))
+
+
+if __name__ == "__main__":
+    main()
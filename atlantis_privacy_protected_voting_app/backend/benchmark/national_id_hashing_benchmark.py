@@ -0,0 +1,56 @@
+#
+# Measures the cost of national ID hashing: bulk registration without hashing, with bcrypt in the registering thread and
+# with bcrypt on a process pool, and the per-voter lookup that count_ballot pays - the keyed hash - against bcrypt.
+#
+# $ python -m backend.benchmark.national_id_hashing_benchmark --voters 2000 --rounds 8 --processes 4
+#
+
+import argparse
+import time
+
+import backend.main.api.registry as registry
+from backend.benchmark.utils import fresh_store, synthetic_voters, ops_per_second
+from backend.main.objects.national_id import national_id_lookup_key
+
+
+def register_all(voters, rounds, processes) -> float:
+    fresh_store()
+    if rounds:
+        registry.enable_national_id_hashing(rounds, processes)
+    try:
+        started = time.perf_counter()
+        assert all(registry.register_voters(voters, chunk_size=1000))
+        return len(voters) / (time.perf_counter() - started)
+    finally:
+        registry.disable_national_id_hashing()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks registration with bcrypt-hashed national IDs")
+    parser.add_argument("--voters", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+    voters = synthetic_voters(args.voters)
+    national_ids = [voter.national_id for voter in voters]
+
+    results = [
+        ("no hashing", register_all(voters, None, None)),
+        ("bcrypt, in thread", register_all(voters, args.rounds, None)),
+        ("bcrypt, {0} processes".format(args.processes), register_all(voters, args.rounds, args.processes)),
+    ]
+    print("voters: {0}, bcrypt rounds: {1}".format(args.voters, args.rounds))
+    for label, rate in results:
+        print("{0:<24} {1:10,.0f} registrations/s".format(label, rate))
+
+    hasher = registry.enable_national_id_hashing(args.rounds)
+    national_id_hash = hasher.hash(national_ids[0])
+    lookup_rate = ops_per_second(national_id_lookup_key, national_ids)
+    verify_rate = ops_per_second(lambda national_id: hasher.verify(national_id, national_id_hash), national_ids[:100])
+    registry.disable_national_id_hashing()
+    print("per-vote lookup key      {0:10.2f} us".format(1e6 / lookup_rate))
+    print("bcrypt verify            {0:10.2f} us".format(1e6 / verify_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#
+# Compares the single-pass redaction engine in pii_detection with the original five re.sub passes, over a corpus of
+# synthetic but realistic ballot comments. Also checks that both produce the same output.
+#
+# $ python -m backend.benchmark.redaction_benchmark --comments 20000 --voters 2000
+#
+
+import argparse
+import random
+import re
+import time
+
+from backend.main.detection.pii_detection import redact_free_text
+
+FIRST_NAMES = ["Adam", "Thien", "Neel", "Linda", "Shoujit", "Kathryn", "Aditya", "Rina", "Maia", "Hugo", "Courtney"]
+LAST_NAMES = ["Farfán", "Smith", "Huynh", "Banerjee", "Qi", "Gande", "Collins", "Guha", "Harvey", "Kift", "Jennings",
+              "Yu"]
+
+TEMPLATES = [
+    "Public transportation matters to me. It takes me 90 minutes to get to work each day.",
+    "Hi, I'm {first} {last}. Reach me at {phone} or {email} if you want to talk about schools.",
+    "Please fix the roads near my house! - {first}",
+    "My ID is {national_id}, I want to make sure my vote is counted. Thanks, {last}",
+    "Call {phone} after 6pm. {first} {last}, district 9.",
+    "",
+    "Lower taxes and more parks. Contact: {email}",
+    "I voted for the first time this year and it was easy. Cheers, {first} {last} ({national_id})",
+]
+
+
+def original_redact_free_text(free_text: str, first_name_voter: str, last_name_voter: str, national_id: str) -> str:
+    """
+    The original implementation of redact_free_text, kept here as the baseline.
+    """
+    free_text = re.sub(r"\b\S+@\S+.\S+\b", "[REDACTED EMAIL]", free_text)
+    free_text = re.sub(last_name_voter, "[REDACTED NAME]", free_text, flags=re.IGNORECASE)
+    free_text = re.sub(first_name_voter, "[REDACTED NAME]", free_text, flags=re.IGNORECASE)
+    free_text = re.sub(r"\(?\d{3}(\) | |-)?\d{3}-?\d{4}", "[REDACTED PHONE NUMBER]", free_text)
+    return re.sub(r"\d{3}(-| )?\d{2}(-| )?\d+", "[REDACTED NATIONAL ID]", free_text)
+
+
+def comment_corpus(comment_count: int, voter_count: int, seed: int = 7) -> list:
+    """
+    Returns (comment, first_name, last_name, national_id) records for `voter_count` distinct voters
+    """
+    rng = random.Random(seed)
+    voters = [(rng.choice(FIRST_NAMES) + str(i), rng.choice(LAST_NAMES) + str(i), "{0:09d}".format(i))
+              for i in range(voter_count)]
+    corpus = []
+    for _ in range(comment_count):
+        first, last, national_id = rng.choice(voters)
+        formatted_national_id = "{0}-{1}-{2}".format(national_id[:3], national_id[3:5], national_id[5:])
+        comment = rng.choice(TEMPLATES).format(
+            first=first, last=last, national_id=formatted_national_id,
+            phone="({0}) {1}-{2}".format(rng.randint(200, 999), rng.randint(200, 999), rng.randint(1000, 9999)),
+            email="{0}.{1}@atlantisnet.co.atlantis".format(first.lower(), last.lower()))
+        corpus.append((comment, first, last, national_id))
+    return corpus
+
+
+def comments_per_second(redact, corpus) -> float:
+    started = time.perf_counter()
+    for record in corpus:
+        redact(*record)
+    return len(corpus) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ballot comment redaction")
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--voters", type=int, default=2000)
+    args = parser.parse_args()
+    corpus = comment_corpus(args.comments, args.voters)
+
+    mismatches = sum(1 for record in corpus if redact_free_text(*record) != original_redact_free_text(*record))
+    before = comments_per_second(original_redact_free_text, corpus)
+    after = comments_per_second(redact_free_text, corpus)
+
+    print("comments: {0}, distinct voters: {1}, outputs that differ: {2}".format(
+        args.comments, args.voters, mismatches))
+    print("five re.sub passes: {0:10.0f} comments/s".format(before))
+    print("single-pass engine: {0:10.0f} comments/s ({1:.1f}x)".format(after, after / before))
+
+
+if __name__ == "__main__":
+    main()
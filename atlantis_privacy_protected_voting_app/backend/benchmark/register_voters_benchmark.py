@@ -0,0 +1,37 @@
+#
+# Compares registering voters one at a time through registry.register_voter with the bulk registry.register_voters.
+#
+# $ python -m backend.benchmark.register_voters_benchmark --voters 200000 [--database /tmp/voting.db]
+#
+
+import argparse
+import time
+
+import backend.main.api.registry as registry
+from backend.benchmark.utils import synthetic_voters, ops_per_second, fresh_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks single and bulk voter registration")
+    parser.add_argument("--voters", type=int, default=200000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--database", help="sqlite file to benchmark against (deleted first); in memory by default")
+    args = parser.parse_args()
+    voters = synthetic_voters(args.voters)
+
+    fresh_store(args.database)
+    single = ops_per_second(registry.register_voter, voters)
+
+    fresh_store(args.database)
+    started = time.perf_counter()
+    results = registry.register_voters(iter(voters), chunk_size=args.chunk_size)
+    bulk = len(results) / (time.perf_counter() - started)
+    assert all(results)
+
+    print("voters: {0}".format(args.voters))
+    print("register_voter:  {0:10.0f} voters/s".format(single))
+    print("register_voters: {0:10.0f} voters/s ({1:.1f}x)".format(bulk, bulk / single))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#
+# Measures the serialization of the REST API responses: jsons, which reflects over every object, against the
+# schema-driven serializers of backend.main.api.serializers, which write out the same bytes.
+#
+# $ python -m backend.benchmark.serializers_benchmark --candidates 8 1000 --repetitions 2000
+#
+
+import argparse
+import time
+
+import jsons
+
+from backend.main.api.serializers import serialize_ballot_status, serialize_candidates
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import BallotStatus
+
+
+def mean_latency_us(operation, repetitions: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        operation()
+    return (time.perf_counter() - started) / repetitions * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the API response serializers against jsons")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[8, 1000])
+    parser.add_argument("--repetitions", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("{0:>30} {1:>12} {2:>14} {3:>10}".format("response", "jsons us", "serializer us", "speedup"))
+    for candidate_count in args.candidates:
+        candidates = [Candidate(str(i), "Candidate Número {0}".format(i)) for i in range(1, candidate_count + 1)]
+        assert serialize_candidates(candidates) == jsons.dumps(candidates)
+        jsons_us = mean_latency_us(lambda: jsons.dumps(candidates), args.repetitions)
+        serializer_us = mean_latency_us(lambda: serialize_candidates(candidates), args.repetitions)
+        print("{0:>30} {1:>12.1f} {2:>14.1f} {3:>9.1f}x".format(
+            "{0} candidates".format(candidate_count), jsons_us, serializer_us, jsons_us / serializer_us))
+
+    status = BallotStatus.BALLOT_COUNTED
+    jsons_us = mean_latency_us(lambda: jsons.dumps(status.value), args.repetitions)
+    serializer_us = mean_latency_us(lambda: serialize_ballot_status(status), args.repetitions)
+    print("{0:>30} {1:>12.1f} {2:>14.1f} {3:>9.1f}x".format(
+        "count_ballot status", jsons_us, serializer_us, jsons_us / serializer_us))
+
+
+if __name__ == "__main__":
+    main()
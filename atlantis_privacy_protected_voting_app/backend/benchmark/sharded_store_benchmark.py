@@ -0,0 +1,67 @@
+#
+# Measures the throughput of counting ballots from many threads against the number of shards of the store. Each shard
+# is its own database file with its own write lock, so ballots of voters on different shards are committed in
+# parallel. Most telling with --synchronous FULL, where every commit waits for an fsync.
+#
+# $ python -m backend.benchmark.sharded_store_benchmark --voters 20000 --shards 1 2 4 8 --database /tmp/voting.db
+#
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.store.connection_manager import FILE_DATABASE_PRAGMAS
+from backend.benchmark.utils import synthetic_voters, fresh_store
+
+
+def prepare_election(voter_count: int, database: str, shards: int):
+    """
+    Creates a fresh store with `shards` shards and returns (Ballot, national_id) pairs, one freshly issued ballot per
+    registered voter.
+    """
+    fresh_store(database, shards)
+    registry.register_candidate("Kathryn Collins")
+    candidate_id = registry.get_all_candidates()[0].candidate_id
+    voters = synthetic_voters(voter_count)
+    registry.register_voters(voters)
+    ballot_numbers = balloting.issue_ballots([voter.national_id for voter in voters])
+    return [(Ballot(ballot_number, candidate_id, "Public transportation matters to me."), voter.national_id)
+            for voter, ballot_number in zip(voters, ballot_numbers)]
+
+
+def timed_per_second(operation, items, threads: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(operation, items))
+    return len(items) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks ballot counting against the number of store shards")
+    parser.add_argument("--voters", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--database", help="sqlite file to run on (deleted first); in memory if not given")
+    parser.add_argument("--synchronous", default=FILE_DATABASE_PRAGMAS["synchronous"],
+                        help="PRAGMA synchronous of the database files: FULL syncs the WAL to disk on every commit")
+    args = parser.parse_args()
+    FILE_DATABASE_PRAGMAS["synchronous"] = args.synchronous
+
+    print("voters: {0}, threads: {1}, database: {2}, synchronous: {3}".format(
+        args.voters, args.threads, args.database or "memory", args.synchronous))
+    print("{0:>8} {1:>16} {2:>16} {3:>16}".format("shards", "count votes/s", "status reads/s", "standings/s"))
+    for shards in args.shards:
+        submissions = prepare_election(args.voters, args.database, shards)
+        votes = timed_per_second(lambda submission: balloting.count_ballot(*submission), submissions, args.threads)
+        reads = timed_per_second(lambda submission: registry.get_voter_status(submission[1]), submissions,
+                                 args.threads)
+        standings = timed_per_second(lambda _: balloting.get_election_standings(), range(1000), args.threads)
+        print("{0:>8} {1:>16.0f} {2:>16.0f} {3:>16.0f}".format(shards, votes, reads, standings))
+    fresh_store()
+
+
+if __name__ == "__main__":
+    main()
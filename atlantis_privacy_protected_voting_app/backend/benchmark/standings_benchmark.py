@@ -0,0 +1,62 @@
+#
+# Measures the latency of the election standings - what result dashboards poll - as the number of counted ballots
+# grows: the live tally against the full GROUP BY scan of the ballots that it replaced.
+#
+# $ python -m backend.benchmark.standings_benchmark --sizes 10000 100000 1000000
+#
+
+import argparse
+import random
+import time
+
+from backend.main.store.data_registry import VotingStore
+
+
+def populate(store: VotingStore, ballot_count: int, candidate_count: int, batch_size: int = 100000):
+    """
+    Inserts `ballot_count` counted ballots straight through SQL, then rebuilds the tally from them.
+    """
+    for candidate_number in range(candidate_count):
+        store.add_candidate("Candidate {0}".format(candidate_number))
+    for start in range(0, ballot_count, batch_size):
+        with store._transaction() as cursor:
+            cursor.executemany(
+                """INSERT INTO ballot (ballot_number, chosen_candidate_id, is_used) VALUES (?, ?, true)""",
+                (("ballot-{0}".format(i), str(random.randint(1, candidate_count)))
+                 for i in range(start, min(start + batch_size, ballot_count))))
+    store.reconcile_tally()
+
+
+def mean_latency_us(operation, repetitions: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        operation()
+    return (time.perf_counter() - started) / repetitions * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the election standings against the number of ballots")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{0:>10} {1:>18} {2:>18} {3:>18}".format("ballots", "full scan us", "tally us", "standings us"))
+    for size in args.sizes:
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        populate(store, size, args.candidates)
+
+        def full_scan():
+            with store._reading() as cursor:
+                VotingStore._count_votes(cursor)
+
+        print("{0:>10} {1:>18.1f} {2:>18.1f} {3:>18.1f}".format(
+            size,
+            mean_latency_us(full_scan, args.repetitions),
+            mean_latency_us(store.get_most_voted, args.repetitions),
+            mean_latency_us(store.get_standings, args.repetitions)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#
+# Shared helpers for the benchmarks in this package. Run any benchmark from the directory that contains /backend, e.g.
+#
+# $ python -m backend.benchmark.count_ballot_benchmark --voters 5000
+#
+
+import os
+import time
+from typing import Callable, Iterable, List, Optional
+
+from backend.main.objects.voter import Voter
+from backend.main.store.data_registry import VotingStore, DATABASE_ENV_VARIABLE, SHARDS_ENV_VARIABLE, \
+    STORED_KEY_SECRET_NAMES
+from backend.main.store.secret_registry import KEY_RING, overwrite_secret_bytes
+from backend.main.store.sharded_store import shard_database
+
+
+def synthetic_voters(count: int, start: int = 0) -> List[Voter]:
+    """
+    Builds `count` distinct voters with 9-digit national IDs, starting at `start`.
+    """
+    return [Voter("First{0}".format(i), "Last{0}".format(i), "{0:09d}".format(i)) for i in range(start, start + count)]
+
+
+def ops_per_second(operation: Callable, items: Iterable) -> float:
+    """
+    Calls `operation` once per item and returns the sustained throughput in operations per second.
+    """
+    count = 0
+    started = time.perf_counter()
+    for item in items:
+        operation(item)
+        count += 1
+    elapsed = time.perf_counter() - started
+    return count / elapsed if elapsed > 0 else float("inf")
+
+
+def fresh_store(database: Optional[str] = None, shards: int = 1) -> VotingStore:
+    """
+    Replaces the VotingStore singleton with an empty store. With `database`, the store is backed by that sqlite file,
+    which is deleted first; otherwise it's in memory. With several `shards`, it's a ShardedVotingStore.
+
+    The benchmark's database doesn't outlive it, so the keys it generated are configured as they are, which a store on
+    a database file requires.
+    """
+    os.environ[SHARDS_ENV_VARIABLE] = str(shards)
+    if database:
+        for name in STORED_KEY_SECRET_NAMES:
+            overwrite_secret_bytes(KEY_RING.secret_name(name, KEY_RING.current_version(name)), KEY_RING.get_key(name))
+        database_files = [database] + [shard_database(database, shard_index) for shard_index in range(shards)]
+        for database_file in database_files:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(database_file + suffix):
+                    os.remove(database_file + suffix)
+        os.environ[DATABASE_ENV_VARIABLE] = database
+    VotingStore.refresh_instance()
+    return VotingStore.get_instance()
@@ -0,0 +1,222 @@
+#
+# This file is an asyncio (ASGI) variant of the REST API in backend_rest_api.py, serving the same routes. The event
+# loop only parses requests and writes responses: every call into the store runs on a bounded thread pool, and when
+# that pool and its queue are full new requests are turned away with a 503 straight away, instead of piling up and
+# dragging the latency of every in-flight ballot with them.
+#
+# It needs no web framework. To run it, use any ASGI server from the directory that contains /backend, e.g.
+#
+# $ pip install uvicorn
+# $ uvicorn backend.main.api.backend_asgi_api:app --port 5000
+#
+# The Flask entry point in backend_rest_api.py keeps working. This app doesn't populate the database: to serve the
+# same data from both, point VOTING_STORE_DATABASE at a sqlite file.
+#
+
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.api.serializers import serialize_comment_line, serialize_count_ballot_response
+from backend.main.objects.voter import BallotStatus
+from backend.main.objects.ballot import Ballot
+from backend.main.store.data_registry import VotingStore
+
+ALLOWED_ORIGIN_REGEX = re.compile(r"^http://(localhost|127\.0\.0\.1)(:\d+)?$")
+MAX_BODY_SIZE = 64 * 1024
+COMMENTS_PAGE_SIZE = 1000
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AsgiApi:
+    """
+    The ASGI application. Store work is handed to a pool of `max_workers` threads; at most `max_queued` more requests
+    may wait for a thread, and any request beyond that gets a 503 with a Retry-After header. The time a request can
+    spend queued is therefore bounded, which keeps the tail latency of the accepted requests predictable under load.
+    """
+
+    def __init__(self, max_workers: int = 16, max_queued: int = 1024):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asgi-store")
+        # Only touched from the event loop, so it needs no lock
+        self.in_flight = 0
+        self.rejected = 0
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ("GET", "/"): self.ping,
+            ("POST", "/api/count_ballot"): self.count_ballot,
+            ("GET", "/api/get_all_candidates"): self.get_all_candidates,
+            ("GET", "/api/get_all_ballot_comments"): self.get_all_ballot_comments,
+            ("GET", "/metrics"): self.metrics,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        headers = self.cors_headers(scope)
+        if scope["method"] == "OPTIONS":
+            await self.respond(send, 204, b"", "text/plain", headers + [
+                (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                (b"access-control-allow-headers", b"content-type"),
+            ])
+            return
+
+        handler = self.routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            status = 405 if any(path == scope["path"] for _, path in self.routes) else 404
+            await self.respond_json(send, status, {"error": "not found" if status == 404 else "method not allowed"},
+                                    headers)
+            return
+
+        # Backpressure: reject now rather than queue behind a backlog that can't be served in time
+        if self.in_flight >= self.max_workers + self.max_queued:
+            self.rejected += 1
+            await self.respond_json(send, 503, {"error": "server busy, please retry"},
+                                    headers + [(b"retry-after", b"1")])
+            return
+
+        self.in_flight += 1
+        try:
+            await handler(scope, receive, send, headers)
+        except HttpError as e:
+            await self.respond_json(send, e.status, {"error": e.message}, headers)
+        finally:
+            self.in_flight -= 1
+
+    async def run_in_store(self, function: Callable, *args):
+        """
+        Runs a blocking call into the store on the bounded thread pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def ping(self, scope, receive, send, headers):
+        await self.respond(send, 200, b"pong", "text/html; charset=utf-8", headers)
+
+    async def count_ballot(self, scope, receive, send, headers):
+        req_data = await self.read_json(receive)
+        try:
+            ballot = Ballot(req_data['ballot_number'], req_data['chosen_candidate_id'], req_data['voter_comments'])
+            voter_national_id = req_data['voter_national_id']
+        except (KeyError, TypeError) as e:
+            raise HttpError(400, "missing field {0}".format(e))
+
+        result = await self.run_in_store(balloting.count_ballot, ballot, voter_national_id)
+        await self.respond(send, 202 if result == BallotStatus.BALLOT_COUNTED else 409,
+                           serialize_count_ballot_response(result).encode("utf-8"), "application/json", headers)
+
+    async def get_all_candidates(self, scope, receive, send, headers):
+        body, etag = await self.run_in_store(registry.get_all_candidates_json)
+        headers = headers + [(b"etag", etag.encode("latin-1")), (b"cache-control", b"no-cache")]
+        if_none_match = dict(scope.get("headers", [])).get(b"if-none-match", b"").decode("latin-1")
+        client_etags = [tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")]
+        if etag in client_etags or "*" in client_etags:
+            await self.respond(send, 304, b"", "application/json", headers)
+            return
+        await self.respond(send, 200, body.encode("utf-8"), "application/json", headers)
+
+    async def metrics(self, scope, receive, send, headers):
+        store_metrics = VotingStore.get_instance().metrics
+        if store_metrics is None:
+            raise HttpError(404, "instrumentation is disabled")
+        await self.respond(send, 200, store_metrics.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4",
+                           headers)
+
+    async def get_all_ballot_comments(self, scope, receive, send, headers):
+        """
+        Streams the non-empty ballot comments as newline-delimited JSON, like the Flask endpoint of the same name. Each
+        page is read from the store on the thread pool, so the event loop never blocks on it.
+        """
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        try:
+            page_size = int(query.get("page_size", [COMMENTS_PAGE_SIZE])[0])
+        except ValueError:
+            page_size = COMMENTS_PAGE_SIZE
+        page_size = page_size if page_size > 0 else COMMENTS_PAGE_SIZE
+
+        comments = balloting.iter_all_ballot_comments(page_size)
+
+        def next_chunk() -> bytes:
+            return "".join(serialize_comment_line(comment) for comment in islice(comments, page_size)).encode("utf-8")
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")] + headers,
+        })
+        while True:
+            chunk = await self.run_in_store(next_chunk)
+            if not chunk:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    async def read_json(receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get("body", b""))
+            if len(body) > MAX_BODY_SIZE:
+                raise HttpError(413, "request body too large")
+            if not message.get("more_body", False):
+                break
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise HttpError(400, "the request body is not valid JSON")
+
+    @staticmethod
+    def cors_headers(scope) -> List[Tuple[bytes, bytes]]:
+        """
+        The same CORS policy as the Flask app: the frontend may call the API from localhost, on any port
+        """
+        if not scope["path"].startswith("/api/"):
+            return []
+        origin = dict(scope.get("headers", [])).get(b"origin")
+        if origin is None or not ALLOWED_ORIGIN_REGEX.match(origin.decode("latin-1")):
+            return []
+        return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+
+    @staticmethod
+    async def respond(send, status: int, body: bytes, content_type: str,
+                      headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode("latin-1")),
+                        (b"content-length", str(len(body)).encode("latin-1"))] + (headers or []),
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def respond_json(send, status: int, data, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        await AsgiApi.respond(send, status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+
+app = AsgiApi()
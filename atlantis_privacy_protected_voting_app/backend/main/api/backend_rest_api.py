@@ -7,14 +7,28 @@
 # $ export FLASK_APP=main/api/backend_rest_api.py
 # $ flask run
 #
+# The data is kept in memory unless VOTING_STORE_DATABASE points at a sqlite file, e.g.
+#
+# $ export VOTING_STORE_DATABASE=/var/lib/atlantis/voting.db
+#
+# The keys the data in that file is made with must then be configured too, as base64, or the store refuses to open it:
+#
+# $ export NATIONAL_ID_LOOKUP_KEY=$(head -c 32 /dev/urandom | base64)
+# $ export BALLOT_NUMBER_KEY=$(head -c 32 /dev/urandom | base64)
+#
+# Metrics of every store method and SQL statement are served at /metrics when VOTING_STORE_INSTRUMENTATION=1.
+#
 
-from flask import request
+from itertools import islice
+
+from flask import Response, request
 import backend.main.api.balloting as balloting
 import backend.main.api.registry as registry
 from backend.main.objects.voter import Voter, BallotStatus
 from backend.main.objects.ballot import Ballot
+from backend.main.api.serializers import serialize_ballot_status, serialize_comment_line
+from backend.main.store.data_registry import VotingStore, INSTRUMENTATION_ENV_VARIABLE
 from flask_api import FlaskAPI, status
-import jsons
 from flask_cors import CORS
 
 app = FlaskAPI(__name__)
@@ -36,13 +50,54 @@ def count_ballot():
 
     ballot = Ballot(ballot_number, chosen_candidate_id, voter_comments)
     result = balloting.count_ballot(ballot, voter_national_id)
-    return {"status": jsons.dumps(result.value)}, \
+    return {"status": serialize_ballot_status(result)}, \
         status.HTTP_202_ACCEPTED if result == BallotStatus.BALLOT_COUNTED else status.HTTP_409_CONFLICT
 
 
 @app.route('/api/get_all_candidates')
 def get_all_candidates():
-    return jsons.dumps(registry.get_all_candidates())
+    """
+    Serves the pre-serialized candidate list. Clients that send back its ETag in If-None-Match get a 304, and no
+    database work is done either way until a candidate is added.
+    """
+    body, etag = registry.get_all_candidates_json()
+    response = Response(status=304) if request.if_none_match.contains(etag.strip('"')) else \
+        Response(body, mimetype="application/json")
+    response.set_etag(etag.strip('"'))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route('/api/get_all_ballot_comments')
+def get_all_ballot_comments():
+    """
+    Streams the non-empty ballot comments as newline-delimited JSON, one JSON string per line, sent in chunks of
+    `page_size` lines (1000 by default), so the response never holds every comment in memory.
+    """
+    page_size = request.args.get('page_size', default=1000, type=int)
+    page_size = page_size if page_size and page_size > 0 else 1000
+
+    def ndjson_chunks():
+        comments = balloting.iter_all_ballot_comments(page_size)
+        while True:
+            lines = [serialize_comment_line(comment) for comment in islice(comments, page_size)]
+            if not lines:
+                return
+            yield "".join(lines)
+
+    return Response(ndjson_chunks(), mimetype="application/x-ndjson")
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    The metrics of the store in the Prometheus text format, when its instrumentation is enabled
+    """
+    store_metrics = VotingStore.get_instance().metrics
+    if store_metrics is None:
+        return Response("Instrumentation is disabled; set {0}=1 to enable it\n".format(INSTRUMENTATION_ENV_VARIABLE),
+                        status=404, mimetype="text/plain")
+    return Response(store_metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 def populate_database():
@@ -1,10 +1,17 @@
-from typing import Set, Optional
+from itertools import tee
+from typing import Iterable, Iterator, List, Set, Optional, Tuple
 
-from backend.main.objects.voter import Voter, BallotStatus, VoterStatus
+from backend.main.objects.voter import Voter, BallotStatus
 from backend.main.objects.candidate import Candidate
-from backend.main.objects.ballot import Ballot, generate_ballot_number
+from backend.main.objects.national_id import NationalId
+from backend.main.objects.ballot import Ballot, generate_ballot_number, generate_ballot_numbers, \
+    is_authentic_ballot_number, is_legacy_ballot_number
 from backend.main.store.data_registry import VotingStore
-from backend.main.detection.pii_detection import redact_free_text
+from backend.main.store.ballot_ingestion_queue import BallotIngestionQueue
+from backend.main.detection.pii_detection import redact_free_text, redact_many
+
+# When set, count_ballot hands ballots to this queue, see enable_ballot_ingestion_queue
+_ballot_ingestion_queue: Optional[BallotIngestionQueue] = None
 
 
 def issue_ballot(voter_national_id: str) -> Optional[str]:
@@ -16,6 +23,9 @@ def issue_ballot(voter_national_id: str) -> Optional[str]:
     :returns: The ballot number of the new ballot, or None if the voter isn't registered
     """
     try:
+        voter_national_id = NationalId.try_parse(voter_national_id)
+        if voter_national_id is None:
+            return None
         store = VotingStore.get_instance()
         isVoter = store.get_voter(voter_national_id)
         if isVoter is None:
@@ -27,6 +37,32 @@ def issue_ballot(voter_national_id: str) -> Optional[str]:
         raise e
 
 
+def issue_ballots(voter_national_ids: Iterable[str], processes: Optional[int] = None) -> List[Optional[str]]:
+    """
+    Issues a new ballot to each of the given voters, e.g. for mass issuance before the election. Registration is checked
+    with one set-based query, the ballot numbers are generated in batch (optionally on a pool of `processes`
+    processes), and all the ballots are written in one transaction. Like issue_ballot, this never invalidates old
+    ballots, and a voter that appears several times gets several ballots.
+
+    :params: voter_national_ids The sensitive IDs of the voters to issue new ballots to.
+    :params: processes The number of processes to generate the ballot numbers on. None generates them in this process.
+    :returns: One entry per national ID, in order: the ballot number of the new ballot, or None if that voter isn't
+              registered
+    """
+    try:
+        store = VotingStore.get_instance()
+        voter_national_ids = [NationalId.try_parse(national_id) for national_id in voter_national_ids]
+        registered = store.get_registered_national_ids(list(set(filter(None, voter_national_ids))))
+        to_issue = [national_id for national_id in voter_national_ids if national_id in registered]
+        ballot_numbers = iter(generate_ballot_numbers(to_issue, processes))
+        issued = [next(ballot_numbers) if national_id in registered else None for national_id in voter_national_ids]
+        store.add_ballots([(national_id, ballot_number)
+                           for national_id, ballot_number in zip(voter_national_ids, issued) if ballot_number])
+        return issued
+    except Exception as e:
+        raise e
+
+
 def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     """
     Validates and counts the ballot for the given voter. If the ballot contains a sensitive comment, this method will
@@ -44,43 +80,65 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     :returns: The Ballot Status after the ballot has been processed.
     """
     try:
-        store = VotingStore.get_instance()
-        # VOTER_NOT_REGISTERED
-        voter = store.get_voter(voter_national_id)
-        if voter is None:
+        voter_national_id = NationalId.try_parse(voter_national_id)
+        if voter_national_id is None:
             return BallotStatus.VOTER_NOT_REGISTERED
-        # VOTER_BALLOT_MISMATCH
-        is_ballot_to_voter = store.is_ballont_to_voter(
-            voter_national_id, 
-            ballot.ballot_number
-        )
-        if is_ballot_to_voter == 0:
-            return BallotStatus.VOTER_BALLOT_MISMATCH
-        # INVALID_BALLOT : is invalited
-        is_ballot_invalidated = store.is_invalitated_ballot(ballot.ballot_number)
-        if is_ballot_invalidated > 0:
-            return BallotStatus.INVALID_BALLOT
-        # INVALID_BALLOT : does not exist
-        is_existed_invalidated = store.is_existed_ballot(ballot.ballot_number)
-        if is_existed_invalidated == 0:
+        store = VotingStore.get_instance()
+        if not _might_exist(store, ballot.ballot_number):
             return BallotStatus.INVALID_BALLOT
-        # FRAUD_COMMITTED
-        cast_ballots =store.count_casted_ballot(voter_national_id)
-        if cast_ballots > 0:
-            store.update_status_voter(voter_national_id, str(VoterStatus.FRAUD_COMMITTED.value))
-            store.invalidated_ballot(ballot.ballot_number)
-            return BallotStatus.FRAUD_COMMITTED
-        # BALLOT_COUNTED
-        else:
-            store.update_status_voter(voter_national_id, str(VoterStatus.BALLOT_COUNTED.value))
-            store.validated_ballot(ballot.ballot_number)
-            redaction_comment = redact_free_text(ballot.voter_comments, voter.first_name, voter.last_name, voter.national_id )
-            store.update_content_ballot(ballot.ballot_number, ballot.chosen_candidate_id ,redaction_comment)
-            return BallotStatus.BALLOT_COUNTED
+        if _ballot_ingestion_queue is not None:
+            return _ballot_ingestion_queue.count_ballot(ballot, voter_national_id)
+        return store.cast_ballot(ballot, voter_national_id, _redact_comment)
     except Exception as e:
         raise e
 
 
+def _might_exist(store: VotingStore, ballot_number: str) -> bool:
+    """
+    Whether the ballot may exist. Forged and malformed ballot numbers are turned away by their tag, without any I/O;
+    then the store's in-process filter of the issued ballots turns away those it never issued, e.g. ones it deleted.
+    Numbers of the legacy, unauthenticated format can only be checked by the filter.
+    """
+    if not (is_authentic_ballot_number(ballot_number) or is_legacy_ballot_number(ballot_number)):
+        return False
+    return store.might_have_ballot(ballot_number)
+
+
+def enable_ballot_ingestion_queue(max_batch_size: int = 512, max_delay: float = 0.0) -> BallotIngestionQueue:
+    """
+    Switches count_ballot to the write-behind ingestion mode: ballots are handed to a single writer thread that counts
+    them in group-commit batches, and count_ballot returns once the batch of its ballot is committed. Meant for
+    servers with many concurrent requests.
+
+    :params: max_batch_size The most ballots committed together
+    :params: max_delay The most seconds the writer waits for more ballots once the queue is empty
+    :returns: The queue now used by count_ballot
+    """
+    global _ballot_ingestion_queue
+    disable_ballot_ingestion_queue()
+    _ballot_ingestion_queue = BallotIngestionQueue(_redact_comment, max_batch_size, max_delay)
+    return _ballot_ingestion_queue
+
+
+def disable_ballot_ingestion_queue():
+    """
+    Switches count_ballot back to counting each ballot in its own transaction, once every queued ballot is committed
+    """
+    global _ballot_ingestion_queue
+    ingestion_queue, _ballot_ingestion_queue = _ballot_ingestion_queue, None
+    if ingestion_queue is not None:
+        ingestion_queue.close()
+
+
+def _redact_comment(voter: Voter, comment: str) -> str:
+    """
+    Redacts the sensitive data of the given voter from a ballot comment, and the names of all registered voters if the
+    store keeps a name dictionary. Used by the store while counting a ballot.
+    """
+    return redact_free_text(comment, voter.first_name, voter.last_name, voter.national_id,
+                            VotingStore.get_instance().name_dictionary)
+
+
 def invalidate_ballot(ballot_number: str) -> bool:
     """
     Marks a ballot as invalid so that it cannot be used. This should only work on ballots that have NOT been cast. If a
@@ -93,6 +151,8 @@ def invalidate_ballot(ballot_number: str) -> bool:
     """
     try:
         store = VotingStore.get_instance()
+        if not _might_exist(store, ballot_number):
+            return False
         counting = store.is_invalitated_ballot(ballot_number)
         is_used = store.is_used_ballot(ballot_number)
 
@@ -120,7 +180,12 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
               invalid. Boolean False otherwise.
     """
     try:
+        voter_national_id = NationalId.try_parse(voter_national_id)
+        if voter_national_id is None:
+            return False
         store = VotingStore.get_instance()
+        if not _might_exist(store, ballot_number):
+            return False
         counting = store.count_specified_validated_ballot(voter_national_id, ballot_number)
 
         if counting > 0:
@@ -134,6 +199,36 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
     raise NotImplementedError()
 
 
+def redact_all_ballot_comments(processes: Optional[int] = None, chunk_size: int = 1000) -> int:
+    """
+    Runs the redaction rules again over every stored ballot comment, e.g. after the rules have changed - the same rules
+    as when counting, including the names of all registered voters if the store keeps a name dictionary. The comments
+    are streamed from the store and written back one chunk per transaction, so vote counting is never blocked for long.
+
+    :param: processes The number of processes to redact on. None redacts in this process.
+    :param: chunk_size The number of comments per redaction chunk and per write transaction
+    :returns: The number of comments that changed
+    """
+    try:
+        store = VotingStore.get_instance()
+        records, ballot_ids = tee(store.iter_comment_records(page_size=chunk_size))
+        redacted_comments = redact_many((record[1:] for record in records), chunk_size, processes,
+                                        store.name_dictionary)
+        updated = 0
+        changes = []
+        for (ballot_id, comment, *_), redacted_comment in zip(ballot_ids, redacted_comments):
+            if redacted_comment != comment:
+                changes.append((redacted_comment, ballot_id))
+            if len(changes) >= chunk_size:
+                store.update_comments(changes)
+                updated += len(changes)
+                changes = []
+        store.update_comments(changes)
+        return updated + len(changes)
+    except Exception as e:
+        raise e
+
+
 #
 # Aggregate API
 #
@@ -143,9 +238,22 @@ def get_all_ballot_comments() -> Set[str]:
     Returns a list of all the ballot comments that are non-empty.
     :returns: A list of all the ballot comments that are non-empty
     """
+    try:
+        return list(iter_all_ballot_comments())
+    except Exception as e:
+        raise e
+
+
+def iter_all_ballot_comments(page_size: int = 1000) -> Iterator[str]:
+    """
+    Streams all the ballot comments that are non-empty, reading them from the store one page at a time, so that an
+    export of millions of comments runs in constant memory.
+    :params: page_size The number of comments read from the store per query
+    :returns: A generator of the ballot comments that are non-empty
+    """
     try:
         store = VotingStore.get_instance()
-        return store.get_comments()
+        yield from store.iter_comments(page_size)
     except Exception as e:
         raise e
 
@@ -157,8 +265,20 @@ def compute_election_winner() -> Candidate:
     """
     try:
         store = VotingStore.get_instance()
-        candidates = store.get_most_voted()
-        return store.get_candidate(candidates[0][0])
+        standings = store.get_standings()
+        return standings[0][0]
+    except Exception as e:
+        raise e
+
+
+def get_election_standings() -> List[Tuple[Candidate, int]]:
+    """
+    Returns the current standings of the election, e.g. for the results dashboards, which poll it constantly.
+    :return: The (Candidate, votes) of every candidate that got votes, most voted first
+    """
+    try:
+        store = VotingStore.get_instance()
+        return store.get_standings()
     except Exception as e:
         raise e
 
@@ -178,7 +298,6 @@ def get_all_fraudulent_voters() -> Set[str]:
         rpta = list()
         for voter in voters:
             rpta.append( voter.first_name + " " + voter.last_name)
-        print(rpta)
         return rpta
     except Exception as e:
         raise e
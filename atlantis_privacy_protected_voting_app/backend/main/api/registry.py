@@ -2,11 +2,21 @@
 # This file is the internal-only API that allows for the population of the voter registry.
 # This API should not be exposed as a REST API for election security purposes.
 #
-from typing import List
+import hashlib
+import threading
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
+
 from backend.main.objects.voter import Voter, VoterStatus
 from backend.main.objects.candidate import Candidate
+from backend.main.objects.national_id import NationalId
+from backend.main.objects.national_id_hasher import NationalIdHasher, DEFAULT_ROUNDS
+from backend.main.api.serializers import serialize_candidates
 from backend.main.store.data_registry import VotingStore
 
+# When set, registration stores the bcrypt hash of every national ID, see enable_national_id_hashing
+_national_id_hasher: Optional[NationalIdHasher] = None
+
 #
 # Voter Registration
 #
@@ -20,20 +30,93 @@ def register_voter(voter: Voter) -> bool:
     :param: voter The voter to register.
     :returns: Boolean TRUE if the registration was successful. Boolean FALSE if the voter was already registered
               (based on their National ID)
+    :raises: ValueError if the National ID is invalid
     """
     # TODO: Implement this!
     try:
         store = VotingStore.get_instance()
-        national_id = voter.national_id.replace("-", "").replace(" ", "").strip()
+        national_id = NationalId.parse(voter.national_id)
         first_name = voter.first_name
         last_name = voter.last_name
         proxy_voter = Voter(first_name, last_name, national_id)
-        return store.add_voter(proxy_voter)
+        national_id_hash = None
+        if _national_id_hasher is not None and store.get_status_voter(national_id) is None:
+            national_id_hash = _national_id_hasher.hash(national_id)
+        return store.add_voter(proxy_voter, national_id_hash)
     except Exception as e:
         raise e
 
 
 
+def register_voters(voters: Iterable[Voter], chunk_size: int = 10000) -> List[bool]:
+    """
+    Registers many voters at once, e.g. when loading the national roll. The voters are streamed in chunks of
+    `chunk_size`, and each chunk is registered in a single transaction, so any iterable (including a generator) works
+    without holding the whole roll in memory.
+
+    :param: voters The voters to register.
+    :param: chunk_size The number of voters registered per transaction.
+    :returns: One Boolean per voter, in input order: TRUE if that voter was registered, FALSE if the voter was already
+              registered or appeared earlier in the input (based on their normalized National ID)
+    :raises: ValueError if a National ID is invalid. The chunks before the one holding it are registered.
+    """
+    try:
+        store = VotingStore.get_instance()
+        voters = iter(voters)
+        results = []
+        while True:
+            chunk = [
+                Voter(voter.first_name, voter.last_name, NationalId.parse(voter.national_id))
+                for voter in islice(voters, chunk_size)
+            ]
+            if not chunk:
+                return results
+            results.extend(store.add_voters(chunk, _hash_new_national_ids(store, chunk)))
+    except Exception as e:
+        raise e
+
+
+def _hash_new_national_ids(store: VotingStore, voters: List[Voter]) -> Optional[List[Optional[bytes]]]:
+    """
+    Hashes the national IDs of the voters that aren't registered yet, once per national ID, if national ID hashing is
+    enabled. This runs outside of the transaction that registers them, so that other writers aren't held up.
+
+    :returns: One hash per voter, in order, None for the voters already registered
+    """
+    if _national_id_hasher is None:
+        return None
+    registered = store.get_registered_national_ids(list({voter.national_id for voter in voters}))
+    new_national_ids = list(dict.fromkeys(voter.national_id for voter in voters if voter.national_id not in registered))
+    hashes = dict(zip(new_national_ids, _national_id_hasher.hash_many(new_national_ids)))
+    return [hashes.get(voter.national_id) for voter in voters]
+
+
+def enable_national_id_hashing(rounds: int = DEFAULT_ROUNDS, processes: Optional[int] = None) -> NationalIdHasher:
+    """
+    Makes registration store a salted, peppered bcrypt hash of every new voter's national ID, on a pool of `processes`
+    processes for register_voters. Voters are still looked up by the keyed hash of their national ID, so counting
+    ballots never pays for bcrypt.
+
+    :param: rounds The bcrypt work factor
+    :param: processes The number of processes to hash on. None hashes in the registering thread.
+    :returns: The hasher, e.g. to verify a national ID against the hash returned by VotingStore.get_national_id_hash
+    """
+    global _national_id_hasher
+    disable_national_id_hashing()
+    _national_id_hasher = NationalIdHasher(rounds, processes)
+    return _national_id_hasher
+
+
+def disable_national_id_hashing():
+    """
+    Stops hashing the national IDs of new voters, and shuts down the hasher's processes
+    """
+    global _national_id_hasher
+    if _national_id_hasher is not None:
+        _national_id_hasher.close()
+        _national_id_hasher = None
+
+
 def get_voter_status(voter_national_id: str) -> VoterStatus:
     """
     Checks to see if the specified voter is registered.
@@ -43,7 +126,10 @@ def get_voter_status(voter_national_id: str) -> VoterStatus:
     """
     try:
         store = VotingStore.get_instance()
-        status = store.get_status_voter(voter_national_id.replace("-", "").replace(" ", "").strip())
+        national_id = NationalId.try_parse(voter_national_id)
+        if national_id is None:
+            return VoterStatus.NOT_REGISTERED
+        status = store.get_status_voter(national_id)
         if status is None or str(VoterStatus.NOT_REGISTERED.value) == status:
             return VoterStatus.NOT_REGISTERED
         elif str(VoterStatus.BALLOT_COUNTED.value) == status:
@@ -70,7 +156,9 @@ def de_register_voter(voter_national_id: str) -> bool:
     """
     try:
         store = VotingStore.get_instance()
-        clean_national_id = voter_national_id.replace("-", "").replace(" ", "").strip()
+        clean_national_id = NationalId.try_parse(voter_national_id)
+        if clean_national_id is None:
+            return False
         status = store.get_status_voter(clean_national_id)
         if str(VoterStatus.FRAUD_COMMITTED.value) == status:
             return False
@@ -106,3 +194,28 @@ def candidate_is_registered(candidate: Candidate) -> bool:
 def get_all_candidates() -> List[Candidate]:
     store = VotingStore.get_instance()
     return store.get_all_candidates()
+
+
+# (store, candidates_version, body, etag) of the last serialized candidate list
+_candidates_document = None
+_candidates_document_lock = threading.Lock()
+
+
+def get_all_candidates_json() -> Tuple[str, str]:
+    """
+    Returns the candidate list serialized as JSON, with an ETag for it. Both are computed once per version of the
+    candidate list, so serving them again costs neither a query nor a serialization.
+
+    :returns: The JSON body (the same as jsons.dumps(get_all_candidates())) and its quoted, strong ETag
+    """
+    global _candidates_document
+    store = VotingStore.get_instance()
+    document = _candidates_document
+    if document is not None and document[0] is store and document[1] == store.candidates_version:
+        return document[2], document[3]
+    with _candidates_document_lock:
+        version = store.candidates_version
+        body = serialize_candidates(store.get_all_candidates())
+        etag = '"{0}"'.format(hashlib.sha256(body.encode("utf-8")).hexdigest()[:32])
+        _candidates_document = (store, version, body, etag)
+    return body, etag
@@ -0,0 +1,65 @@
+#
+# This file contains the serializers of the REST API responses. Each one writes out a known schema directly, instead of
+# reflecting over the objects like jsons does, and produces exactly the same bytes as the jsons / json calls they
+# replace, so clients see no difference.
+#
+
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Any, Iterable
+
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import BallotStatus
+
+
+def _json_string(value: Any) -> str:
+    """
+    Encodes a field declared as a str the way jsons did for these objects before they had __slots__: None becomes null,
+    anything else is converted with str() and written as an ASCII-only JSON string. encode_basestring_ascii is the C
+    escaper json.dumps itself uses.
+    """
+    return "null" if value is None else encode_basestring_ascii(str(value))
+
+
+def serialize_candidate(candidate: Candidate) -> str:
+    """
+    :returns: The same JSON as jsons.dumps(candidate): the fields sorted by name, ", " and ": " as separators
+    """
+    return '{{"candidate_id": {0}, "name": {1}}}'.format(
+        _json_string(candidate.candidate_id), _json_string(candidate.name))
+
+
+def serialize_candidates(candidates: Iterable[Candidate]) -> str:
+    """
+    :returns: The same JSON as jsons.dumps(candidates) for a list of candidates
+    """
+    return "[" + ", ".join(serialize_candidate(candidate) for candidate in candidates) + "]"
+
+
+# jsons.dumps(status.value) for every status: the JSON string that count_ballot puts in its "status" field
+BALLOT_STATUS_JSON = {status: json.dumps(status.value) for status in BallotStatus}
+
+# The whole JSON body of a count_ballot response, {"status": jsons.dumps(status.value)}, for every status
+COUNT_BALLOT_RESPONSE_JSON = {status: json.dumps({"status": status_json})
+                              for status, status_json in BALLOT_STATUS_JSON.items()}
+
+
+def serialize_ballot_status(status: BallotStatus) -> str:
+    """
+    :returns: The same JSON as jsons.dumps(status.value)
+    """
+    return BALLOT_STATUS_JSON[status]
+
+
+def serialize_count_ballot_response(status: BallotStatus) -> str:
+    """
+    :returns: The JSON body of the count_ballot endpoint for this status
+    """
+    return COUNT_BALLOT_RESPONSE_JSON[status]
+
+
+def serialize_comment_line(comment: str) -> str:
+    """
+    :returns: The same line as json.dumps(comment) + "\\n", for the newline-delimited JSON comment export
+    """
+    return encode_basestring_ascii(comment) + "\n"
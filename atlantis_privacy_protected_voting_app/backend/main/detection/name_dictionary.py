@@ -0,0 +1,125 @@
+#
+# This file contains a dictionary of names that can find every one of its names in a text in a single pass
+#
+
+import re
+import threading
+from collections import Counter
+from typing import List, Tuple
+
+WORD_REGEX = re.compile(r"[^\W_]+")
+# The particles of compound names ("De La Cruz", "Van Der Berg"), which are also ordinary words: they are matched as
+# part of the whole name only, never on their own
+NAME_PARTICLES = frozenset([
+    "al", "bin", "da", "das", "de", "del", "della", "den", "der", "des", "di", "do", "dos", "du", "el", "la", "las",
+    "le", "les", "lo", "los", "mac", "mc", "san", "st", "ten", "ter", "van", "vom", "von", "y", "zu",
+])
+
+
+def _lower_keep_length(text: str) -> str:
+    """
+    Lower-cases the text one character at a time, leaving the characters whose lower case is longer untouched, so that
+    positions in the result are positions in the original text
+    """
+    lowered_text = text.lower()
+    if len(lowered_text) == len(text):
+        return lowered_text
+    return "".join(lowered if len(lowered) == 1 else character
+                   for character, lowered in ((character, character.lower()) for character in text))
+
+
+class NameDictionary:
+    """
+    A multi-pattern matcher over a set of names, used to find the names of every registered voter in a ballot comment.
+
+    Names are matched case-insensitively and only as whole words, so every match starts and ends on a word boundary of
+    the text. The text is split into words once, and at each word the dictionary - a hash table of lower-cased names -
+    is probed with the sequences of up to as many words as the longest name has, whatever separates those words.
+    Matching therefore takes time linear in the length of the text, no matter how many names are in the dictionary,
+    and adding or removing a name is a single hash table update, so the dictionary can follow every add_voter and
+    delete_voter.
+
+    A name that has several words (e.g. "Chicata Farfán") is added as a whole, and each of its words on its own, except
+    for the particles of NAME_PARTICLES: "De La Cruz" adds "de la cruz" and "cruz", but not "de" or "la". Names are
+    reference counted, so removing one of two voters with the same name keeps that name in the dictionary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._max_words = 1
+
+    def __getstate__(self) -> dict:
+        # Sent to worker processes without the lock, which can't be pickled
+        with self._lock:
+            return {"counts": Counter(self._counts), "max_words": self._max_words}
+
+    def __setstate__(self, state: dict):
+        self._lock = threading.Lock()
+        self._counts = state["counts"]
+        self._max_words = state["max_words"]
+
+    def __len__(self) -> int:
+        """
+        The number of distinct names in the dictionary
+        """
+        return len(self._counts)
+
+    @staticmethod
+    def _entries(name: str) -> List[Tuple[str, int]]:
+        """
+        The lower-cased entries for a name, with their number of words
+        """
+        words = WORD_REGEX.findall(_lower_keep_length(name))
+        if not words:
+            return []
+        entries = [(" ".join(words), len(words))]
+        if len(words) > 1:
+            entries.extend((word, 1) for word in words if len(word) > 1 and word not in NAME_PARTICLES)
+        return entries
+
+    def add(self, name: str):
+        """
+        Adds a name (and each of its words) to the dictionary
+        """
+        with self._lock:
+            for entry, word_count in NameDictionary._entries(name):
+                self._counts[entry] += 1
+                self._max_words = max(self._max_words, word_count)
+
+    def remove(self, name: str):
+        """
+        Removes one occurrence of a name (and of each of its words) from the dictionary
+        """
+        with self._lock:
+            for entry, _ in NameDictionary._entries(name):
+                if self._counts[entry] > 1:
+                    self._counts[entry] -= 1
+                else:
+                    self._counts.pop(entry, None)
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Finds the names in the text.
+
+        :param: text The text to search
+        :returns: The sorted (start, end) positions of the non-overlapping names found, preferring, among overlapping
+                  names, the one that starts first and then the longest one
+        """
+        lowered_text = _lower_keep_length(text)
+        words = [(match.start(), match.end()) for match in WORD_REGEX.finditer(lowered_text)]
+        counts, max_words = self._counts, self._max_words
+        matches = []
+        index = 0
+        while index < len(words):
+            start = words[index][0]
+            for last in range(min(index + max_words, len(words)) - 1, index - 1, -1):
+                # Multi-word names are stored with single spaces between their words, whatever separated them
+                candidate = " ".join(lowered_text[word_start:word_end]
+                                     for word_start, word_end in words[index:last + 1])
+                if candidate in counts:
+                    matches.append((start, words[last][1]))
+                    index = last
+                    break
+            index += 1
+        return matches
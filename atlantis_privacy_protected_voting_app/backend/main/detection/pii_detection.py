@@ -1,37 +1,189 @@
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Optional, Pattern, Tuple
 
-def redact_free_text(free_text: str, first_name_voter: str, last_name_voter: str, national_id: str) -> str:
+from backend.main.detection.name_dictionary import NameDictionary
+
+#
+# The sensitive data we redact, in order of precedence: when two kinds match at the same position, the first one wins.
+#
+EMAIL_REGEX = r"\b\S+@\S+.\S+\b"
+NAME_REGEX = r"(?i:{0})"
+PHONE_REGEX = r"\(?\d{3}(?:\) | |-)?\d{3}-?\d{4}"
+NATIONAL_ID_REGEX = r"\d{3}(?:-| )?\d{2}(?:-| )?\d+"
+
+# (free_text, first_name_voter, last_name_voter, national_id), the arguments of redact_free_text
+RedactionRecord = Tuple[str, str, str, str]
+
+REDACTIONS = {
+    "email": "[REDACTED EMAIL]",
+    "name": "[REDACTED NAME]",
+    "phone": "[REDACTED PHONE NUMBER]",
+    "national_id": "[REDACTED NATIONAL ID]",
+}
+
+
+def _build_redaction_regex(name_regex: Optional[str] = None) -> Pattern:
+    """
+    Combines the patterns into one alternation with a named group per kind of sensitive data, so that the text is
+    redacted in a single scan.
+    """
+    alternatives = ["(?P<email>{0})".format(EMAIL_REGEX)]
+    if name_regex:
+        alternatives.append("(?P<name>{0})".format(NAME_REGEX.format(name_regex)))
+    alternatives.append("(?P<phone>{0})".format(PHONE_REGEX))
+    alternatives.append("(?P<national_id>{0})".format(NATIONAL_ID_REGEX))
+    return re.compile("|".join(alternatives))
+
+
+FIXED_REDACTION_REGEX = _build_redaction_regex()
+
+
+@lru_cache(maxsize=1024)
+def _get_redaction_regex(first_name_voter: str, last_name_voter: str) -> Pattern:
+    """
+    Returns the compiled redaction regex for a voter, with the names as escaped literals, the last name first.
+    Only used for the rare text where lower-casing changes its length, so positions can't be mapped back.
+    """
+    return _build_redaction_regex("|".join(re.escape(name) for name in (last_name_voter, first_name_voter) if name))
+
+
+def _replace_match(match) -> str:
+    return REDACTIONS[match.lastgroup]
+
+
+def _find_name(lowered_text: str, lowered_names: List[str], name_spans: List[Tuple[int, int]],
+               position: int) -> Tuple[int, int]:
+    """
+    Returns the (start, end) of the leftmost name in the text from `position` on, or (-1, -1). The names are either
+    found as substrings, or given as sorted spans found by a NameDictionary. When several names start at the same
+    place, the one listed first wins, like in a regex alternation.
+    """
+    best_start, best_end = -1, -1
+    for name in lowered_names:
+        start = lowered_text.find(name, position)
+        if start != -1 and (best_start == -1 or start < best_start):
+            best_start, best_end = start, start + len(name)
+    span_index = bisect_left(name_spans, (position, -1))
+    if span_index < len(name_spans) and (best_start == -1 or name_spans[span_index][0] < best_start):
+        best_start, best_end = name_spans[span_index]
+    return best_start, best_end
+
+
+def _redact_with_literal_names(free_text: str, lowered_text: str, lowered_names: List[str],
+                               name_spans: List[Tuple[int, int]]) -> str:
+    """
+    Redacts the text in one left-to-right scan that merges the matches of FIXED_REDACTION_REGEX with the (case
+    insensitive) occurrences of the names, with the same precedence as the full alternation: leftmost match first, and
+    at the same position email, then name, then phone number, then national ID. This avoids compiling a regex per voter.
+    """
+    pieces = []
+    position = 0
+    match = FIXED_REDACTION_REGEX.search(free_text, position)
+    name_start, name_end = _find_name(lowered_text, lowered_names, name_spans, position)
+    while match is not None or name_start != -1:
+        if name_start != -1 and (match is None or name_start < match.start() or
+                                 (name_start == match.start() and match.lastgroup != "email")):
+            start, end, redaction = name_start, name_end, REDACTIONS["name"]
+        else:
+            start, end, redaction = match.start(), match.end(), REDACTIONS[match.lastgroup]
+        pieces.append(free_text[position:start])
+        pieces.append(redaction)
+        position = end
+        # Only look again for the kinds whose next match overlaps what was just redacted
+        if match is not None and match.start() < position:
+            match = FIXED_REDACTION_REGEX.search(free_text, position)
+        if name_start != -1 and name_start < position:
+            name_start, name_end = _find_name(lowered_text, lowered_names, name_spans, position)
+    pieces.append(free_text[position:])
+    return "".join(pieces)
+
+
+def redact_free_text(free_text: str, first_name_voter: str, last_name_voter: str, national_id: str,
+                     name_dictionary: Optional[NameDictionary] = None) -> str:
     """
     :param: free_text The free text to remove sensitive data from
+    :param: name_dictionary If given, every name in this dictionary (e.g. the names of all registered voters) is
+            redacted as well, on top of the voter's own names
     :returns: The redacted free text
     """
     try:
-        email_regex = r"\b\S+@\S+.\S+\b"
-        nation_id_regex = r"\d{3}(-| )?\d{2}(-| )?\d+"
-        phone_regex = r"\(?\d{3}(\) | |-)?\d{3}-?\d{4}"
-        free_text = re.sub(email_regex, "[REDACTED EMAIL]" , free_text)
-        free_text = re.sub(
-            last_name_voter,
-            "[REDACTED NAME]",
-            free_text,
-            flags=re.IGNORECASE
-        )
-        free_text = re.sub(
-            first_name_voter,
-            "[REDACTED NAME]",
-            free_text,
-            flags=re.IGNORECASE
-        )
-        free_text = re.sub(
-            phone_regex,
-            "[REDACTED PHONE NUMBER]",
-            free_text
-        )
-        free_text = re.sub(
-            nation_id_regex,
-            "[REDACTED NATIONAL ID]",
-            free_text
-        )
+        names = [name for name in (last_name_voter, first_name_voter) if name]
+        if not names and name_dictionary is None:
+            return FIXED_REDACTION_REGEX.sub(_replace_match, free_text)
+        lowered_text = free_text.lower()
+        lowered_names = [name.lower() for name in names]
+        if len(lowered_text) == len(free_text) and all(
+                len(lowered_name) == len(name) for lowered_name, name in zip(lowered_names, names)):
+            name_spans = name_dictionary.find_all(free_text) if name_dictionary is not None else []
+            return _redact_with_literal_names(free_text, lowered_text, lowered_names, name_spans)
+        free_text = _get_redaction_regex(first_name_voter, last_name_voter).sub(_replace_match, free_text)
+        if name_dictionary is not None:
+            free_text = _redact_spans(free_text, name_dictionary.find_all(free_text), REDACTIONS["name"])
         return free_text
     except Exception as e:
         raise e
+
+
+def _redact_spans(free_text: str, spans: List[Tuple[int, int]], redaction: str) -> str:
+    pieces = []
+    position = 0
+    for start, end in spans:
+        pieces.append(free_text[position:start])
+        pieces.append(redaction)
+        position = end
+    pieces.append(free_text[position:])
+    return "".join(pieces)
+
+
+def redact_many(records: Iterable[RedactionRecord], chunk_size: int = 1000,
+                processes: Optional[int] = None, name_dictionary: Optional[NameDictionary] = None) -> Iterator[str]:
+    """
+    Redacts many texts, e.g. a backlog of ballot comments. The records are consumed lazily, `chunk_size` at a time, so a
+    generator of any length can be passed in.
+
+    :param: records (free_text, first_name_voter, last_name_voter, national_id) tuples
+    :param: chunk_size The number of records handed to a worker process at a time
+    :param: processes If given, the chunks are redacted on a pool of this many processes. At most two chunks per process
+            are in flight at any time, so memory stays bounded.
+    :param: name_dictionary If given, every name in this dictionary is redacted from every text, as by redact_free_text.
+            It's sent to each worker process once, when the pool starts.
+    :returns: The redacted texts, in the same order as the records
+    """
+    records = iter(records)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    if not processes:
+        for chunk in chunks:
+            yield from _redact_chunk(chunk, name_dictionary)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_set_worker_name_dictionary,
+                             initargs=(name_dictionary,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_redact_chunk_in_worker, chunk))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+# The name dictionary of a redact_many worker process
+_worker_name_dictionary: Optional[NameDictionary] = None
+
+
+def _set_worker_name_dictionary(name_dictionary: Optional[NameDictionary]):
+    global _worker_name_dictionary
+    _worker_name_dictionary = name_dictionary
+
+
+def _redact_chunk_in_worker(records: List[RedactionRecord]) -> List[str]:
+    return _redact_chunk(records, _worker_name_dictionary)
+
+
+def _redact_chunk(records: List[RedactionRecord], name_dictionary: Optional[NameDictionary] = None) -> List[str]:
+    return [redact_free_text(*record, name_dictionary) for record in records]
@@ -1,19 +1,64 @@
-import uuid
-from Cryptodome.Cipher import AES
+import hashlib
+import hmac
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
 from Crypto.Random import get_random_bytes
-from base64 import b64encode, b64decode
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+from backend.main.store.secret_registry import KEY_RING
+
+BALLOT_NUMBER_KEY_SECRET_NAME = "BALLOT_NUMBER_KEY"
+# A ballot number is base64url(key version | nonce | tag): 33 bytes, which encode to exactly 44 characters without
+# padding. The version of the ballot number key is a single byte, so that key can be rotated up to 255 versions.
+BALLOT_NONCE_SIZE = 16
+BALLOT_TAG_SIZE = 16
+BALLOT_NUMBER_LENGTH = 44
+BALLOT_NUMBER_REGEX = re.compile(r"[0-9A-Za-z_-]{%d}" % BALLOT_NUMBER_LENGTH)
+# The numbers issued before the authenticated format, base64 of an (unauthenticated) ciphertext. They can't be
+# verified without the store, but may still be held by voters.
+LEGACY_BALLOT_NUMBER_REGEX = re.compile(r"[0-9A-Za-z+/]{52,}={0,2}")
+BALLOT_KEY_SIZE = 16
+
+# Generated on first use, which is only good for in-memory stores: the ballots in a database file must be verified
+# by every process that opens it, also after a restart, so a store on a file refuses a generated key
+KEY_RING.get_or_create_key(BALLOT_NUMBER_KEY_SECRET_NAME)
 
 
 class Ballot:
     """
     A ballot that exists in a specific, secret manner
     """
+    __slots__ = ("ballot_number", "chosen_candidate_id", "voter_comments")
+
     def __init__(self, ballot_number: str, chosen_candidate_id: str, voter_comments: str):
         self.ballot_number = ballot_number
         self.chosen_candidate_id = chosen_candidate_id
         self.voter_comments = voter_comments
 
 
+def ballot_number_lookup_key(ballot_number: str) -> bytes:
+   """
+    The fixed-size key the store indexes and matches ballots by, instead of their base64 number. Ballot numbers are
+    random and reveal nothing, so an unkeyed digest suffices and never needs recomputing.
+
+    :param: ballot_number The ballot number, as issued
+    :return: A 16 byte digest of the ballot number
+   """
+   return hashlib.blake2b(ballot_number.encode("utf-8"), digest_size=BALLOT_KEY_SIZE).digest()
+
+
+def _ballot_tag(ballot_hmac: hmac.HMAC, version_and_nonce: bytes) -> bytes:
+   ballot_hmac = ballot_hmac.copy()
+   ballot_hmac.update(version_and_nonce)
+   return ballot_hmac.digest()[:BALLOT_TAG_SIZE]
+
+
+def _seal_ballot_number(key_version: int, ballot_hmac: hmac.HMAC, nonce: bytes) -> str:
+   version_and_nonce = bytes((key_version,)) + nonce
+   return urlsafe_b64encode(version_and_nonce + _ballot_tag(ballot_hmac, version_and_nonce)).decode("ascii")
+
+
 def generate_ballot_number(national_id: str) -> str:
    """
     Produces a ballot number. Feel free to add parameters to this method, if you feel those are necessary.
@@ -29,21 +74,72 @@ def generate_ballot_number(national_id: str) -> str:
        are associated with the same voter.
 
 
-    SOLUTION: using a non-deterministic and symmetric cipher in value (nation id + uuid) to get a unique
-    and secret value
+    SOLUTION: a random 128-bit nonce, authenticated with a keyed MAC: base64url(key version | nonce | tag). The number
+    carries nothing of the voter - the store alone links it to them - so it satisfies 2 and 3 by construction, and its
+    tag lets anyone holding the key tell a number we issued from a forged one without looking it up
+    (is_authentic_ballot_number). Every number is 44 URL-safe characters.
 
+    :param: national_id The voter the ballot is issued to. It doesn't enter the number.
     :return: A string representing a ballot number that satisfies the conditions above
    """
-   id = str(uuid.uuid4())
-   national_id = national_id.replace("-", "").replace(" ", "").strip()
    try:
-      id = national_id + id
-      cipher = AES.new(
-         b'12345678901234567890123456789012', 
-         mode=AES.MODE_EAX
-      )
-      ciphertext = cipher.encrypt(id.encode("utf-8"))
-      ciphertext = b64encode(ciphertext).decode("utf-8")
-      return ciphertext
+      return _generate_ballot_number_chunk(1)[0]
    except Exception as e:
       raise e
+
+
+def generate_ballot_numbers(national_ids: List[str], processes: Optional[int] = None,
+                            chunk_size: int = 10000) -> List[str]:
+   """
+    Produces one ballot number per national ID, in order, with the same properties as generate_ballot_number. Used for
+    mass issuance.
+
+    :param: national_ids The national IDs to issue ballot numbers to
+    :param: processes If given, the numbers are generated on a pool of this many processes, `chunk_size` IDs at a time.
+            A number costs about a microsecond, so this only pays off for very large batches.
+    :return: The ballot numbers, in the same order as national_ids
+   """
+   if not processes or len(national_ids) <= chunk_size:
+      return _generate_ballot_number_chunk(len(national_ids))
+   chunk_sizes = [min(chunk_size, len(national_ids) - start) for start in range(0, len(national_ids), chunk_size)]
+   with ProcessPoolExecutor(max_workers=processes) as executor:
+      return [ballot_number for chunk in executor.map(_generate_ballot_number_chunk, chunk_sizes)
+              for ballot_number in chunk]
+
+
+def _generate_ballot_number_chunk(count: int) -> List[str]:
+   """
+    Vectorized generate_ballot_number: the nonces of the whole chunk are drawn with a single call.
+   """
+   key_version = KEY_RING.current_version(BALLOT_NUMBER_KEY_SECRET_NAME)
+   ballot_hmac = KEY_RING.get_hmac(BALLOT_NUMBER_KEY_SECRET_NAME, key_version)
+   nonces = get_random_bytes(BALLOT_NONCE_SIZE * count)
+   return [_seal_ballot_number(key_version, ballot_hmac, nonces[offset:offset + BALLOT_NONCE_SIZE])
+           for offset in range(0, len(nonces), BALLOT_NONCE_SIZE)]
+
+
+def is_authentic_ballot_number(ballot_number: str) -> bool:
+   """
+    Verifies a ballot number without any I/O: it must have the current format and carry the tag made with the version
+    of our key it names, which may have been rotated since. This doesn't tell whether the ballot still exists, or was
+    invalidated; the store does.
+
+    :param: ballot_number A ballot number, as submitted
+    :return: True if we issued this number, False if it's malformed or forged
+   """
+   if not isinstance(ballot_number, str) or not BALLOT_NUMBER_REGEX.fullmatch(ballot_number):
+      return False
+   envelope = urlsafe_b64decode(ballot_number)
+   ballot_hmac = KEY_RING.get_hmac(BALLOT_NUMBER_KEY_SECRET_NAME, envelope[0]) if envelope[0] else None
+   if ballot_hmac is None:
+      return False
+   version_and_nonce = envelope[:1 + BALLOT_NONCE_SIZE]
+   return hmac.compare_digest(_ballot_tag(ballot_hmac, version_and_nonce), envelope[1 + BALLOT_NONCE_SIZE:])
+
+
+def is_legacy_ballot_number(ballot_number: str) -> bool:
+   """
+    Whether the ballot number has the format of the numbers issued before they were authenticated. Such numbers can
+    only be checked against the store.
+   """
+   return isinstance(ballot_number, str) and LEGACY_BALLOT_NUMBER_REGEX.fullmatch(ballot_number) is not None
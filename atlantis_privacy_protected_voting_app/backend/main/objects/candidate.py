@@ -3,6 +3,15 @@ class Candidate:
 	"""
 	Information about a specific candidate in the election
 	"""
+	__slots__ = ("candidate_id", "name")
+
 	def __init__(self, candidate_id: str, name: str):
 		self.candidate_id = candidate_id
 		self.name = name
+
+	@classmethod
+	def from_row(cls, row: tuple) -> "Candidate":
+		"""
+		Builds a candidate from a (candidate_id, name) row of the candidates table
+		"""
+		return cls(str(row[0]), row[1])
@@ -0,0 +1,93 @@
+#
+# This file contains the national ID value type. A national ID is normalized and validated once, where it enters the
+# API, and carries the keyed hash that the store indexes voters and ballots by.
+#
+
+import hmac
+import re
+from functools import lru_cache
+from typing import Optional
+
+from backend.main.store.secret_registry import KEY_RING
+
+NATIONAL_ID_LOOKUP_KEY_SECRET_NAME = "NATIONAL_ID_LOOKUP_KEY"
+LOOKUP_KEY_SIZE = 16
+NATIONAL_ID_REGEX = re.compile(r"[0-9A-Za-z]{1,32}")
+# The most distinct national IDs kept interned; the IDs of a busy election day are looked up again and again
+INTERNED_NATIONAL_IDS = 1 << 16
+
+# The key of the national ID lookup keys. It's generated on first use, which is only good for in-memory stores: a store
+# on a database file refuses a generated key, and one made with another key (e.g. once it's rotated) until its lookup
+# keys are recomputed with rekey_lookup_keys. The key is read once, at start-up: the NationalIds interned since carry
+# lookup keys made with it.
+NATIONAL_ID_LOOKUP_KEY = KEY_RING.get_or_create_key(NATIONAL_ID_LOOKUP_KEY_SECRET_NAME)
+_NATIONAL_ID_LOOKUP_HMAC = KEY_RING.get_hmac(NATIONAL_ID_LOOKUP_KEY_SECRET_NAME)
+# Identifies the key without revealing it, so that the store can tell when its lookup keys were made with another one
+NATIONAL_ID_LOOKUP_KEY_FINGERPRINT = hmac.digest(NATIONAL_ID_LOOKUP_KEY, b"lookup key fingerprint", "sha256")[:16]
+
+
+def normalize_national_id(national_id: str) -> str:
+    """
+    Removes the dashes and spaces that national IDs are commonly written with. A NationalId is returned as it is.
+    """
+    if isinstance(national_id, NationalId):
+        return national_id
+    return national_id.replace("-", "").replace(" ", "").strip()
+
+
+def national_id_lookup_key(national_id: str) -> bytes:
+    """
+    The keyed hash of a national ID: a fixed-size key that the store indexes and matches exactly.
+
+    :param: national_id A NationalId, or a national ID string, which is normalized but not validated
+    """
+    if isinstance(national_id, NationalId):
+        return national_id.lookup_key
+    return _keyed_hash(normalize_national_id(national_id))
+
+
+def _keyed_hash(normalized_national_id: str) -> bytes:
+    lookup_hmac = _NATIONAL_ID_LOOKUP_HMAC.copy()
+    lookup_hmac.update(normalized_national_id.encode("utf-8"))
+    return lookup_hmac.digest()[:LOOKUP_KEY_SIZE]
+
+
+class NationalId(str):
+    """
+    A normalized and validated national ID, with its lookup key. It is a str, so it can be stored and compared like the
+    plain national IDs; build it with NationalId.parse, which returns the same interned object for the same ID however
+    it was written.
+    """
+    lookup_key: bytes
+
+    @staticmethod
+    def parse(national_id: str) -> "NationalId":
+        """
+        :param: national_id A national ID as written by the voter, e.g. "123-45-6789"
+        :returns: The NationalId
+        :raises: ValueError if the national ID isn't 1 to 32 letters or digits once normalized
+        """
+        if isinstance(national_id, NationalId):
+            return national_id
+        if not isinstance(national_id, str):
+            raise ValueError("A national ID must be a string")
+        return _intern_national_id(normalize_national_id(national_id))
+
+    @staticmethod
+    def try_parse(national_id: str) -> Optional["NationalId"]:
+        """
+        :returns: The NationalId, or None if the national ID is invalid - such an ID can't belong to a registered voter
+        """
+        try:
+            return NationalId.parse(national_id)
+        except ValueError:
+            return None
+
+
+@lru_cache(maxsize=INTERNED_NATIONAL_IDS)
+def _intern_national_id(normalized_national_id: str) -> NationalId:
+    if not NATIONAL_ID_REGEX.fullmatch(normalized_national_id):
+        raise ValueError("Invalid national ID")
+    national_id = NationalId(normalized_national_id)
+    national_id.lookup_key = _keyed_hash(normalized_national_id)
+    return national_id
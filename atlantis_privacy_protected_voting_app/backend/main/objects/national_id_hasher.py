@@ -0,0 +1,91 @@
+#
+# This file contains the service that turns national IDs into salted, peppered bcrypt hashes: pseudonyms that can be
+# checked against a national ID, but that are deliberately slow to brute-force from the small space of national IDs.
+# Only registration pays for them; voters are looked up by the keyed hash of backend.main.objects.national_id.
+#
+
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import bcrypt
+
+from backend.main.objects.national_id import normalize_national_id
+from backend.main.store.secret_registry import KEY_RING, gen_salt
+
+NATIONAL_ID_PEPPER_SECRET_NAME = "NATIONAL_ID_PEPPER"
+DEFAULT_ROUNDS = 12
+
+# Generated on first use. Unlike the salts, the pepper isn't stored with the hashes, so a stolen database alone can't
+# be brute-forced. The worker processes are only ever sent peppered IDs, never the pepper.
+KEY_RING.get_or_create_key(NATIONAL_ID_PEPPER_SECRET_NAME)
+
+
+def _peppered(national_id: str) -> bytes:
+    """
+    The HMAC of the national ID under the pepper, in base64: 44 bytes, within bcrypt's 72-byte limit and free of the
+    NUL bytes bcrypt stops at
+    """
+    pepper_hmac = KEY_RING.get_hmac(NATIONAL_ID_PEPPER_SECRET_NAME).copy()
+    pepper_hmac.update(normalize_national_id(national_id).encode("utf-8"))
+    return b64encode(pepper_hmac.digest())
+
+
+def _hash_peppered(peppered_national_ids: List[bytes], rounds: int) -> List[bytes]:
+    return [bcrypt.hashpw(peppered_national_id, gen_salt(rounds)) for peppered_national_id in peppered_national_ids]
+
+
+class NationalIdHasher:
+    """
+    Hashes national IDs with bcrypt, on a pool of processes for bulk registration. The CPU time of a hash doubles with
+    every round - a quarter of a second at the default 12 rounds - so a roll of voters needs every core.
+
+    The pool is started on first use and kept until close(), so that the chunks of a bulk registration don't each pay
+    for starting it.
+    """
+
+    def __init__(self, rounds: int = DEFAULT_ROUNDS, processes: Optional[int] = None, chunk_size: int = 16):
+        """
+        :param: rounds The bcrypt work factor, from 4 to 31
+        :param: processes If given, hash_many hashes on a pool of this many processes, `chunk_size` IDs at a time.
+                None hashes in the calling thread.
+        :param: chunk_size The number of national IDs handed to a process at a time
+        """
+        self.rounds = rounds
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def hash(self, national_id: str) -> bytes:
+        """
+        :param: national_id A national ID, which is normalized
+        :returns: Its salted, peppered bcrypt hash, e.g. b"$2b$12$..."
+        """
+        return _hash_peppered([_peppered(national_id)], self.rounds)[0]
+
+    def hash_many(self, national_ids: List[str]) -> List[bytes]:
+        """
+        :param: national_ids National IDs, which are normalized
+        :returns: Their hashes, in the same order
+        """
+        peppered_national_ids = [_peppered(national_id) for national_id in national_ids]
+        if not self.processes or len(peppered_national_ids) <= self.chunk_size:
+            return _hash_peppered(peppered_national_ids, self.rounds)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        chunks = [peppered_national_ids[start:start + self.chunk_size]
+                  for start in range(0, len(peppered_national_ids), self.chunk_size)]
+        return [national_id_hash
+                for chunk in self._executor.map(_hash_peppered, chunks, [self.rounds] * len(chunks))
+                for national_id_hash in chunk]
+
+    def verify(self, national_id: str, national_id_hash: bytes) -> bool:
+        """
+        :returns: True if the hash was made from this national ID (and our pepper). Costs as much as hashing it.
+        """
+        return bcrypt.checkpw(_peppered(national_id), national_id_hash)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
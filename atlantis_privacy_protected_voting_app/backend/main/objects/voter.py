@@ -4,13 +4,25 @@
 
 from random import shuffle
 from enum import Enum
+from typing import Iterable, List, Optional
 from Cryptodome.Cipher import AES
 from Crypto.Random import get_random_bytes
 from base64 import b64encode, b64decode
 
+from backend.main.objects.national_id import normalize_national_id
+from backend.main.store.secret_registry import KEY_RING
+
+NAME_ENCRYPTION_KEY_SECRET_NAME = "NAME_ENCRYPTION_KEY"
+NONCE_SIZE = 16
+TAG_SIZE = 16
+# Separates the key version from the envelope of the names encrypted with a rotated key, see NameCipher
+KEY_VERSION_SEPARATOR = ":"
+
+# The current name encryption key as of start-up, generated on first use. Storing a generated key in the secrets lets
+# processes started from this one decrypt the names this one encrypted. encrypt_name and decrypt_name get their keys
+# from the KEY_RING, so that they follow rotations.
+NAME_ENCRYPTION_KEY = KEY_RING.get_or_create_key(NAME_ENCRYPTION_KEY_SECRET_NAME)
 
-NAME_ENCRYPTION_KEY = get_random_bytes(32)
-MAPPER = dict()
 
 def obfuscate_national_id(national_id: str) -> str:
     """
@@ -20,7 +32,7 @@ def obfuscate_national_id(national_id: str) -> str:
     :param: national_id A real national ID that is sensitive and needs to be obfuscated in some manner.
     :return: An obfuscated version of the national_id.
     """
-    sanitized_national_id = national_id.replace("-", "").replace(" ", "").strip()
+    sanitized_national_id = normalize_national_id(national_id)
     try:
         sanitized_national_id = list(sanitized_national_id)
         shuffle(sanitized_national_id)
@@ -33,30 +45,111 @@ def obfuscate_national_id(national_id: str) -> str:
         raise e
 
 
+class NameCipher:
+    """
+    Encrypts and decrypts voter names with AES-EAX, with the key of one version of the name encryption key. The key is
+    read from the secrets once, and the cipher is cached in the KEY_RING (see get_name_cipher); every name gets its own
+    EAX object, since EAX needs a fresh nonce per name.
+
+    A NameCipher holds no state between calls, so one can be shared by any number of threads.
+
+    The envelopes of the first version of a key are plain base64; those of a rotated key are prefixed with its version,
+    e.g. "2:base64", which base64 can't be confused with.
+    """
+
+    def __init__(self, key: bytes, key_version: int = 1):
+        """
+        :param: key The AES key
+        :param: key_version The version of the key in the KEY_RING, written into the envelopes
+        """
+        self.key_version = key_version
+        self._key = key
+        self._envelope_prefix = "" if key_version == 1 else str(key_version) + KEY_VERSION_SEPARATOR
+
+    @staticmethod
+    def for_key(key: bytes, key_version: int) -> "NameCipher":
+        """
+        The factory of the ciphers cached in the KEY_RING
+        """
+        return NameCipher(key, key_version=key_version)
+
+    def _seal(self, nonce: bytes, name: str) -> str:
+        ciphertext, tag = AES.new(self._key, AES.MODE_EAX, nonce=nonce).encrypt_and_digest(name.encode("utf-8"))
+        return self._envelope_prefix + b64encode(nonce + tag + ciphertext).decode("utf-8")
+
+    def encrypt(self, name: str) -> str:
+        """
+        Encrypts a name, non-deterministically, into base64(nonce | tag | ciphertext), prefixed with the key version
+        unless it's 1
+        """
+        return self._seal(get_random_bytes(NONCE_SIZE), name)
+
+    def decrypt(self, encrypted_name: str) -> str:
+        """
+        Decrypts a name encrypted by encrypt.
+
+        :raises: ValueError if the encrypted name was tampered with, or wasn't encrypted with our key
+        """
+        if name_key_version(encrypted_name) != self.key_version:
+            raise ValueError("The name was encrypted with another version of the key")
+        envelope = b64decode(encrypted_name[len(self._envelope_prefix):])
+        if len(envelope) < NONCE_SIZE + TAG_SIZE:
+            raise ValueError("The encrypted name is too short")
+        nonce, tag = envelope[:NONCE_SIZE], envelope[NONCE_SIZE:NONCE_SIZE + TAG_SIZE]
+        cipher = AES.new(self._key, AES.MODE_EAX, nonce=nonce)
+        return cipher.decrypt_and_verify(envelope[NONCE_SIZE + TAG_SIZE:], tag).decode("utf-8")
+
+    def encrypt_many(self, names: Iterable[str]) -> List[str]:
+        """
+        :param: names A list or generator of plaintext names
+        :returns: The encrypted names, in the same order. The nonces of the whole batch are drawn with a single call.
+        """
+        names = list(names)
+        nonces = get_random_bytes(NONCE_SIZE * len(names))
+        return [self._seal(nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE], name) for i, name in enumerate(names)]
+
+    def decrypt_many(self, encrypted_names: Iterable[str]) -> List[str]:
+        """
+        :param: encrypted_names A list or generator of names encrypted by this cipher
+        :returns: The plaintext names, in the same order
+        """
+        return [self.decrypt(encrypted_name) for encrypted_name in encrypted_names]
+
+
+def name_key_version(encrypted_name: str) -> int:
+    """
+    :returns: The version of the key that a name was encrypted with
+    """
+    version, separator, _ = encrypted_name.partition(KEY_VERSION_SEPARATOR)
+    return int(version) if separator else 1
+
+
+def get_name_cipher(key_version: Optional[int] = None) -> NameCipher:
+    """
+    :param: key_version The version of the name encryption key, by default the current one
+    :returns: The NameCipher of that key, built once and cached in the KEY_RING
+    :raises: ValueError if there's no such version of the key
+    """
+    name_cipher = KEY_RING.get_object(NAME_ENCRYPTION_KEY_SECRET_NAME, key_version, NameCipher.for_key)
+    if name_cipher is None:
+        raise ValueError("Unknown version of the name encryption key: {0}".format(key_version))
+    return name_cipher
+
+
 def encrypt_name(name: str) -> str:
     """
     Encrypts a name, non-deterministically.
 
+    The result is a self-contained envelope - base64(nonce | tag | ciphertext), prefixed with the version of the key
+    once it's rotated - so decrypting it needs nothing but the key: no state is kept per encrypted name.
+
     :param: name A plaintext name that is sensitive and needs to encrypt.
     :return: The encrypted cipher text of the name.
     """
     try:
-        random_value = b64encode(get_random_bytes(16)).decode("utf-8")
-        name = name
-        cipher = AES.new(
-            NAME_ENCRYPTION_KEY, 
-            mode=AES.MODE_EAX
-        )
-        ciphertext = cipher.encrypt(name.encode("utf-8"))
-        ciphertext = b64encode(ciphertext).decode("utf-8")
-        MAPPER[ciphertext] = (
-            random_value, 
-            None,
-            cipher.nonce
-        )
-        return ciphertext
+        return get_name_cipher().encrypt(name)
     except Exception as e:
-        raise e;
+        raise e
 
 
 def decrypt_name(encrypted_name: str) -> str:
@@ -65,22 +158,12 @@ def decrypt_name(encrypted_name: str) -> str:
 
     :param: encrypted_name The ciphertext of a name that is sensitive
     :return: The plaintext name
+    :raises: ValueError if the encrypted name was tampered with, or wasn't encrypted with any version of our key
     """
     try:
-        tuple = MAPPER.get(encrypted_name) or (None, None)
-        cipher = AES.new(
-            NAME_ENCRYPTION_KEY, 
-            mode=AES.MODE_EAX,
-            nonce=tuple[2]
-        )
-        ciphertext = cipher.decrypt(
-            b64decode(encrypted_name)
-        )
-        ciphertext = ciphertext.decode("utf-8")
-        return ciphertext
+        return get_name_cipher(name_key_version(encrypted_name)).decrypt(encrypted_name)
     except Exception as e:
-        raise e;
-
+        raise e
 
 
 class MinimalVoter:
@@ -88,6 +171,8 @@ class MinimalVoter:
     Our representation of a voter, with the national id obfuscated (but still unique).
     This is the class that we want to be using in the majority of our codebase.
     """
+    __slots__ = ("obfuscated_national_id", "obfuscated_first_name", "obfuscated_last_name")
+
     def __init__(self, obfuscated_first_name: str, obfuscated_last_name: str, obfuscated_national_id: str):
         self.obfuscated_national_id = obfuscated_national_id
         self.obfuscated_first_name = obfuscated_first_name
@@ -100,11 +185,20 @@ class Voter:
     This class should only be used in the initial stages when requests come in; in the rest of the
     codebase, we should be using the ObfuscatedVoter class
     """
+    __slots__ = ("national_id", "first_name", "last_name")
+
     def __init__(self, first_name: str, last_name: str, national_id: str):
         self.national_id = national_id
         self.first_name = first_name
         self.last_name = last_name
 
+    @classmethod
+    def from_row(cls, row: tuple) -> "Voter":
+        """
+        Builds a voter from a (first_name, last_name, national_id) row of the voter table
+        """
+        return cls(row[0], row[1], row[2])
+
     def get_minimal_voter(self) -> MinimalVoter:
         """
         Converts this object (self) into its obfuscated version
@@ -115,6 +209,26 @@ class Voter:
             obfuscate_national_id(self.national_id))
 
 
+def get_minimal_voters(voters: Iterable[Voter], name_cipher: Optional[NameCipher] = None) -> List[MinimalVoter]:
+    """
+    Converts many voters into their obfuscated versions, encrypting all their names in one batch.
+
+    :param: voters A list or generator of voters
+    :param: name_cipher The cipher to encrypt the names with. Defaults to the cipher of the current name encryption key.
+    :returns: The minimal voters, in the same order
+    """
+    try:
+        voters = list(voters)
+        name_cipher = name_cipher or get_name_cipher()
+        encrypted_names = name_cipher.encrypt_many(
+            name.strip() for voter in voters for name in (voter.first_name, voter.last_name))
+        return [MinimalVoter(encrypted_names[2 * i], encrypted_names[2 * i + 1],
+                             obfuscate_national_id(voter.national_id))
+                for i, voter in enumerate(voters)]
+    except Exception as e:
+        raise e
+
+
 class VoterStatus(Enum):
     """
     An enum that represents the current status of a voter.
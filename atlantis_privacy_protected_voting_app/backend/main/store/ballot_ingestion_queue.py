@@ -0,0 +1,125 @@
+#
+# This file contains a write-behind queue that counts ballots in group-commit batches
+#
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, BallotStatus
+from backend.main.store.data_registry import VotingStore
+
+# Put on the queue by close(), to stop the writer once it has drained everything submitted before it
+_STOP = object()
+
+
+class BallotIngestionQueue:
+    """
+    Counts ballots through a single writer thread. Submitted ballots wait in an in-process queue; the writer takes up
+    to `max_batch_size` of them - everything queued while it was committing the previous batch, optionally waiting up
+    to `max_delay` seconds for more - and counts the whole batch with VotingStore.cast_ballots, in one transaction and
+    one commit. Each submitter gets a Future, which is
+    resolved with the ballot's BallotStatus only once the transaction of its batch has committed - which, on an on-disk
+    database, survives a crash of the application (and a power loss too if PRAGMA synchronous is FULL).
+
+    Ballots are applied in the order they were submitted and each one sees the ones before it, so the fraud rule (only
+    one counted ballot per voter) is exactly the same as when counting them one by one.
+    """
+
+    def __init__(self, redact_comment: Optional[Callable[[Voter, str], str]] = None, max_batch_size: int = 512,
+                 max_delay: float = 0.0, max_queued: int = 100000):
+        """
+        :param: redact_comment Passed on to VotingStore.cast_ballots
+        :param: max_batch_size The most ballots committed together
+        :param: max_delay The most seconds the writer waits for more ballots once the queue is empty. The default, 0,
+                never delays a ballot: the batches grow by themselves as the load does, since ballots pile up while the
+                writer commits.
+        :param: max_queued The most ballots waiting in the queue; submit blocks while it's full
+        """
+        self.redact_comment = redact_comment
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._closed = False
+        self._closing_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_batches, name="ballot-ingestion-writer", daemon=True)
+        self._writer.start()
+
+    def submit(self, ballot: Ballot, voter_national_id: str) -> "Future[BallotStatus]":
+        """
+        Queues a ballot to be counted.
+
+        :returns: A Future resolved with the BallotStatus once the ballot is committed, or with the exception raised
+                  while counting it
+        """
+        future = Future()
+        with self._closing_lock:
+            if self._closed:
+                raise RuntimeError("The ballot ingestion queue is closed")
+            self._queue.put((ballot, voter_national_id, future))
+        return future
+
+    def count_ballot(self, ballot: Ballot, voter_national_id: str, timeout: Optional[float] = None) -> BallotStatus:
+        """
+        Queues a ballot and waits until its batch is committed.
+
+        :returns: The BallotStatus after the ballot has been processed
+        """
+        return self.submit(ballot, voter_national_id).result(timeout)
+
+    def close(self):
+        """
+        Stops accepting ballots, and waits until every ballot already submitted is committed
+        """
+        with self._closing_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._writer.join()
+
+    def _next_batch(self) -> Tuple[List[Tuple[Ballot, str, Future]], bool]:
+        """
+        Blocks for the first ballot, then gathers more until the batch is full, or the queue is empty and max_delay
+        has passed.
+
+        :returns: The batch, and whether the queue was closed
+        """
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_delay
+        while item is not _STOP:
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                return batch, False
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return batch, False
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    return batch, False
+        return batch, True
+
+    def _write_batches(self):
+        closed = False
+        while not closed:
+            batch, closed = self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = VotingStore.get_instance().cast_ballots(
+                    [(ballot, voter_national_id) for ballot, voter_national_id, _ in batch], self.redact_comment)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,71 @@
+#
+# This file contains the in-process Bloom filter the VotingStore keeps of the ballot lookup keys, so that ballot numbers
+# that were never issued are rejected without a query.
+#
+
+import threading
+from typing import Iterable, List
+
+# 10 bits and 7 probes per key give a false positive rate of about 1%; every further layer gets 2 more bits per key,
+# which divides its rate by about 2.6, so that the rates of all the layers add up to less than 2%
+BITS_PER_KEY = 10
+EXTRA_BITS_PER_KEY_PER_LAYER = 2
+
+
+class _BloomLayer:
+    def __init__(self, capacity: int, bits_per_key: int):
+        self.capacity = capacity
+        self.bits_per_key = bits_per_key
+        # The optimal number of probes is ln(2) per bit per key
+        self.probes = round(bits_per_key * 0.693)
+        self.size_in_bits = capacity * bits_per_key
+        self.bits = bytearray((self.size_in_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes) -> Iterable[int]:
+        # The keys are already uniform digests, so two halves of one give all the probes (double hashing)
+        first_hash = int.from_bytes(key[:8], "little")
+        second_hash = int.from_bytes(key[8:16], "little") | 1
+        return ((first_hash + probe * second_hash) % self.size_in_bits for probe in range(self.probes))
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BloomFilter:
+    """
+    A Bloom filter of fixed-size digests (at least 16 bytes) that grows with the number of keys: once a layer holds the
+    keys it was sized for, new keys go to a layer twice as large and with a lower false positive rate, so the rate of
+    the whole filter stays bounded. A key that was added is always found; a key that wasn't is found 1 to 2% of the
+    time.
+
+    Lookups take no lock; adds are serialized, since setting a bit is a read-modify-write of its byte.
+    """
+
+    def __init__(self, initial_capacity: int = 1 << 16):
+        self._lock = threading.Lock()
+        self._layers: List[_BloomLayer] = [_BloomLayer(initial_capacity, BITS_PER_KEY)]
+
+    def __len__(self) -> int:
+        return sum(layer.count for layer in self._layers)
+
+    def add(self, key: bytes):
+        with self._lock:
+            layer = self._layers[-1]
+            if layer.count >= layer.capacity:
+                layer = _BloomLayer(layer.capacity * 2, layer.bits_per_key + EXTRA_BITS_PER_KEY_PER_LAYER)
+                self._layers = self._layers + [layer]
+            layer.add(key)
+
+    def update(self, keys: Iterable[bytes]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: bytes) -> bool:
+        return any(key in layer for layer in self._layers)
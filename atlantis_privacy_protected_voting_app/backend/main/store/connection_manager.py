@@ -0,0 +1,124 @@
+#
+# This file manages the sqlite connections used by the VotingStore
+#
+
+import sqlite3
+import threading
+import weakref
+from sqlite3 import Connection
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+
+MEMORY_DATABASE = ":memory:"
+
+# Pragmas applied to every connection of an on-disk database. WAL lets readers run in parallel with the single writer;
+# synchronous=NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit.
+FILE_DATABASE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,           # negative values are in KiB, so 64MB of page cache per connection
+    "mmap_size": 268435456,         # 256MB memory-mapped I/O
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,           # milliseconds to wait on another process holding the write lock
+}
+
+
+class _ThreadConnection:
+    """
+    Holds the connection of one thread, in that thread's thread-local storage. The thread-local storage is dropped when
+    the thread exits, and with it this holder, whose finalizer then closes the connection.
+    """
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+
+class ConnectionManager:
+    """
+    Hands out sqlite connections to the VotingStore.
+
+    For an on-disk database every thread gets its own connection, so reads run in parallel under WAL, while writes are
+    serialized by a lock in this process (and by sqlite's own write lock across processes). A thread's connection is
+    closed when the thread exits, so servers that start a thread per request don't accumulate connections.
+
+    An in-memory database only exists inside the connection that created it, so in that mode - the test profile - a
+    single connection is shared by every thread and all reads and writes are serialized by the same lock.
+    """
+
+    def __init__(self, database: str = MEMORY_DATABASE,
+                 pragmas: Optional[Dict[str, Union[str, int]]] = None):
+        self.database = database
+        self.pragmas = FILE_DATABASE_PRAGMAS if pragmas is None else pragmas
+        self._write_lock = threading.RLock()
+        self._thread_local = threading.local()
+        self._all_connections: List[Connection] = []
+        self._all_connections_lock = threading.Lock()
+        self._shared_connection = self._connect() if self.is_memory() else None
+
+    def is_memory(self) -> bool:
+        return self.database == MEMORY_DATABASE
+
+    def _connect(self) -> Connection:
+        # isolation_level=None: the store begins and commits its write transactions explicitly
+        connection = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+        if not self.is_memory():
+            for pragma_name, pragma_value in self.pragmas.items():
+                connection.execute("""PRAGMA {0} = {1}""".format(pragma_name, pragma_value))
+        with self._all_connections_lock:
+            self._all_connections.append(connection)
+        return connection
+
+    def get_connection(self) -> Connection:
+        """
+        Returns the connection of the calling thread, opening it on first use
+        """
+        if self._shared_connection is not None:
+            return self._shared_connection
+        holder = getattr(self._thread_local, "holder", None)
+        if holder is None:
+            holder = _ThreadConnection(self._connect())
+            weakref.finalize(holder, self._release, holder.connection)
+            self._thread_local.holder = holder
+        return holder.connection
+
+    def _release(self, connection: Connection):
+        """
+        Closes the connection of a thread that exited
+        """
+        with self._all_connections_lock:
+            if connection in self._all_connections:
+                self._all_connections.remove(connection)
+        connection.close()
+
+    @contextmanager
+    def reading(self) -> Iterator[Connection]:
+        """
+        Yields a connection to read from. Only takes the lock when the connection is shared between threads.
+        """
+        if self._shared_connection is not None:
+            with self._write_lock:
+                yield self._shared_connection
+        else:
+            yield self.get_connection()
+
+    @contextmanager
+    def writing(self) -> Iterator[Connection]:
+        """
+        Yields a connection to write to, holding the write lock so that only one thread of this process writes at a time
+        """
+        with self._write_lock:
+            yield self.get_connection()
+
+    def get_all_connections(self) -> List[Connection]:
+        with self._all_connections_lock:
+            return list(self._all_connections)
+
+    def close(self):
+        """
+        Closes every connection handed out by this manager
+        """
+        with self._all_connections_lock:
+            for connection in self._all_connections:
+                connection.close()
+            self._all_connections = []
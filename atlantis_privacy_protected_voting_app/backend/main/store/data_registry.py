@@ -2,15 +2,111 @@
 # This file is the interface between the stores and the database
 #
 
-import sqlite3
-from sqlite3 import Connection
+import os
+import inspect
+import threading
+from sqlite3 import Connection, Cursor
+from contextlib import contextmanager
 
 from datetime import datetime
-from typing import List
+from typing import Callable, Iterator, List, Optional, Set, Tuple, Union
 
-from backend.main.objects.voter import Voter, VoterStatus
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
 from backend.main.objects.candidate import Candidate
-from backend.main.objects.ballot import Ballot
+from backend.main.objects.ballot import Ballot, ballot_number_lookup_key, BALLOT_NUMBER_KEY_SECRET_NAME
+from backend.main.objects.national_id import national_id_lookup_key, NATIONAL_ID_LOOKUP_KEY_FINGERPRINT, \
+    NATIONAL_ID_LOOKUP_KEY_SECRET_NAME
+from backend.main.store.connection_manager import ConnectionManager, MEMORY_DATABASE
+from backend.main.store.instrumentation import InstrumentedCursor, StoreMetrics
+from backend.main.store.bloom_filter import BloomFilter
+from backend.main.store.secret_registry import KEY_RING
+from backend.main.detection.name_dictionary import NameDictionary
+
+# Path of the sqlite database file. When unset, the store runs on an in-memory database (the test profile).
+DATABASE_ENV_VARIABLE = "VOTING_STORE_DATABASE"
+# Number of databases to partition the voters and their ballots over, see ShardedVotingStore. 1 (the default) keeps
+# everything in a single database.
+SHARDS_ENV_VARIABLE = "VOTING_STORE_SHARDS"
+# Set to 1 to collect the metrics of every store method and SQL statement, see VotingStore.enable_instrumentation
+INSTRUMENTATION_ENV_VARIABLE = "VOTING_STORE_INSTRUMENTATION"
+# Name of the setting that identifies the key the national ID lookup keys were computed with
+LOOKUP_KEY_FINGERPRINT_SETTING = "national_id_lookup_key_fingerprint"
+# The keys that what a database file holds was made with, which must be configured in the secrets for a store to open
+# one: a key generated by the process would be gone when it restarts
+STORED_KEY_SECRET_NAMES = [NATIONAL_ID_LOOKUP_KEY_SECRET_NAME, BALLOT_NUMBER_KEY_SECRET_NAME]
+
+
+def _add_column(table: str, column: str, column_type: str) -> Callable[[Cursor], None]:
+    """
+    A migration step that adds a column to a table, unless the table already has it (sqlite has no ADD COLUMN IF NOT
+    EXISTS)
+    """
+    def add_column(cursor: Cursor):
+        columns = [row[1] for row in cursor.execute("""PRAGMA table_info({0})""".format(table)).fetchall()]
+        if column not in columns:
+            cursor.execute("""ALTER TABLE {0} ADD COLUMN {1} {2}""".format(table, column, column_type))
+    return add_column
+
+
+#
+# Schema migrations. Version 0 is the original set of tables created by VotingStore.create_tables. Each entry moves
+# the schema one version forward; the current version of a database is kept in its PRAGMA user_version. A step is
+# either a SQL statement or a function of the cursor. Never edit a migration that has shipped - append a new one
+# instead.
+#
+SCHEMA_MIGRATIONS = [
+    # 1: indexes that match the predicates the store queries on
+    [
+        """CREATE UNIQUE INDEX IF NOT EXISTS voter_national_id_idx ON voter(national_id)""",
+        """CREATE INDEX IF NOT EXISTS voter_status_idx ON voter(status)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS ballot_number_idx ON ballot(ballot_number)""",
+        """
+        CREATE INDEX IF NOT EXISTS ballot_voter_cast_idx
+        ON ballot(voter_national_id, is_used, is_validated, deleted)
+        """,
+    ],
+    # 2: live tally of the votes per candidate, kept up to date in the transaction that counts each ballot
+    [
+        """CREATE TABLE IF NOT EXISTS tally (candidate_id text primary key, votes integer not null default 0)""",
+        """
+        INSERT OR REPLACE INTO tally (candidate_id, votes)
+        SELECT chosen_candidate_id, count(*)
+        FROM ballot
+        WHERE chosen_candidate_id is not null
+        GROUP BY chosen_candidate_id
+        """,
+    ],
+    # 3: voters and ballots are looked up by the keyed hash of the national ID, see backend.main.objects.national_id
+    [
+        _add_column("voter", "lookup_key", "blob"),
+        _add_column("ballot", "voter_lookup_key", "blob"),
+        """CREATE TABLE IF NOT EXISTS store_settings (name text primary key, value blob)""",
+        """UPDATE voter SET lookup_key = national_id_lookup_key(national_id)""",
+        """UPDATE ballot SET voter_lookup_key = national_id_lookup_key(voter_national_id)""",
+        """
+        INSERT OR REPLACE INTO store_settings (name, value)
+        VALUES ('national_id_lookup_key_fingerprint', national_id_lookup_key_fingerprint())
+        """,
+        """CREATE UNIQUE INDEX IF NOT EXISTS voter_lookup_key_idx ON voter(lookup_key)""",
+        """DROP INDEX IF EXISTS ballot_voter_cast_idx""",
+        """
+        CREATE INDEX IF NOT EXISTS ballot_voter_lookup_key_cast_idx
+        ON ballot(voter_lookup_key, is_used, is_validated, deleted)
+        """,
+    ],
+    # 4: ballots are looked up by a fixed-size digest of their number, see ballot_number_lookup_key
+    [
+        _add_column("ballot", "ballot_key", "blob"),
+        """UPDATE ballot SET ballot_key = ballot_number_lookup_key(ballot_number)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS ballot_key_idx ON ballot(ballot_key)""",
+        """DROP INDEX IF EXISTS ballot_number_idx""",
+    ],
+    # 5: the bcrypt pseudonym of the national ID, see backend.main.objects.national_id_hasher. Never looked up by.
+    [
+        _add_column("voter", "national_id_hash", "blob"),
+    ],
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
 
 
 class VotingStore:
@@ -28,323 +124,891 @@ class VotingStore:
     @staticmethod
     def get_instance():
         if not VotingStore.voting_store_instance:
-            VotingStore.voting_store_instance = VotingStore()
+            VotingStore.voting_store_instance = VotingStore._create_instance()
 
         return VotingStore.voting_store_instance
 
     @staticmethod
     def refresh_instance():
         """
-        DO NOT MODIFY THIS METHOD
-        Only to be used for testing. This will only work if the sqlite connection is :memory:
+        Only to be used for testing. This only wipes the data if the store is running on the in-memory database.
         """
         if VotingStore.voting_store_instance:
-            VotingStore.voting_store_instance.connection.close()
-        VotingStore.voting_store_instance = VotingStore()
+            VotingStore.voting_store_instance.close()
+        VotingStore.voting_store_instance = VotingStore._create_instance()
 
-    def __init__(self):
+    @staticmethod
+    def _create_instance():
         """
-        DO NOT MODIFY THIS METHOD
-        DO NOT call this method directly - instead use the VotingStore.get_instance method above.
+        Creates the store of this process: a ShardedVotingStore, with the same methods, when VOTING_STORE_SHARDS asks
+        for more than one shard
         """
-        self.connection = VotingStore._get_sqlite_connection()
-        self.create_tables()
+        shard_count = int(os.getenv(SHARDS_ENV_VARIABLE) or 1)
+        if shard_count > 1:
+            # Imported here, since the sharded store is built out of VotingStores
+            from backend.main.store.sharded_store import ShardedVotingStore
+            return ShardedVotingStore(shard_count)
+        return VotingStore()
+
+    def __init__(self, database: Optional[str] = None, check_lookup_keys: bool = True):
+        """
+        DO NOT call this method directly - instead use the VotingStore.get_instance method above.
 
-    @staticmethod
-    def _get_sqlite_connection() -> Connection:
+        :param: database Path of the sqlite database file. Defaults to the VOTING_STORE_DATABASE environment variable,
+                and to an in-memory database when that isn't set either.
+        :param: check_lookup_keys Whether to refuse a database whose lookup keys were made with another key. Only
+                rekey_lookup_keys opens one without the check, to recompute them.
+        :raises: ValueError if a key in STORED_KEY_SECRET_NAMES was generated by this process rather than configured,
+                 and the database is a file; or if the lookup keys of the database were made with another key
+        """
+        database = database or os.getenv(DATABASE_ENV_VARIABLE) or MEMORY_DATABASE
+        if database != MEMORY_DATABASE:
+            VotingStore._check_keys_configured()
+        self.connections = ConnectionManager(database)
+        self.name_dictionary: Optional[NameDictionary] = None
+        self.metrics: Optional[StoreMetrics] = None
+        # Bumped by add_candidate; the cached candidate list is only used while it was read at the current version
+        self.candidates_version = 0
+        self._candidates_cache: Optional[Tuple[int, List[Candidate]]] = None
+        # Bloom filter of the ballot keys, loaded on first use by might_have_ballot, and the last ballot_id it has seen
+        self._ballot_filter: Optional[BloomFilter] = None
+        self._ballot_filter_last_id = 0
+        self._ballot_filter_lock = threading.Lock()
+        try:
+            self.create_tables()
+            if check_lookup_keys:
+                self._check_lookup_keys()
+        except BaseException:
+            self.close()
+            raise
+        if os.getenv(INSTRUMENTATION_ENV_VARIABLE, "").lower() in ("1", "true", "yes"):
+            self.enable_instrumentation()
+
+    @property
+    def connection(self) -> Connection:
         """
-        DO NOT MODIFY THIS METHOD
+        The sqlite connection of the calling thread
         """
-        return sqlite3.connect(":memory:", check_same_thread=False)
+        return self.connections.get_connection()
+
+    def close(self):
+        self.connections.close()
 
     def create_tables(self):
         """
-        Creates Tables
+        Creates Tables, if they don't exist yet, and migrates them to the latest schema version
         """
-        self.connection.execute(
-            """CREATE TABLE candidates (candidate_id integer primary key autoincrement, name text)""")
-        self.connection.execute(
-            """
-            CREATE TABLE voter(
-                voter_id integer primary key autoincrement,
-                first_name text,
-                last_name text,
-                national_id text,
-                status text null,
-                creation text,
-                deleted boolean default false
+        with self._transaction() as cursor:
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS candidates (candidate_id integer primary key autoincrement, name text)""")
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS voter(
+                    voter_id integer primary key autoincrement,
+                    first_name text,
+                    last_name text,
+                    national_id text,
+                    status text null,
+                    creation text,
+                    deleted boolean default false
+                )
+                """
             )
-            """
-        )
-        self.connection.execute(
-            """
-            CREATE TABLE ballot(
-                ballot_id integer primary key autoincrement,
-                ballot_number text,
-                chosen_candidate_id text null,
-                voter_comments text null,
-                voter_id text null,
-                voter_national_id text,
-                is_validated boolean default true,
-                is_used boolean default false,
-                deleted boolean default false
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ballot(
+                    ballot_id integer primary key autoincrement,
+                    ballot_number text,
+                    chosen_candidate_id text null,
+                    voter_comments text null,
+                    voter_id text null,
+                    voter_national_id text,
+                    is_validated boolean default true,
+                    is_used boolean default false,
+                    deleted boolean default false
+                )
+                """
             )
-            """
-        )
-        self.connection.commit()
+        self.migrate_schema()
+
+    @staticmethod
+    def _check_keys_configured():
+        generated = [name for name in STORED_KEY_SECRET_NAMES if KEY_RING.is_generated(name)]
+        if generated:
+            raise ValueError("A store on a database file needs these secrets to be configured: {0}".format(
+                ", ".join(generated)))
+
+    def _check_lookup_keys(self):
+        with self._reading() as cursor:
+            cursor.execute("""SELECT value FROM store_settings WHERE name=?""", (LOOKUP_KEY_FINGERPRINT_SETTING,))
+            fingerprint_row = cursor.fetchone()
+        if fingerprint_row is not None and fingerprint_row[0] != NATIONAL_ID_LOOKUP_KEY_FINGERPRINT:
+            raise ValueError("The lookup keys of the database were made with another NATIONAL_ID_LOOKUP_KEY; configure "
+                             "that key, or recompute them with rekey_lookup_keys")
+
+    def get_schema_version(self) -> int:
+        """
+        Returns the schema version of the database, as stored in its PRAGMA user_version
+        """
+        with self._reading() as cursor:
+            return cursor.execute("""PRAGMA user_version""").fetchone()[0]
+
+    def migrate_schema(self):
+        """
+        Applies every migration in SCHEMA_MIGRATIONS that is newer than the database's schema version. Each migration
+        runs in its own transaction together with the version bump, so a failed migration leaves the database at the
+        previous version. The version is re-read inside the transaction, so that several processes opening the same
+        database apply each migration only once.
+        """
+        while True:
+            with self._transaction() as cursor:
+                version = cursor.execute("""PRAGMA user_version""").fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    return
+                VotingStore._create_lookup_key_functions(cursor)
+                for statement in SCHEMA_MIGRATIONS[version]:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute("""PRAGMA user_version = {0}""".format(version + 1))
+
+    def update_lookup_keys(self) -> bool:
+        """
+        Recomputes the national ID lookup keys of every voter and ballot if they were computed with another key than
+        the current NATIONAL_ID_LOOKUP_KEY, e.g. because the secret was rotated. It rewrites both tables, so it's a
+        maintenance step, see rekey_lookup_keys: no other store may use the database meanwhile.
+
+        :returns: Boolean TRUE if the lookup keys had to be recomputed
+        """
+        with self._transaction() as cursor:
+            cursor.execute("""SELECT value FROM store_settings WHERE name=?""", (LOOKUP_KEY_FINGERPRINT_SETTING,))
+            fingerprint_row = cursor.fetchone()
+            if fingerprint_row is not None and fingerprint_row[0] == NATIONAL_ID_LOOKUP_KEY_FINGERPRINT:
+                return False
+            VotingStore._create_lookup_key_functions(cursor)
+            # Clear the keys first, so that no voter briefly holds a key that another one still has under the old key
+            cursor.execute("""UPDATE voter SET lookup_key = NULL""")
+            cursor.execute("""UPDATE voter SET lookup_key = national_id_lookup_key(national_id)""")
+            cursor.execute("""UPDATE ballot SET voter_lookup_key = national_id_lookup_key(voter_national_id)""")
+            cursor.execute("""INSERT OR REPLACE INTO store_settings (name, value) VALUES (?, ?)""",
+                           (LOOKUP_KEY_FINGERPRINT_SETTING, NATIONAL_ID_LOOKUP_KEY_FINGERPRINT))
+        return True
+
+    @staticmethod
+    def _create_lookup_key_functions(cursor: Cursor):
+        """
+        Makes the national ID and ballot number lookup keys available to the SQL statements that backfill them
+        """
+        cursor.connection.create_function(
+            "national_id_lookup_key", 1,
+            lambda national_id: None if national_id is None else national_id_lookup_key(str(national_id)),
+            deterministic=True)
+        cursor.connection.create_function(
+            "national_id_lookup_key_fingerprint", 0, lambda: NATIONAL_ID_LOOKUP_KEY_FINGERPRINT, deterministic=True)
+        cursor.connection.create_function(
+            "ballot_number_lookup_key", 1,
+            lambda ballot_number: None if ballot_number is None else ballot_number_lookup_key(str(ballot_number)),
+            deterministic=True)
+
+    @contextmanager
+    def _reading(self) -> Iterator[Cursor]:
+        """
+        Yields a cursor for read-only statements. On an on-disk database, reads from different threads run in parallel.
+        """
+        with self.connections.reading() as connection:
+            yield self._cursor(connection)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[Cursor]:
+        """
+        Runs the enclosed statements as one atomic write transaction. The transaction is started with BEGIN IMMEDIATE
+        so that the checks made inside it cannot be invalidated by a concurrent writer before it commits. Commits once
+        on success and rolls back if anything raises.
+        """
+        with self.connections.writing() as connection:
+            cursor = self._cursor(connection)
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+
+    def _cursor(self, connection: Connection) -> Cursor:
+        if self.metrics is None:
+            return connection.cursor()
+        self.metrics.instrument_connection(connection)
+        return InstrumentedCursor(connection.cursor(), self.metrics)
+
+    def enable_instrumentation(self, metrics: Optional[StoreMetrics] = None) -> StoreMetrics:
+        """
+        Starts collecting, for every public store method and every SQL statement, the number of calls, their latency
+        histogram, and the rows they returned and scanned (see StoreMetrics). The methods are wrapped on this instance
+        only, and the cursors only while enabled, so a store without instrumentation runs exactly as before.
+
+        :param: metrics The StoreMetrics to collect into, e.g. one shared by several stores. A new one by default.
+        """
+        if self.metrics is None:
+            metrics = metrics or StoreMetrics()
+            for name in VotingStore._instrumented_methods():
+                setattr(self, name, metrics.instrument_method(name, getattr(self, name)))
+            self.metrics = metrics
+        return self.metrics
+
+    def disable_instrumentation(self):
+        if self.metrics is not None:
+            for name in VotingStore._instrumented_methods():
+                self.__dict__.pop(name, None)
+            for connection in self.connections.get_all_connections():
+                connection.set_progress_handler(None, 0)
+            self.metrics = None
+
+    @staticmethod
+    def _instrumented_methods() -> List[str]:
+        return [name for name, member in vars(VotingStore).items()
+                if not name.startswith("_") and inspect.isfunction(member)
+                and name not in ("close", "create_tables", "enable_instrumentation", "disable_instrumentation")]
 
     def add_candidate(self, candidate_name: str):
         """
         Adds a candidate into the candidate table, overwriting an existing entry if one exists
         """
-        self.connection.execute("""INSERT INTO candidates (name) VALUES (?)""", (candidate_name, ))
-        self.connection.commit()
+        with self._transaction() as cursor:
+            cursor.execute("""INSERT INTO candidates (name) VALUES (?)""", (candidate_name, ))
+        self.candidates_version += 1
 
     def get_candidate(self, candidate_id: str) -> Candidate:
         """
         Returns the candidate specified, if that candidate is registered. Otherwise returns None.
         """
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT * FROM candidates WHERE candidate_id=?""", (candidate_id,))
-        candidate_row = cursor.fetchone()
-        candidate = Candidate(candidate_id, candidate_row[1]) if candidate_row else None
-        self.connection.commit()
-
-        return candidate
+        with self._reading() as cursor:
+            cursor.execute("""SELECT * FROM candidates WHERE candidate_id=?""", (candidate_id,))
+            candidate_row = cursor.fetchone()
+        return Candidate(candidate_id, candidate_row[1]) if candidate_row else None
 
     def get_all_candidates(self) -> List[Candidate]:
         """
-        Gets ALL the candidates from the database
+        Gets ALL the candidates from the database. The list is cached until add_candidate is called, since it hardly
+        ever changes once the election has started. Candidates added by another process, on a shared database file, are
+        only seen by this one once it adds a candidate itself or is restarted.
         """
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT * FROM candidates""")
-        all_candidate_rows = cursor.fetchall()
-        all_candidates = [Candidate(str(candidate_row[0]), candidate_row[1]) for candidate_row in all_candidate_rows]
-        self.connection.commit()
+        cache = self._candidates_cache
+        if cache is not None and cache[0] == self.candidates_version:
+            return list(cache[1])
+        # Read the version before the rows: if a candidate is added meanwhile, the list is stored as already stale
+        version = self.candidates_version
+        with self._reading() as cursor:
+            cursor.execute("""SELECT * FROM candidates""")
+            all_candidate_rows = cursor.fetchall()
+        all_candidates = [Candidate.from_row(candidate_row) for candidate_row in all_candidate_rows]
+        self._candidates_cache = (version, all_candidates)
+        return list(all_candidates)
 
-        return all_candidates
-    
     # NEW METHOD
-    def add_voter(self, voter: Voter) -> bool:
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute("""SELECT count(*) FROM voter WHERE national_id=?""", (voter.national_id,))
-            status_voter = cursor.fetchone()
-            count_voter = int(status_voter[0]) if status_voter else 0
-
-            if count_voter == 0:
-                today = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
-                statusVoted = VoterStatus.REGISTERED_NOT_VOTED.value
-                self.connection.execute("""
-                    INSERT INTO voter (
-                        first_name, 
-                        last_name, 
-                        national_id, 
-                        status, 
-                        creation)
-                    values (?,?,?, ?, ?)
-                """, (voter.first_name , 
-                    voter.last_name, 
-                    voter.national_id, 
-                    str(statusVoted), 
-                    today))
-                self.connection.commit()
-                return True
-            else: 
-                return False
-        except Exception as e:
-            raise e 
+    def add_voter(self, voter: Voter, national_id_hash: Optional[bytes] = None) -> bool:
+        """
+        :param: national_id_hash The bcrypt hash of the voter's national ID, if national ID hashing is enabled
+        """
+        with self._transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO voter (
+                    first_name,
+                    last_name,
+                    national_id,
+                    lookup_key,
+                    national_id_hash,
+                    status,
+                    creation)
+                values (?,?,?,?,?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, VotingStore._voter_row(voter, national_id_hash))
+            is_new = cursor.rowcount == 1
+        if is_new and self.name_dictionary is not None:
+            self.name_dictionary.add(voter.first_name)
+            self.name_dictionary.add(voter.last_name)
+        return is_new
+
+    def add_voters(self, voters: List[Voter], national_id_hashes: Optional[List[Optional[bytes]]] = None) -> List[bool]:
+        """
+        Registers a batch of voters in a single transaction.
 
-    def get_voter(self, national_id:str) -> Voter:
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT first_name, last_name, national_id FROM voter WHERE national_id=?""", (national_id,))
-        voter_row = cursor.fetchone()
-        voter = Voter(voter_row[0], voter_row[1], voter_row[2]) if voter_row else None
-        self.connection.commit()
+        :param: voters The voters to register, with normalized national IDs
+        :param: national_id_hashes The bcrypt hashes of their national IDs, in the same order, if national ID hashing
+                is enabled. Computed before the call, so that the write lock isn't held while hashing.
+        :returns: One Boolean per voter, in order: TRUE if that voter was registered, FALSE if a voter with the same
+                  national ID was already registered or appears earlier in the batch
+        """
+        with self._transaction() as cursor:
+            registered = self._get_registered_national_ids(cursor, [voter.national_id for voter in voters])
+            results = []
+            new_rows = []
+            for voter, national_id_hash in zip(voters, national_id_hashes or [None] * len(voters)):
+                is_new = voter.national_id not in registered
+                if is_new:
+                    registered.add(voter.national_id)
+                    new_rows.append(VotingStore._voter_row(voter, national_id_hash))
+                results.append(is_new)
+            cursor.executemany("""
+                INSERT INTO voter (first_name, last_name, national_id, lookup_key, national_id_hash, status, creation)
+                values (?,?,?,?,?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, new_rows)
+        if self.name_dictionary is not None:
+            for first_name, last_name, *_ in new_rows:
+                self.name_dictionary.add(first_name)
+                self.name_dictionary.add(last_name)
+        return results
 
-        return voter
+    @staticmethod
+    def _voter_row(voter: Voter, national_id_hash: Optional[bytes] = None) -> tuple:
+        today = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+        return (voter.first_name, voter.last_name, voter.national_id, national_id_lookup_key(voter.national_id),
+                national_id_hash, str(VoterStatus.REGISTERED_NOT_VOTED.value), today)
 
-    def get_status_voter(self, national_id: str) -> str:
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT status FROM voter WHERE national_id=?""", (national_id,))
-        status_voter = cursor.fetchone()
-        status_voter = status_voter[0] if status_voter else None
-        self.connection.commit()
+    @staticmethod
+    def _get_registered_national_ids(cursor: Cursor, national_ids: List[str],
+                                     max_parameters: int = 500) -> Set[str]:
+        """
+        Returns the subset of the given national IDs that are registered, using one indexed IN query per
+        `max_parameters` IDs.
+        """
+        national_ids_by_key = {national_id_lookup_key(national_id): national_id for national_id in national_ids}
+        lookup_keys = list(national_ids_by_key)
+        registered = set()
+        for start in range(0, len(lookup_keys), max_parameters):
+            chunk = lookup_keys[start:start + max_parameters]
+            cursor.execute("""SELECT lookup_key FROM voter WHERE lookup_key IN ({0})""".format(
+                ",".join("?" * len(chunk))), chunk)
+            registered.update(national_ids_by_key[row[0]] for row in cursor.fetchall())
+        return registered
+
+    def get_voter(self, national_id: str) -> Voter:
+        with self._reading() as cursor:
+            cursor.execute("""SELECT first_name, last_name, national_id FROM voter WHERE lookup_key=?""",
+                           (national_id_lookup_key(national_id),))
+            voter_row = cursor.fetchone()
+        return Voter.from_row(voter_row) if voter_row else None
+
+    def get_national_id_hash(self, national_id: str) -> Optional[bytes]:
+        """
+        :returns: The bcrypt hash the voter was registered with, or None if they weren't, or without national ID hashing
+        """
+        with self._reading() as cursor:
+            cursor.execute("""SELECT national_id_hash FROM voter WHERE lookup_key=?""",
+                           (national_id_lookup_key(national_id),))
+            row = cursor.fetchone()
+        return None if row is None else row[0]
 
-        return status_voter
+    def get_status_voter(self, national_id: str) -> str:
+        with self._reading() as cursor:
+            cursor.execute("""SELECT status FROM voter WHERE lookup_key=?""", (national_id_lookup_key(national_id),))
+            status_voter = cursor.fetchone()
+        return status_voter[0] if status_voter else None
 
     def update_status_voter(self, national_id: str, new_status: str):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        UPDATE voter
-        SET  status =?
-        WHERE national_id=?""", (new_status, national_id))
-        self.connection.commit()
+        with self._transaction() as cursor:
+            cursor.execute("""
+            UPDATE voter
+            SET  status =?
+            WHERE lookup_key=?""", (new_status, national_id_lookup_key(national_id)))
 
     def delete_voter(self, national_id: str) -> bool:
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute("""SELECT count(*) FROM voter WHERE national_id=?""", (national_id,))
-            status_voter = cursor.fetchone()
-            count_voter = int(status_voter[0]) if status_voter else 0
-
-            if count_voter > 0:
-                self.connection.execute("""
-                    DELETE FROM voter 
-                    WHERE national_id=?
-                """, (national_id,))
-                self.connection.commit()
-                return True
-            else:
+        with self._transaction() as cursor:
+            lookup_key = national_id_lookup_key(national_id)
+            cursor.execute("""SELECT first_name, last_name FROM voter WHERE lookup_key=?""", (lookup_key,))
+            voter_row = cursor.fetchone()
+            if voter_row is None:
                 return False
-        except Exception as e:
-            raise e
+            cursor.execute("""
+                DELETE FROM voter
+                WHERE lookup_key=?
+            """, (lookup_key,))
+        if self.name_dictionary is not None:
+            self.name_dictionary.remove(voter_row[0])
+            self.name_dictionary.remove(voter_row[1])
+        return True
+
+    def enable_name_dictionary(self, name_dictionary: Optional[NameDictionary] = None) -> NameDictionary:
+        """
+        Builds a NameDictionary with the names of every registered voter, which add_voter, add_voters and delete_voter
+        then keep up to date. Ballot comments are redacted against it, so that the names of other voters are redacted
+        too. Writes are blocked while the dictionary is built, so that no voter is missed.
 
-    def get_fraudulent_voters(self ) -> List[Voter]:
-        cursor = self.connection.cursor()
-        cursor.execute("""
-            SELECT first_name, last_name, national_id
-            FROM voter
-            WHERE status=?
-        """, (str(VoterStatus.FRAUD_COMMITTED.value),))
-        all_voter_rows = cursor.fetchall()
+        :param: name_dictionary The NameDictionary to add the names to, e.g. one shared by several stores. A new one by
+                default.
+        """
+        name_dictionary = name_dictionary if name_dictionary is not None else NameDictionary()
+        with self._transaction() as cursor:
+            for first_name, last_name in cursor.execute("""SELECT first_name, last_name FROM voter"""):
+                name_dictionary.add(first_name)
+                name_dictionary.add(last_name)
+            self.name_dictionary = name_dictionary
+        return name_dictionary
+
+    def disable_name_dictionary(self):
+        self.name_dictionary = None
+
+    def get_fraudulent_voters(self) -> List[Voter]:
+        with self._reading() as cursor:
+            cursor.execute("""
+                SELECT first_name, last_name, national_id
+                FROM voter
+                WHERE status=?
+            """, (str(VoterStatus.FRAUD_COMMITTED.value),))
+            all_voter_rows = cursor.fetchall()
         all_voters = [Voter(str(voter_row[0]), str(voter_row[1]), str(voter_row[2])) for voter_row in all_voter_rows]
-        self.connection.commit()
-        print(all_voters)
         return all_voters
 
     def add_ballot(self, national_id: str, ballot_number: str):
-        self.connection.execute("""INSERT INTO ballot (ballot_number, voter_national_id) VALUES (?, ?)""", (ballot_number,national_id ))
-        self.connection.commit()
+        ballot_key = ballot_number_lookup_key(ballot_number)
+        with self._transaction() as cursor:
+            # Added to the filter before the commit, so that the ballot can never be counted while missing from it
+            self._add_to_ballot_filter([ballot_key])
+            cursor.execute(
+                """
+                INSERT INTO ballot (ballot_number, ballot_key, voter_national_id, voter_lookup_key)
+                VALUES (?, ?, ?, ?)
+                """,
+                (ballot_number, ballot_key, national_id, national_id_lookup_key(national_id)))
+
+    def add_ballots(self, ballots: List[Tuple[str, str]]):
+        """
+        Adds many ballots in a single transaction.
 
-    def count_specified_validated_ballot(self,voter_national_id : str, ballot_number: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) FROM ballot WHERE voter_national_id=? AND ballot_number=? AND is_validated=true AND deleted=false""", 
-            (voter_national_id, ballot_number))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
+        :param: ballots (national_id, ballot_number) pairs
+        """
+        rows = [(national_id, national_id_lookup_key(national_id),
+                 ballot_number, ballot_number_lookup_key(ballot_number))
+                for national_id, ballot_number in ballots]
+        with self._transaction() as cursor:
+            self._add_to_ballot_filter([row[3] for row in rows])
+            cursor.executemany(
+                """
+                INSERT INTO ballot (voter_national_id, voter_lookup_key, ballot_number, ballot_key)
+                VALUES (?, ?, ?, ?)
+                """, rows)
+
+    def get_registered_national_ids(self, national_ids: List[str]) -> Set[str]:
+        """
+        Returns the subset of the given national IDs that belong to registered voters
+        """
+        with self._reading() as cursor:
+            return VotingStore._get_registered_national_ids(cursor, national_ids)
 
-        return all_ballots_count[0]
+    def might_have_ballot(self, ballot_number: str) -> bool:
+        """
+        Tells whether a ballot with this number may exist, from an in-process Bloom filter of the issued ballots, so
+        that made-up ballot numbers are turned away without a query. FALSE means that the ballot certainly doesn't
+        exist; TRUE is wrong about 1% of the time.
 
-    def is_ballont_to_voter(self,voter_national_id : str, ballot_number: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) FROM ballot WHERE voter_national_id=? AND ballot_number=?""", 
-            (voter_national_id, ballot_number))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
+        On a database file other processes may issue ballots too, so a miss is confirmed by reading the ballots added
+        since the filter was last brought up to date - a range read on the primary key, normally empty.
+        """
+        ballot_key = ballot_number_lookup_key(ballot_number)
+        ballot_filter = self._ballot_filter or self._load_ballot_filter()
+        if ballot_key in ballot_filter:
+            return True
+        if self.connections.is_memory():
+            # Only this store writes to its in-memory database, and every ballot it added is in the filter
+            return False
+        self._catch_up_ballot_filter()
+        return ballot_key in ballot_filter
+
+    def _load_ballot_filter(self) -> BloomFilter:
+        """
+        Builds the Bloom filter from every ballot key. It's built while holding the write lock, and published before
+        the lock is released, so that every ballot added afterwards is added to it.
+        """
+        with self._ballot_filter_lock:
+            if self._ballot_filter is None:
+                with self._transaction() as cursor:
+                    cursor.execute("""SELECT count(*), coalesce(max(ballot_id), 0) FROM ballot""")
+                    ballot_count, last_ballot_id = cursor.fetchone()
+                    ballot_filter = BloomFilter(max(1 << 16, 2 * ballot_count))
+                    cursor.execute("""SELECT ballot_key FROM ballot WHERE ballot_key IS NOT NULL""")
+                    while True:
+                        rows = cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        ballot_filter.update(row[0] for row in rows)
+                    self._ballot_filter_last_id = last_ballot_id
+                    self._ballot_filter = ballot_filter
+            return self._ballot_filter
+
+    def _catch_up_ballot_filter(self):
+        with self._ballot_filter_lock:
+            with self._reading() as cursor:
+                cursor.execute(
+                    """SELECT ballot_id, ballot_key FROM ballot WHERE ballot_id > ? ORDER BY ballot_id""",
+                    (self._ballot_filter_last_id,))
+                rows = cursor.fetchall()
+            self._ballot_filter.update(ballot_key for _, ballot_key in rows if ballot_key is not None)
+            if rows:
+                self._ballot_filter_last_id = rows[-1][0]
+
+    def _add_to_ballot_filter(self, ballot_keys: List[bytes]):
+        """
+        Adds the keys of new ballots to the Bloom filter, if it's loaded. Called inside the transaction that adds them.
+        """
+        if self._ballot_filter is not None:
+            self._ballot_filter.update(ballot_keys)
+
+    def count_specified_validated_ballot(self, voter_national_id: str, ballot_number: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*) FROM ballot
+                WHERE voter_lookup_key=? AND ballot_key=? AND is_validated=true AND deleted=false""",
+                (national_id_lookup_key(voter_national_id), ballot_number_lookup_key(ballot_number)))
+            return cursor.fetchone()[0]
+
+    def is_ballont_to_voter(self, voter_national_id: str, ballot_number: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*) FROM ballot WHERE voter_lookup_key=? AND ballot_key=?""",
+                (national_id_lookup_key(voter_national_id), ballot_number_lookup_key(ballot_number)))
+            return cursor.fetchone()[0]
+
+    def is_invalitated_ballot(self, ballot_number: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*)
+                FROM ballot
+                WHERE ballot_key=? AND is_validated=false""",
+                (ballot_number_lookup_key(ballot_number),))
+            return cursor.fetchone()[0]
+
+    def is_used_ballot(self, ballot_number: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*)
+                FROM ballot
+                WHERE ballot_key=? AND is_validated=true
+                AND is_used=true""",
+                (ballot_number_lookup_key(ballot_number),))
+            return cursor.fetchone()[0]
+
+    def is_existed_ballot(self, ballot_number: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*) FROM ballot WHERE ballot_key=?""",
+                (ballot_number_lookup_key(ballot_number),))
+            return cursor.fetchone()[0]
+
+    def count_casted_ballot(self, voter_national_id: str) -> int:
+        with self._reading() as cursor:
+            cursor.execute(
+                """SELECT count(*) FROM ballot
+                WHERE voter_lookup_key=? AND deleted=false
+                AND is_used=true
+                AND is_validated=true""",
+                (national_id_lookup_key(voter_national_id),))
+            return cursor.fetchone()[0]
 
-        return all_ballots_count[0]
+    def invalidated_ballot(self, ballot_number: str):
+        with self._transaction() as cursor:
+            cursor.execute("""
+            UPDATE ballot
+            SET  is_validated = false,
+                is_used = true
+            WHERE ballot_key=?""", (ballot_number_lookup_key(ballot_number), ))
 
-    def is_invalitated_ballot(self, ballot_number: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) 
-            FROM ballot 
-            WHERE ballot_number=? AND is_validated=false""", 
-            (ballot_number,))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
+    def validated_ballot(self, ballot_number: str):
+        with self._transaction() as cursor:
+            cursor.execute("""
+            UPDATE ballot
+            SET is_used = true
+            WHERE ballot_key=?""", (ballot_number_lookup_key(ballot_number), ))
+
+    def update_content_ballot(self, ballot_number: str, candidate_id: str, coment: str):
+        ballot_key = ballot_number_lookup_key(ballot_number)
+        with self._transaction() as cursor:
+            cursor.execute("""SELECT chosen_candidate_id FROM ballot WHERE ballot_key=?""", (ballot_key,))
+            for previous_candidate_row in cursor.fetchall():
+                VotingStore._add_to_tally(cursor, previous_candidate_row[0], -1)
+                VotingStore._add_to_tally(cursor, candidate_id, 1)
+            cursor.execute("""
+            UPDATE ballot
+            SET chosen_candidate_id =?,
+                voter_comments =?
+            WHERE ballot_key=?""", (candidate_id, coment, ballot_key))
+
+    def cast_ballot(self, ballot: Ballot, voter_national_id: str,
+                    redact_comment: Optional[Callable[[Voter, str], str]] = None) -> BallotStatus:
+        """
+        Validates and counts a ballot in a single transaction: one combined lookup for the voter and every ballot check,
+        then the status change, and a single commit. The checks run in the same order as the individual store methods
+        (get_voter, is_ballont_to_voter, is_invalitated_ballot, count_casted_ballot) so the BallotStatus is the same.
+
+        :param: ballot The ballot to count
+        :param: voter_national_id The sensitive ID of the voter who the ballot corresponds to
+        :param: redact_comment Optional callback that receives the voter and the raw comment, and returns the comment
+                to store. Only called when the ballot is counted.
+        :returns: The BallotStatus after the ballot has been processed
+        """
+        with self._transaction() as cursor:
+            return VotingStore._cast_ballot(cursor, ballot, voter_national_id, redact_comment)
 
-        return all_ballots_count[0]
+    def cast_ballots(self, ballots: List[Tuple[Ballot, str]],
+                     redact_comment: Optional[Callable[[Voter, str], str]] = None
+                     ) -> List[Union[BallotStatus, Exception]]:
+        """
+        Validates and counts many ballots in a single transaction (a group commit), in the order given. Each ballot sees
+        the ones before it, so a voter who appears twice in the batch gets exactly one counted ballot, as if they had
+        been cast one by one. If a ballot fails, the batch is rolled back and counted again with a savepoint per ballot,
+        so that only the failed ballot's own changes are undone.
+
+        :param: ballots (ballot, voter_national_id) pairs
+        :param: redact_comment See cast_ballot
+        :returns: The BallotStatus of each ballot, or the exception raised while processing it
+        """
+        try:
+            with self._transaction() as cursor:
+                return [VotingStore._cast_ballot(cursor, ballot, voter_national_id, redact_comment)
+                        for ballot, voter_national_id in ballots]
+        except Exception:
+            pass
+
+        results = []
+        with self._transaction() as cursor:
+            for ballot, voter_national_id in ballots:
+                cursor.execute("SAVEPOINT cast_ballot")
+                try:
+                    results.append(VotingStore._cast_ballot(cursor, ballot, voter_national_id, redact_comment))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO cast_ballot")
+                    results.append(e)
+                cursor.execute("RELEASE cast_ballot")
+        return results
 
-    def is_used_ballot(self, ballot_number: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) 
-            FROM ballot 
-            WHERE ballot_number=? AND is_validated=true
-            AND is_used=true""", 
-            (ballot_number,))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
-
-        return all_ballots_count[0]
-
-    def is_existed_ballot(self, ballot_number: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) FROM ballot WHERE ballot_number=?""", 
-            (ballot_number,))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
-
-        return all_ballots_count[0]
-    
-    def count_casted_ballot(self, voter_national_id: str ) -> int:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """SELECT count(*) FROM ballot 
-            WHERE voter_national_id=? AND deleted=false 
-            AND is_used=true
-            AND is_validated=true""", 
-            (voter_national_id,))
-        all_ballots_count = cursor.fetchone()
-        self.connection.commit()
-
-        return all_ballots_count[0]
-    
-    def invalidated_ballot(self, ballot_number: str):
-        cursor = self.connection.cursor()
+    @staticmethod
+    def _cast_ballot(cursor: Cursor, ballot: Ballot, voter_national_id: str,
+                     redact_comment: Optional[Callable[[Voter, str], str]]) -> BallotStatus:
+        """
+        The body of cast_ballot, inside the caller's transaction
+        """
+        # The ownership count also proves that the ballot exists, so no separate existence check is needed.
+        lookup_key = national_id_lookup_key(voter_national_id)
+        ballot_key = ballot_number_lookup_key(ballot.ballot_number)
         cursor.execute("""
-        UPDATE ballot
-        SET  is_validated = false,
-            is_used = true
-        WHERE ballot_number=?""", (ballot_number, ))
-        self.connection.commit()    
-    
-    def validated_ballot(self, ballot_number: str):
-        cursor = self.connection.cursor()
+            SELECT v.first_name, v.last_name, v.national_id,
+                (SELECT count(*) FROM ballot b
+                    WHERE b.voter_lookup_key=v.lookup_key AND b.ballot_key=:ballot_key),
+                (SELECT count(*) FROM ballot b
+                    WHERE b.ballot_key=:ballot_key AND b.is_validated=false),
+                (SELECT count(*) FROM ballot b
+                    WHERE b.voter_lookup_key=v.lookup_key AND b.deleted=false
+                    AND b.is_used=true AND b.is_validated=true)
+            FROM voter v
+            WHERE v.lookup_key=:lookup_key
+        """, {"ballot_key": ballot_key, "lookup_key": lookup_key})
+        row = cursor.fetchone()
+        if row is None:
+            return BallotStatus.VOTER_NOT_REGISTERED
+        first_name, last_name, national_id, owned_count, invalidated_count, casted_count = row
+        if owned_count == 0:
+            return BallotStatus.VOTER_BALLOT_MISMATCH
+        if invalidated_count > 0:
+            return BallotStatus.INVALID_BALLOT
+
+        if casted_count > 0:
+            cursor.execute("""UPDATE voter SET status=? WHERE lookup_key=?""",
+                           (str(VoterStatus.FRAUD_COMMITTED.value), lookup_key))
+            # Only an unused ballot is invalidated: resubmitting the counted ballot must leave it counted, or the
+            # voter's next ballot would find no counted ballot and be counted too
+            cursor.execute("""
+                UPDATE ballot SET is_validated=false, is_used=true WHERE ballot_key=? AND is_used=false
+            """, (ballot_key,))
+            return BallotStatus.FRAUD_COMMITTED
+
+        comment = ballot.voter_comments
+        if redact_comment is not None:
+            comment = redact_comment(Voter(first_name, last_name, national_id), comment)
+        cursor.execute("""UPDATE voter SET status=? WHERE lookup_key=?""",
+                       (str(VoterStatus.BALLOT_COUNTED.value), lookup_key))
         cursor.execute("""
-        UPDATE ballot
-        SET is_used = true
-        WHERE ballot_number=?""", (ballot_number, ))
-        self.connection.commit()
+            UPDATE ballot
+            SET is_used=true,
+                chosen_candidate_id=?,
+                voter_comments=?
+            WHERE ballot_key=?""", (ballot.chosen_candidate_id, comment, ballot_key))
+        VotingStore._add_to_tally(cursor, ballot.chosen_candidate_id, 1)
+        return BallotStatus.BALLOT_COUNTED
 
-    def update_content_ballot(self, ballot_number: str, candidate_id: str, coment: str):
-        cursor = self.connection.cursor()
+    @staticmethod
+    def _add_to_tally(cursor: Cursor, candidate_id: Optional[str], votes: int):
+        """
+        Adds votes (or removes them, if negative) to a candidate in the tally, inside the caller's transaction
+        """
+        if candidate_id is None:
+            return
         cursor.execute("""
-        UPDATE ballot
-        SET chosen_candidate_id =?,
-            voter_comments =?
-        WHERE ballot_number=?""", (candidate_id, coment, ballot_number))
-        self.connection.commit()
-
-    def get_most_voted(self) -> List[str]:
-        cursor = self.connection.cursor()
+            INSERT INTO tally (candidate_id, votes) VALUES (?, ?)
+            ON CONFLICT (candidate_id) DO UPDATE SET votes = votes + excluded.votes
+        """, (str(candidate_id), votes))
+
+    def iter_comment_records(self, page_size: int = 1000) -> Iterator[Tuple[int, str, str, str, str]]:
+        """
+        Iterates over every stored ballot comment together with the voter it belongs to, one page of `page_size` rows
+        per query. The pages are keyed on ballot_id, so rows can be updated while iterating, and no read is held open
+        between pages.
+
+        :returns: (ballot_id, comment, first_name, last_name, national_id) tuples. The names are empty if the voter has
+                  since been de-registered.
+        """
+        last_ballot_id = 0
+        while True:
+            with self._reading() as cursor:
+                cursor.execute("""
+                    SELECT b.ballot_id, b.voter_comments,
+                        coalesce(v.first_name, ''), coalesce(v.last_name, ''), b.voter_national_id
+                    FROM ballot b
+                    LEFT JOIN voter v ON v.lookup_key = b.voter_lookup_key
+                    WHERE b.ballot_id > ? AND b.voter_comments IS NOT NULL
+                    ORDER BY b.ballot_id
+                    LIMIT ?
+                """, (last_ballot_id, page_size))
+                page = cursor.fetchall()
+            if not page:
+                return
+            yield from page
+            last_ballot_id = page[-1][0]
+
+    def update_comments(self, comments: List[Tuple[str, int]]):
+        """
+        Overwrites many ballot comments in a single transaction.
+
+        :param: comments (comment, ballot_id) pairs
+        """
+        with self._transaction() as cursor:
+            cursor.executemany("""UPDATE ballot SET voter_comments=? WHERE ballot_id=?""", comments)
+
+    def get_most_voted(self) -> List[Tuple[str, int]]:
+        """
+        Returns the (candidate_id, votes) of every candidate that got votes, most voted first. Reads the tally, so it
+        takes time in the number of candidates, not of ballots.
+        """
+        with self._reading() as cursor:
+            cursor.execute(
+                """
+                SELECT candidate_id, votes
+                FROM tally
+                WHERE votes > 0
+                ORDER BY votes DESC, candidate_id
+                """,
+            )
+            all_candidate_rows = cursor.fetchall()
+        return [(str(candidate_row[0]), int(candidate_row[1])) for candidate_row in all_candidate_rows]
+
+    def get_standings(self) -> List[Tuple[Candidate, int]]:
+        """
+        Returns every registered candidate that got votes, with their votes, most voted first, in a single query
+        """
+        with self._reading() as cursor:
+            cursor.execute(
+                """
+                SELECT c.candidate_id, c.name, t.votes
+                FROM tally t
+                JOIN candidates c ON c.candidate_id = t.candidate_id
+                WHERE t.votes > 0
+                ORDER BY t.votes DESC, t.candidate_id
+                """,
+            )
+            all_candidate_rows = cursor.fetchall()
+        return [(Candidate.from_row(candidate_row), int(candidate_row[2]))
+                for candidate_row in all_candidate_rows]
+
+    @staticmethod
+    def _count_votes(cursor: Cursor) -> List[Tuple[str, int]]:
+        """
+        Counts the votes per candidate with a full scan of the ballots, as the tally should have them
+        """
         cursor.execute(
             """
             SELECT chosen_candidate_id, count(*) as voter
-            FROM ballot 
+            FROM ballot
             WHERE chosen_candidate_id is not null
             GROUP BY chosen_candidate_id
             ORDER BY 2 DESC
-            """, 
+            """,
         )
-        all_candidate_rows = cursor.fetchall()
-        all_ballots_count = [(str(candidate_row[0]), int(candidate_row[1])) for candidate_row in all_candidate_rows]
-        self.connection.commit()
+        return [(str(candidate_row[0]), int(candidate_row[1])) for candidate_row in cursor.fetchall()]
 
-        return all_ballots_count
+    def reconcile_tally(self) -> bool:
+        """
+        Checks the tally against a full count of the ballots, and rebuilds it from the ballots if they disagree. Meant
+        to be run periodically, not per request: it scans the whole ballot table.
 
-    def get_comments(self) -> List[str]:
-        cursor = self.connection.cursor()
-        cursor.execute(
-            """
-            SELECT voter_comments
-            FROM ballot 
-            WHERE deleted = false
-            AND is_validated = true
-            """, 
-        )
-        all_comments_rows = cursor.fetchall()
-        all_comment = [ str(comment_row[0]) for comment_row in all_comments_rows]
-        self.connection.commit()
+        :returns: True if the tally was correct, False if it had to be rebuilt
+        """
+        with self._transaction() as cursor:
+            counted_votes = dict(VotingStore._count_votes(cursor))
+            cursor.execute("""SELECT candidate_id, votes FROM tally WHERE votes != 0""")
+            if dict(cursor.fetchall()) == counted_votes:
+                return True
+            cursor.execute("""DELETE FROM tally""")
+            cursor.executemany("""INSERT INTO tally (candidate_id, votes) VALUES (?, ?)""", counted_votes.items())
+            return False
 
-        return all_comment
+    def iter_comments(self, page_size: int = 1000) -> Iterator[str]:
+        """
+        Iterates over the non-empty comments of the validated ballots, one page of `page_size` rows per query. The pages
+        are keyed on ballot_id, so memory use doesn't grow with the number of ballots, and no read is held open between
+        pages.
+        """
+        last_ballot_id = 0
+        while True:
+            with self._reading() as cursor:
+                cursor.execute("""
+                    SELECT ballot_id, voter_comments
+                    FROM ballot
+                    WHERE ballot_id > ?
+                    AND deleted = false
+                    AND is_validated = true
+                    AND voter_comments IS NOT NULL AND voter_comments != ''
+                    ORDER BY ballot_id
+                    LIMIT ?
+                """, (last_ballot_id, page_size))
+                page = cursor.fetchall()
+            if not page:
+                return
+            for comment_row in page:
+                yield comment_row[1]
+            last_ballot_id = page[-1][0]
+
+    def get_comments(self) -> List[str]:
+        with self._reading() as cursor:
+            cursor.execute(
+                """
+                SELECT voter_comments
+                FROM ballot
+                WHERE deleted = false
+                AND is_validated = true
+                """,
+            )
+            all_comments_rows = cursor.fetchall()
+        return [str(comment_row[0]) for comment_row in all_comments_rows]
 
     # TODO: If you create more tables in the create_tables method, feel free to add more methods here to make accessing
     #       data from those tables easier. See get_all_candidates, get_candidates and add_candidate for examples of how
     #       to do this.
 
+
+def rekey_lookup_keys(database: str, shard_count: int = 1) -> bool:
+    """
+    Maintenance step, to run once the NATIONAL_ID_LOOKUP_KEY is rotated, with the new key configured, while no store
+    has the database open: recomputes the lookup keys of every voter and ballot with the new key.
+
+    :param: database Path of the sqlite database file
+    :param: shard_count The number of shards, if the database is sharded
+    :returns: Boolean TRUE if the lookup keys had to be recomputed
+    """
+    if shard_count > 1:
+        from backend.main.store.sharded_store import shard_database
+        return any([rekey_lookup_keys(shard_database(database, shard_index)) for shard_index in range(shard_count)])
+    store = VotingStore(database, check_lookup_keys=False)
+    try:
+        return store.update_lookup_keys()
+    finally:
+        store.close()
@@ -0,0 +1,308 @@
+#
+# This file contains the opt-in instrumentation of the VotingStore: call counts, latency histograms and row counts for
+# every store method and every SQL statement, exposed as a Python snapshot and in the Prometheus text format.
+#
+
+import bisect
+import functools
+import inspect
+import re
+import threading
+import time
+from sqlite3 import Connection, Cursor
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds, in seconds, of the latency histogram buckets; the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+# sqlite calls the progress handler once every this many virtual machine instructions. The instructions executed are
+# the closest measure of the rows a statement scanned that sqlite gives us.
+VM_STEPS_PER_CALLBACK = 100
+
+# Statements whose query plan is looked up to tell whether they scan a whole table
+EXPLAINABLE_STATEMENT_REGEX = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+class OperationMetrics:
+    """
+    The metrics of one store method or SQL statement. The latency of a statement is that of its execute call, which in
+    sqlite3 runs it up to its first row; the rows fetched afterwards are counted, with their VM steps, but not timed.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.rows_returned = 0
+        self.vm_steps = 0
+        self.full_scan: Optional[bool] = None
+
+    def observe(self, seconds: float, failed: bool = False):
+        self.calls += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_dict(self) -> dict:
+        cumulative_count = 0
+        buckets = {}
+        for upper_bound, bucket_count in zip(LATENCY_BUCKETS + [float("inf")], self.bucket_counts):
+            cumulative_count += bucket_count
+            buckets["+Inf" if upper_bound == float("inf") else repr(upper_bound)] = cumulative_count
+        metrics = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": self.total_seconds,
+            "latency_buckets": buckets,
+            "rows_returned": self.rows_returned,
+            "vm_steps": self.vm_steps,
+        }
+        if self.full_scan is not None:
+            metrics["full_scan"] = self.full_scan
+        return metrics
+
+
+class StoreMetrics:
+    """
+    Collects the metrics of a VotingStore. See VotingStore.enable_instrumentation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self.methods: Dict[str, OperationMetrics] = {}
+        self.statements: Dict[str, OperationMetrics] = {}
+        self._explained_statements = set()
+
+    def _operation(self, operations: Dict[str, OperationMetrics], name: str) -> OperationMetrics:
+        operation = operations.get(name)
+        if operation is None:
+            operation = operations.setdefault(name, OperationMetrics())
+        return operation
+
+    def _method_stack(self) -> List[str]:
+        stack = getattr(self._thread_local, "method_stack", None)
+        if stack is None:
+            stack = self._thread_local.method_stack = []
+        return stack
+
+    def count_vm_steps(self) -> int:
+        """
+        The progress handler installed on the store's connections. Returns 0 so that sqlite carries on.
+        """
+        self._thread_local.vm_callbacks = getattr(self._thread_local, "vm_callbacks", 0) + 1
+        return 0
+
+    def _vm_steps(self) -> int:
+        return getattr(self._thread_local, "vm_callbacks", 0) * VM_STEPS_PER_CALLBACK
+
+    def instrument_connection(self, connection: Connection):
+        connection.set_progress_handler(self.count_vm_steps, VM_STEPS_PER_CALLBACK)
+
+    def instrument_method(self, name: str, method: Callable) -> Callable:
+        """
+        Wraps a store method so that each call is timed. Generator methods are timed over their whole iteration.
+        """
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def timed_generator(*args, **kwargs):
+                generator = method(*args, **kwargs)
+                seconds, failed = 0.0, False
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        self._method_stack().append(name)
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        except BaseException:
+                            failed = True
+                            raise
+                        finally:
+                            self._method_stack().pop()
+                            seconds += time.perf_counter() - started
+                        yield item
+                finally:
+                    with self._lock:
+                        self._operation(self.methods, name).observe(seconds, failed)
+            return timed_generator
+
+        @functools.wraps(method)
+        def timed_method(*args, **kwargs):
+            stack = self._method_stack()
+            stack.append(name)
+            failed = False
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                stack.pop()
+                with self._lock:
+                    self._operation(self.methods, name).observe(seconds, failed)
+        return timed_method
+
+    def _record_statement(self, sql: str, seconds: float, vm_steps: int, failed: bool,
+                          full_scan: Optional[bool] = None):
+        with self._lock:
+            statement = self._operation(self.statements, sql)
+            statement.observe(seconds, failed)
+            if full_scan is not None:
+                statement.full_scan = full_scan
+        self._record_rows(sql, 0, vm_steps)
+
+    def _record_rows(self, sql: str, rows: int, vm_steps: int):
+        """
+        Adds rows and VM steps to a statement, and to the store method running it
+        """
+        method_stack = self._method_stack()
+        with self._lock:
+            statement = self._operation(self.statements, sql)
+            statement.rows_returned += rows
+            statement.vm_steps += vm_steps
+            if method_stack:
+                method = self._operation(self.methods, method_stack[-1])
+                method.rows_returned += rows
+                method.vm_steps += vm_steps
+
+    def _needs_query_plan(self, sql: str) -> bool:
+        """
+        Whether the query plan of the statement is still to be looked up. Each statement is only explained once.
+        """
+        with self._lock:
+            if sql in self._explained_statements:
+                return False
+            self._explained_statements.add(sql)
+        return bool(EXPLAINABLE_STATEMENT_REGEX.match(sql))
+
+    def snapshot(self) -> dict:
+        """
+        :returns: A copy of every metric, as plain dicts: {"methods": {name: metrics}, "statements": {sql: metrics}}
+        """
+        with self._lock:
+            return {
+                "methods": {name: operation.to_dict() for name, operation in sorted(self.methods.items())},
+                "statements": {sql: operation.to_dict() for sql, operation in sorted(self.statements.items())},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.methods.clear()
+            self.statements.clear()
+            self._explained_statements.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        :returns: Every metric in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind, label in (("method", "method"), ("sql", "statement")):
+            operations = snapshot["methods" if kind == "method" else "statements"]
+            prefix = "voting_store_{0}".format(kind)
+            lines.append("# HELP {0}_duration_seconds Latency of the VotingStore {1}s".format(prefix, label))
+            lines.append("# TYPE {0}_duration_seconds histogram".format(prefix))
+            for name, metrics in operations.items():
+                escaped_name = _escape_label_value(name)
+                for upper_bound, cumulative_count in metrics["latency_buckets"].items():
+                    lines.append('{0}_duration_seconds_bucket{{{1}="{2}",le="{3}"}} {4}'.format(
+                        prefix, label, escaped_name, upper_bound, cumulative_count))
+                lines.append('{0}_duration_seconds_sum{{{1}="{2}"}} {3!r}'.format(
+                    prefix, label, escaped_name, metrics["total_seconds"]))
+                lines.append('{0}_duration_seconds_count{{{1}="{2}"}} {3}'.format(
+                    prefix, label, escaped_name, metrics["calls"]))
+            for metric, help_text in (("errors", "Calls that raised"),
+                                      ("rows_returned", "Rows fetched from the database"),
+                                      ("vm_steps", "sqlite VM instructions executed, a proxy for the rows scanned")):
+                lines.append("# HELP {0}_{1}_total {2}".format(prefix, metric, help_text))
+                lines.append("# TYPE {0}_{1}_total counter".format(prefix, metric))
+                for name, metrics in operations.items():
+                    lines.append('{0}_{1}_total{{{2}="{3}"}} {4}'.format(
+                        prefix, metric, label, _escape_label_value(name), metrics[metric]))
+        lines.append("# HELP voting_store_sql_full_scan 1 if the query plan of the statement scans a whole table")
+        lines.append("# TYPE voting_store_sql_full_scan gauge")
+        for sql, metrics in snapshot["statements"].items():
+            if "full_scan" in metrics:
+                lines.append('voting_store_sql_full_scan{{statement="{0}"}} {1}'.format(
+                    _escape_label_value(sql), int(metrics["full_scan"])))
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _normalize_sql(sql: str) -> str:
+    return WHITESPACE_REGEX.sub(" ", sql).strip()
+
+
+class InstrumentedCursor:
+    """
+    A sqlite cursor that records the latency, the rows returned and the VM steps of every statement it runs
+    """
+
+    def __init__(self, cursor: Cursor, metrics: StoreMetrics):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._sql: Optional[str] = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _run(self, operation: Callable, sql: str, parameters, explain: bool):
+        sql_text = _normalize_sql(sql)
+        full_scan = None
+        if explain and self._metrics._needs_query_plan(sql_text):
+            full_scan = self._is_full_scan(sql, parameters)
+        steps_before = self._metrics._vm_steps()
+        failed = False
+        started = time.perf_counter()
+        try:
+            operation(sql, parameters)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._metrics._record_statement(sql_text, time.perf_counter() - started,
+                                            self._metrics._vm_steps() - steps_before, failed, full_scan)
+        self._sql = sql_text
+        return self
+
+    def _is_full_scan(self, sql: str, parameters) -> Optional[bool]:
+        try:
+            plan = self._cursor.connection.execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except Exception:
+            return None
+        return any(row[-1].startswith("SCAN") for row in plan)
+
+    def execute(self, sql: str, parameters=()):
+        return self._run(self._cursor.execute, sql, parameters, explain=True)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self._run(self._cursor.executemany, sql, seq_of_parameters, explain=False)
+
+    def _fetch(self, fetch: Callable, *args):
+        steps_before = self._metrics._vm_steps()
+        result = fetch(*args)
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        if self._sql is not None:
+            self._metrics._record_rows(self._sql, rows, self._metrics._vm_steps() - steps_before)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size: Optional[int] = None):
+        return self._fetch(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
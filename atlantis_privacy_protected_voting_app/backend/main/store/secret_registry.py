@@ -3,12 +3,22 @@
 # variables
 #
 
+import hashlib
+import hmac
 import os
+import threading
 import bcrypt
 from base64 import b64encode, b64decode
-from typing import Optional
+from typing import Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from Crypto.Random import get_random_bytes
 
 UTF_8 = "utf-8"
+# The secret NAME_VERSION holds the current version of the key NAME
+KEY_VERSION_SUFFIX = "_VERSION"
+KEY_SIZE = 32
+
+T = TypeVar("T")
 
 
 def get_secret_str(secret_name: str) -> Optional[str]:
@@ -23,6 +33,7 @@ def overwrite_secret_str(secret_name: str, secret_value: str):
     Will overwrite the secret, even if there already is a secret present for the given secret_name
     """
     os.environ[secret_name] = secret_value
+    KEY_RING.invalidate(secret_name)
 
 
 def get_secret_bytes(secret_name: str) -> Optional[bytes]:
@@ -40,7 +51,151 @@ def overwrite_secret_bytes(secret_name: str, secret_value: bytes):
     Will overwrite the secret, even if there already is a secret present for the given secret_name
     """
     os.environ[secret_name] = b64encode(secret_value).decode(UTF_8)
+    KEY_RING.invalidate(secret_name)
+
+
+def gen_salt(rounds: int = 12) -> bytes:
+    """
+    A bcrypt salt, which also carries the work factor: hashing costs 2^rounds iterations of the key schedule
+    """
+    return bcrypt.gensalt(rounds)
+
+
+class KeyRing:
+    """
+    Loads and decodes keys from the secrets once, and caches them along with the objects built from them - ciphers,
+    HMAC states - so that the hot paths get a ready key with a dictionary lookup.
+
+    Keys are versioned, so they can be rotated: version 1 of the key NAME is the secret NAME, version v > 1 is the
+    secret NAME_V<v>, and the secret NAME_VERSION holds the current version (1 if it's missing). New ciphertexts are
+    made with the current version and carry its number, so the ones made with older versions can still be read.
+
+    Overwriting a secret through overwrite_secret_bytes or overwrite_secret_str drops what was cached from it, and
+    counts as configuring it.
+    """
+
+    def __init__(self):
+        # Reentrant, since creating and rotating keys overwrite secrets, which invalidates
+        self._lock = threading.RLock()
+        # By secret name
+        self._keys: Dict[str, bytes] = {}
+        # By (secret name, factory)
+        self._objects: Dict[Tuple[str, Callable[[bytes, int], object]], object] = {}
+        # By key name
+        self._current_versions: Dict[str, int] = {}
+        # The secret names of the keys this process generated, which only its environment (and its children's) holds
+        self._generated: Set[str] = set()
+
+    @staticmethod
+    def secret_name(name: str, version: int) -> str:
+        """
+        :returns: The name of the secret that holds the given version of the key
+        """
+        return name if version == 1 else "{0}_V{1}".format(name, version)
+
+    def current_version(self, name: str) -> int:
+        version = self._current_versions.get(name)
+        if version is None:
+            version = int(get_secret_str(name + KEY_VERSION_SUFFIX) or 1)
+            self._current_versions[name] = version
+        return version
+
+    def get_key(self, name: str, version: Optional[int] = None) -> Optional[bytes]:
+        """
+        :param: name The name of the key
+        :param: version The version of the key, by default the current one
+        :returns: The key, or None if there's no such key or version
+        """
+        secret_name = KeyRing.secret_name(name, version or self.current_version(name))
+        key = self._keys.get(secret_name)
+        if key is None:
+            key = get_secret_bytes(secret_name)
+            if key is not None:
+                self._keys[secret_name] = key
+        return key
+
+    def get_or_create_key(self, name: str, size: int = KEY_SIZE) -> bytes:
+        """
+        Gets the current version of a key, generating a random one on first use. Storing the generated key in the
+        secrets lets processes started from this one use it too, but it's gone once they exit: see is_generated.
+        """
+        key = self.get_key(name)
+        if key is None:
+            with self._lock:
+                key = self.get_key(name)
+                if key is None:
+                    key = get_random_bytes(size)
+                    secret_name = KeyRing.secret_name(name, self.current_version(name))
+                    overwrite_secret_bytes(secret_name, key)
+                    self._keys[secret_name] = key
+                    self._generated.add(secret_name)
+        return key
+
+    def is_generated(self, name: str) -> bool:
+        """
+        :returns: True if the current version of the key was generated by this process rather than configured in the
+                  secrets. Nothing that outlives the process, e.g. a database file, may depend on such a key.
+        """
+        return KeyRing.secret_name(name, self.current_version(name)) in self._generated
+
+    def rotate(self, name: str, size: int = KEY_SIZE) -> int:
+        """
+        Generates a new version of a key and makes it the current one. The older versions are kept, to read what was
+        made with them.
+
+        :returns: The new version
+        """
+        with self._lock:
+            version = self.current_version(name) + 1
+            secret_name = KeyRing.secret_name(name, version)
+            overwrite_secret_bytes(secret_name, get_random_bytes(size))
+            overwrite_secret_str(name + KEY_VERSION_SUFFIX, str(version))
+            self._generated.add(secret_name)
+            return version
+
+    def get_object(self, name: str, version: Optional[int], factory: Callable[[bytes, int], T]) -> Optional[T]:
+        """
+        Gets the object that factory builds from a key, e.g. a cipher, building it on first use only.
+
+        :param: version The version of the key, by default the current one
+        :param: factory Builds the object from the key and its version. The object is shared, so it must be safe to
+                share, and the factory must be the same function object on every call, e.g. a module-level function.
+        :returns: The object, or None if there's no such key or version
+        """
+        version = version or self.current_version(name)
+        secret_name = KeyRing.secret_name(name, version)
+        built_object = self._objects.get((secret_name, factory))
+        if built_object is None:
+            key = self.get_key(name, version)
+            if key is None:
+                return None
+            built_object = factory(key, version)
+            self._objects[(secret_name, factory)] = built_object
+        return built_object
+
+    def get_hmac(self, name: str, version: Optional[int] = None) -> Optional[hmac.HMAC]:
+        """
+        Gets the HMAC-SHA256 state keyed with a key. Callers copy() it and feed the copy, which skips hashing the key
+        for every message.
+        """
+        return self.get_object(name, version, _new_hmac)
+
+    def invalidate(self, secret_name: str):
+        """
+        Drops what was cached from a secret
+        """
+        with self._lock:
+            self._keys.pop(secret_name, None)
+            self._generated.discard(secret_name)
+            for cached in list(self._objects):
+                if cached[0] == secret_name:
+                    self._objects.pop(cached, None)
+            if secret_name.endswith(KEY_VERSION_SUFFIX):
+                self._current_versions.pop(secret_name[:-len(KEY_VERSION_SUFFIX)], None)
+
+
+def _new_hmac(key: bytes, version: int) -> hmac.HMAC:
+    return hmac.new(key, digestmod=hashlib.sha256)
 
 
-def gen_salt() -> bytes:
-    return bcrypt.gensalt()
+KEY_RING = KeyRing()
@@ -0,0 +1,356 @@
+#
+# This file contains the sharded variant of the VotingStore, for electorates whose write load is more than a single
+# sqlite database can take. Set VOTING_STORE_SHARDS to the number of shards and VotingStore.get_instance() returns a
+# ShardedVotingStore, which has the same methods, so the API modules work with either.
+#
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import methodcaller
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.national_id import normalize_national_id
+from backend.main.objects.voter import Voter, BallotStatus
+from backend.main.detection.name_dictionary import NameDictionary
+from backend.main.store.connection_manager import MEMORY_DATABASE
+from backend.main.store.data_registry import VotingStore, DATABASE_ENV_VARIABLE
+from backend.main.store.instrumentation import StoreMetrics
+
+# Name of the setting that records which shard of how many a database is
+SHARD_SETTING = "shard"
+
+T = TypeVar("T")
+
+
+def shard_database(database: str, shard_index: int) -> str:
+    """
+    The database file of a shard: voting.db is split into voting.shard0.db, voting.shard1.db, ...
+    """
+    if database == MEMORY_DATABASE:
+        return MEMORY_DATABASE
+    root, extension = os.path.splitext(database)
+    return "{0}.shard{1}{2}".format(root, shard_index, extension)
+
+
+def shard_of(national_id: str, shard_count: int) -> int:
+    """
+    The shard that holds a voter and their ballots: a stable hash of the normalized national ID. Unlike the lookup key,
+    it doesn't depend on any secret, so rotating the lookup key never moves a voter.
+    """
+    digest = hashlib.blake2b(normalize_national_id(national_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class ShardedVotingStore:
+    """
+    A VotingStore partitioned over `shard_count` databases. Each voter, with the ballots issued to them, lives in the
+    shard picked by shard_of, so every voter and ballot operation runs on a single shard, and writes to different shards
+    run in parallel. The candidates are kept by the first shard.
+
+    Operations that only know a ballot number, and the aggregates (the tally, the comments, the fraudulent voters), are
+    sent to every shard in parallel and their results merged. The number of shards of a database can't be changed once
+    it holds data: opening it with another number raises a ValueError.
+    """
+
+    def __init__(self, shard_count: int, database: Optional[str] = None):
+        """
+        DO NOT call this method directly - instead set VOTING_STORE_SHARDS and use the VotingStore.get_instance method.
+
+        :param: shard_count The number of shards
+        :param: database Path of the sqlite database file, from which the shard files are named. Defaults to the
+                VOTING_STORE_DATABASE environment variable, and to in-memory databases when that isn't set either.
+        """
+        if shard_count < 1:
+            raise ValueError("A sharded store needs at least one shard")
+        database = database or os.getenv(DATABASE_ENV_VARIABLE) or MEMORY_DATABASE
+        self.shards = [VotingStore(shard_database(database, shard_index)) for shard_index in range(shard_count)]
+        self.executor = ThreadPoolExecutor(max_workers=shard_count, thread_name_prefix="voting-shard")
+        self.name_dictionary: Optional[NameDictionary] = None
+        self.metrics: Optional[StoreMetrics] = None
+        try:
+            for shard_index, shard in enumerate(self.shards):
+                ShardedVotingStore._check_shard(shard, shard_index, shard_count)
+        except ValueError:
+            self.close()
+            raise
+        if any(shard.metrics is not None for shard in self.shards):
+            # VOTING_STORE_INSTRUMENTATION instrumented each shard on its own; collect into one StoreMetrics instead
+            self.disable_instrumentation()
+            self.enable_instrumentation()
+
+    @staticmethod
+    def _check_shard(shard: VotingStore, shard_index: int, shard_count: int):
+        expected = "{0}/{1}".format(shard_index, shard_count)
+        with shard._transaction() as cursor:
+            cursor.execute("""SELECT value FROM store_settings WHERE name=?""", (SHARD_SETTING,))
+            shard_row = cursor.fetchone()
+            if shard_row is None:
+                cursor.execute("""INSERT INTO store_settings (name, value) VALUES (?, ?)""",
+                               (SHARD_SETTING, expected))
+            elif shard_row[0] != expected:
+                raise ValueError("The database of shard {0} was created as shard {1}".format(expected, shard_row[0]))
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.shards)
+
+    @property
+    def primary(self) -> VotingStore:
+        """
+        The shard that keeps the candidates
+        """
+        return self.shards[0]
+
+    @property
+    def candidates_version(self) -> int:
+        return self.primary.candidates_version
+
+    def shard_for(self, national_id: str) -> VotingStore:
+        return self.shards[shard_of(national_id, self.shard_count)]
+
+    def _scatter(self, operation: Callable[[VotingStore], T]) -> List[T]:
+        """
+        Runs an operation on every shard in parallel, and returns the results in shard order
+        """
+        return list(self.executor.map(operation, self.shards))
+
+    def _partition(self, items: List, national_id_of: Callable) -> Dict[int, List[int]]:
+        """
+        Groups the positions of the items by the shard of their national ID
+        """
+        positions_by_shard: Dict[int, List[int]] = {}
+        for position, item in enumerate(items):
+            positions_by_shard.setdefault(shard_of(national_id_of(item), self.shard_count), []).append(position)
+        return positions_by_shard
+
+    def _scatter_items(self, items: List, national_id_of: Callable,
+                       operation: Callable[[VotingStore, List], Optional[List]]) -> List:
+        """
+        Sends each shard, in parallel, the items that belong to it, and puts the per-item results back in input order
+        """
+        positions_by_shard = self._partition(items, national_id_of)
+        results = [None] * len(items)
+
+        def run(shard_index: int):
+            positions = positions_by_shard[shard_index]
+            return positions, operation(self.shards[shard_index], [items[position] for position in positions])
+
+        for positions, shard_results in self.executor.map(run, list(positions_by_shard)):
+            for position, result in zip(positions, shard_results or []):
+                results[position] = result
+        return results
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.executor.shutdown(wait=True)
+
+    def create_tables(self):
+        self._scatter(methodcaller("create_tables"))
+
+    def get_schema_version(self) -> int:
+        return min(self._scatter(methodcaller("get_schema_version")))
+
+    def migrate_schema(self):
+        self._scatter(methodcaller("migrate_schema"))
+
+    def update_lookup_keys(self) -> bool:
+        return any(self._scatter(methodcaller("update_lookup_keys")))
+
+    def enable_instrumentation(self, metrics: Optional[StoreMetrics] = None) -> StoreMetrics:
+        """
+        Instruments every shard, collecting into a single StoreMetrics
+        """
+        if self.metrics is None:
+            metrics = metrics or StoreMetrics()
+            for shard in self.shards:
+                shard.enable_instrumentation(metrics)
+            self.metrics = metrics
+        return self.metrics
+
+    def disable_instrumentation(self):
+        for shard in self.shards:
+            shard.disable_instrumentation()
+        self.metrics = None
+
+    #
+    # Candidates, kept by the primary shard
+    #
+
+    def add_candidate(self, candidate_name: str):
+        self.primary.add_candidate(candidate_name)
+
+    def get_candidate(self, candidate_id: str) -> Candidate:
+        return self.primary.get_candidate(candidate_id)
+
+    def get_all_candidates(self) -> List[Candidate]:
+        return self.primary.get_all_candidates()
+
+    #
+    # Voters, each on the shard of their national ID
+    #
+
+    def add_voter(self, voter: Voter, national_id_hash: Optional[bytes] = None) -> bool:
+        return self.shard_for(voter.national_id).add_voter(voter, national_id_hash)
+
+    def add_voters(self, voters: List[Voter], national_id_hashes: Optional[List[Optional[bytes]]] = None) -> List[bool]:
+        return self._scatter_items(
+            list(zip(voters, national_id_hashes or [None] * len(voters))), lambda item: item[0].national_id,
+            lambda shard, shard_items: shard.add_voters([voter for voter, _ in shard_items],
+                                                        [national_id_hash for _, national_id_hash in shard_items]))
+
+    def get_registered_national_ids(self, national_ids: List[str]) -> Set[str]:
+        registered = self._scatter_items(
+            national_ids, lambda national_id: national_id,
+            lambda shard, shard_national_ids: [national_id in shard.get_registered_national_ids(shard_national_ids)
+                                               for national_id in shard_national_ids])
+        return {national_id for national_id, is_registered in zip(national_ids, registered) if is_registered}
+
+    def get_voter(self, national_id: str) -> Voter:
+        return self.shard_for(national_id).get_voter(national_id)
+
+    def get_national_id_hash(self, national_id: str) -> Optional[bytes]:
+        return self.shard_for(national_id).get_national_id_hash(national_id)
+
+    def get_status_voter(self, national_id: str) -> str:
+        return self.shard_for(national_id).get_status_voter(national_id)
+
+    def update_status_voter(self, national_id: str, new_status: str):
+        self.shard_for(national_id).update_status_voter(national_id, new_status)
+
+    def delete_voter(self, national_id: str) -> bool:
+        return self.shard_for(national_id).delete_voter(national_id)
+
+    def enable_name_dictionary(self) -> NameDictionary:
+        """
+        Builds one NameDictionary with the names of the voters of every shard, which all the shards then keep up to date
+        """
+        name_dictionary = NameDictionary()
+        for shard in self.shards:
+            shard.enable_name_dictionary(name_dictionary)
+        self.name_dictionary = name_dictionary
+        return name_dictionary
+
+    def disable_name_dictionary(self):
+        for shard in self.shards:
+            shard.disable_name_dictionary()
+        self.name_dictionary = None
+
+    def get_fraudulent_voters(self) -> List[Voter]:
+        return list(chain.from_iterable(self._scatter(methodcaller("get_fraudulent_voters"))))
+
+    #
+    # Ballots, each on the shard of the voter it was issued to
+    #
+
+    def add_ballot(self, national_id: str, ballot_number: str):
+        self.shard_for(national_id).add_ballot(national_id, ballot_number)
+
+    def add_ballots(self, ballots: List[Tuple[str, str]]):
+        """
+        :param: ballots (national_id, ballot_number) pairs
+        """
+        self._scatter_items(ballots, lambda ballot: ballot[0],
+                            lambda shard, shard_ballots: shard.add_ballots(shard_ballots))
+
+    def count_specified_validated_ballot(self, voter_national_id: str, ballot_number: str) -> int:
+        return self.shard_for(voter_national_id).count_specified_validated_ballot(voter_national_id, ballot_number)
+
+    def is_ballont_to_voter(self, voter_national_id: str, ballot_number: str) -> int:
+        return self.shard_for(voter_national_id).is_ballont_to_voter(voter_national_id, ballot_number)
+
+    def count_casted_ballot(self, voter_national_id: str) -> int:
+        return self.shard_for(voter_national_id).count_casted_ballot(voter_national_id)
+
+    # A ballot number alone doesn't tell the shard, so these ask every shard
+
+    def might_have_ballot(self, ballot_number: str) -> bool:
+        # The filters are in-process, so the shards are asked one after the other rather than on the thread pool
+        return any(shard.might_have_ballot(ballot_number) for shard in self.shards)
+
+    def is_invalitated_ballot(self, ballot_number: str) -> int:
+        return sum(self._scatter(lambda shard: shard.is_invalitated_ballot(ballot_number)))
+
+    def is_used_ballot(self, ballot_number: str) -> int:
+        return sum(self._scatter(lambda shard: shard.is_used_ballot(ballot_number)))
+
+    def is_existed_ballot(self, ballot_number: str) -> int:
+        return sum(self._scatter(lambda shard: shard.is_existed_ballot(ballot_number)))
+
+    def invalidated_ballot(self, ballot_number: str):
+        self._scatter(lambda shard: shard.invalidated_ballot(ballot_number))
+
+    def validated_ballot(self, ballot_number: str):
+        self._scatter(lambda shard: shard.validated_ballot(ballot_number))
+
+    def update_content_ballot(self, ballot_number: str, candidate_id: str, coment: str):
+        self._scatter(lambda shard: shard.update_content_ballot(ballot_number, candidate_id, coment))
+
+    def cast_ballot(self, ballot: Ballot, voter_national_id: str,
+                    redact_comment: Optional[Callable[[Voter, str], str]] = None) -> BallotStatus:
+        """
+        Counts the ballot on the shard of the voter. A ballot issued to another voter is on another shard, and is
+        reported as a mismatch, as it is by an unsharded store.
+        """
+        return self.shard_for(voter_national_id).cast_ballot(ballot, voter_national_id, redact_comment)
+
+    def cast_ballots(self, ballots: List[Tuple[Ballot, str]],
+                     redact_comment: Optional[Callable[[Voter, str], str]] = None) -> List:
+        """
+        Counts a batch of ballots, each shard's share of the batch in its own transaction, all the shards in parallel
+        """
+        return self._scatter_items(ballots, lambda ballot: ballot[1],
+                                   lambda shard, shard_ballots: shard.cast_ballots(shard_ballots, redact_comment))
+
+    #
+    # Comments. Ballot ids are only unique within a shard, so the records carry ballot_id * shard_count + shard_index.
+    #
+
+    def iter_comment_records(self, page_size: int = 1000) -> Iterator[Tuple[int, str, str, str, str]]:
+        for shard_index, shard in enumerate(self.shards):
+            for ballot_id, *record in shard.iter_comment_records(page_size):
+                yield (ballot_id * self.shard_count + shard_index, *record)
+
+    def update_comments(self, comments: List[Tuple[str, int]]):
+        """
+        :param: comments (comment, ballot_id) pairs, with the ballot ids of iter_comment_records
+        """
+        comments_by_shard: Dict[int, List[Tuple[str, int]]] = {}
+        for comment, ballot_id in comments:
+            shard_ballot_id, shard_index = divmod(ballot_id, self.shard_count)
+            comments_by_shard.setdefault(shard_index, []).append((comment, shard_ballot_id))
+        list(self.executor.map(lambda shard_index: self.shards[shard_index].update_comments(
+            comments_by_shard[shard_index]), list(comments_by_shard)))
+
+    def iter_comments(self, page_size: int = 1000) -> Iterator[str]:
+        """
+        Iterates over the comments of one shard after the other, one page at a time
+        """
+        for shard in self.shards:
+            yield from shard.iter_comments(page_size)
+
+    def get_comments(self) -> List[str]:
+        return list(chain.from_iterable(self._scatter(methodcaller("get_comments"))))
+
+    #
+    # Tally, kept per shard and summed
+    #
+
+    def get_most_voted(self) -> List[Tuple[str, int]]:
+        votes: Dict[str, int] = {}
+        for shard_votes in self._scatter(methodcaller("get_most_voted")):
+            for candidate_id, candidate_votes in shard_votes:
+                votes[candidate_id] = votes.get(candidate_id, 0) + candidate_votes
+        return sorted(votes.items(), key=lambda candidate_votes: (-candidate_votes[1], candidate_votes[0]))
+
+    def get_standings(self) -> List[Tuple[Candidate, int]]:
+        candidates = {candidate.candidate_id: candidate for candidate in self.primary.get_all_candidates()}
+        return [(candidates[candidate_id], votes) for candidate_id, votes in self.get_most_voted()
+                if candidate_id in candidates]
+
+    def reconcile_tally(self) -> bool:
+        return all(self._scatter(methodcaller("reconcile_tally")))
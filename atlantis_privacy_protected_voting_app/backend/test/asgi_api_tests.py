@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.api.backend_asgi_api import AsgiApi
+from backend.main.objects.voter import Voter, BallotStatus
+from backend.main.store.data_registry import VotingStore
+
+
+async def call(app, method: str, path: str, body: bytes = b"", query_string: bytes = b"", headers=()):
+    """
+    Sends one request to the ASGI app and returns its (status, headers, body)
+    """
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string,
+             "headers": [(b"origin", b"http://localhost:3000")] + list(headers)}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"body": b""}
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = dict(message["headers"])
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+class TestAsgiApi:
+    def test_count_ballot(self):
+        """
+        The ASGI app counts ballots and answers like the Flask app
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        registry.register_candidate("Kathryn Collins")
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        request_body = json.dumps({"ballot_number": ballot_number, "chosen_candidate_id": "1",
+                                   "voter_comments": "Go!", "voter_national_id": voter.national_id}).encode("utf-8")
+        app = AsgiApi(max_workers=2)
+
+        status, headers, body = asyncio.run(call(app, "POST", "/api/count_ballot", request_body))
+        assert status == 202
+        assert json.loads(body) == {"status": json.dumps(BallotStatus.BALLOT_COUNTED.value)}
+        assert headers[b"access-control-allow-origin"] == b"http://localhost:3000"
+
+        status, _, body = asyncio.run(call(app, "GET", "/api/get_all_ballot_comments", query_string=b"page_size=1"))
+        assert status == 200
+        assert body == b'"Go!"\n'
+
+        status, _, body = asyncio.run(call(app, "POST", "/api/count_ballot", request_body))
+        assert status == 409
+        assert json.loads(body) == {"status": json.dumps(BallotStatus.FRAUD_COMMITTED.value)}
+
+        status, headers, body = asyncio.run(call(app, "GET", "/api/get_all_candidates"))
+        assert status == 200
+        assert json.loads(body) == [{"candidate_id": "1", "name": "Kathryn Collins"}]
+        status, _, body = asyncio.run(call(app, "GET", "/api/get_all_candidates",
+                                           headers=[(b"if-none-match", headers[b"etag"])]))
+        assert (status, body) == (304, b"")
+
+        assert asyncio.run(call(app, "POST", "/api/count_ballot", b"{"))[0] == 400
+        assert asyncio.run(call(app, "GET", "/api/unknown"))[0] == 404
+
+    def test_backpressure(self, monkeypatch):
+        """
+        Once every worker is busy and the queue is full, further requests are rejected with a 503 right away
+        """
+        release = threading.Event()
+
+        def blocking_count_ballot(ballot, voter_national_id):
+            release.wait()
+            return BallotStatus.BALLOT_COUNTED
+
+        monkeypatch.setattr(balloting, "count_ballot", blocking_count_ballot)
+        app = AsgiApi(max_workers=1, max_queued=1)
+        request_body = json.dumps({"ballot_number": "b", "chosen_candidate_id": "1",
+                                   "voter_comments": "", "voter_national_id": "1"}).encode("utf-8")
+
+        async def submit_three():
+            accepted = [asyncio.ensure_future(call(app, "POST", "/api/count_ballot", request_body))
+                        for _ in range(2)]
+            await asyncio.sleep(0.05)
+            status, headers, _ = await call(app, "POST", "/api/count_ballot", request_body)
+            release.set()
+            return status, headers, [response[0] for response in await asyncio.gather(*accepted)]
+
+        rejected_status, rejected_headers, accepted_statuses = asyncio.run(submit_three())
+        assert rejected_status == 503
+        assert rejected_headers[b"retry-after"] == b"1"
+        assert accepted_statuses == [202, 202]
+        assert app.in_flight == 0
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
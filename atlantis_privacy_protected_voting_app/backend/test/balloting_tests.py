@@ -1,10 +1,16 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pytest
 
 import backend.main.api.balloting as balloting
 import backend.main.api.registry as registry
-from backend.main.objects.ballot import Ballot
+from backend.main.objects.ballot import Ballot, generate_ballot_number, is_authentic_ballot_number, \
+    BALLOT_NUMBER_KEY_SECRET_NAME
+from backend.main.objects.national_id import NationalId
 from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
-from backend.main.store.data_registry import VotingStore
+from backend.main.store.data_registry import VotingStore, DATABASE_ENV_VARIABLE
 
 all_voters = [
     Voter("Adam", "Smith", "111111111"),
@@ -15,6 +21,25 @@ all_voters = [
 ]
 
 
+def issue_ballot_in_process(database: str, voter: Voter) -> str:
+    """
+    Registers the voter and issues them a ballot, in a process of its own on the database file
+    """
+    os.environ[DATABASE_ENV_VARIABLE] = database
+    registry.register_voter(voter)
+    return balloting.issue_ballot(voter.national_id)
+
+
+def count_ballot_in_process(database: str, ballot: Ballot, voter_national_id: str) -> BallotStatus:
+    os.environ[DATABASE_ENV_VARIABLE] = database
+    return balloting.count_ballot(ballot, voter_national_id)
+
+
+def run_in_new_process(function, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
 class TestBalloting:
     def test_ballot_issuing(self):
         """
@@ -39,6 +64,21 @@ class TestBalloting:
         assert balloting.verify_ballot(voter.national_id, ballot_number3)
         assert balloting.verify_ballot(voter.national_id, ballot_number4)
 
+    def test_bulk_ballot_issuing(self):
+        """
+        Ensures that ballots can be issued in bulk, that unregistered voters don't get one, and that a voter listed
+        twice gets two distinct valid ballots.
+        """
+        national_ids = [voter.national_id for voter in all_voters] + ["999999999", all_voters[0].national_id]
+        ballot_numbers = balloting.issue_ballots(national_ids)
+
+        assert len(ballot_numbers) == len(national_ids)
+        assert ballot_numbers[len(all_voters)] is None
+        assert ballot_numbers[0] != ballot_numbers[-1]
+        for national_id, ballot_number in zip(national_ids, ballot_numbers):
+            if ballot_number is not None:
+                assert balloting.verify_ballot(national_id, ballot_number)
+
     def test_count_ballot(self):
         """
         Ensures that ballots can be counted and tallied appropriately.
@@ -158,6 +198,78 @@ class TestBalloting:
         """.strip()
         assert list(all_ballot_comments)[0] == expected_redacted_comment
 
+    def test_ballot_comment_redaction_other_voters(self):
+        """
+        With the name dictionary enabled, the names of every registered voter are redacted, not only the voter's own
+        """
+        store = VotingStore.get_instance()
+        store.enable_name_dictionary()
+        registry.register_voter(Voter("Daniel", "Salt", "999999999"))
+        assert registry.de_register_voter(all_voters[3].national_id)
+
+        voter = all_voters[0]
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        all_candidates = registry.get_all_candidates()
+        comment = "Adam here. Thien Huynh and daniel told me to vote, Linda didn't."
+        ballot = Ballot(ballot_number, all_candidates[0].candidate_id, comment)
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+        assert balloting.get_all_ballot_comments() == [
+            "[REDACTED NAME] here. [REDACTED NAME] [REDACTED NAME] and [REDACTED NAME] told me to vote, Linda didn't."]
+
+    def test_redact_all_ballot_comments(self):
+        """
+        Checks that stored comments can be redacted again, e.g. after the redaction rules change
+        """
+        voter = all_voters[0]
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        all_candidates = registry.get_all_candidates()
+        ballot = Ballot(ballot_number, all_candidates[0].candidate_id, "Parks please")
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+        # Simulate a comment stored under older, weaker rules
+        store = VotingStore.get_instance()
+        ballot_id = next(store.iter_comment_records())[0]
+        store.update_comments([("Parks please, {0} {1} 839-838-1627".format(voter.first_name, voter.last_name),
+                                ballot_id)])
+
+        assert balloting.redact_all_ballot_comments(chunk_size=1) == 1
+        assert balloting.get_all_ballot_comments() == [
+            "Parks please, [REDACTED NAME] [REDACTED NAME] [REDACTED PHONE NUMBER]"]
+        assert balloting.redact_all_ballot_comments() == 0
+
+    def test_redact_all_ballot_comments_with_name_dictionary(self):
+        """
+        Re-redaction applies the same rules as counting, including the names of the other registered voters, also when
+        it runs on a pool of processes
+        """
+        voter = all_voters[0]
+        store = VotingStore.get_instance()
+        store.enable_name_dictionary()
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert balloting.count_ballot(Ballot(ballot_number, "1", "Parks please"), voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+        ballot_id = next(store.iter_comment_records())[0]
+        for processes in (None, 2):
+            store.update_comments([("Parks please, ask Linda or Banerjee", ballot_id)])
+            assert balloting.redact_all_ballot_comments(processes=processes) == 1
+            assert balloting.get_all_ballot_comments() == ["Parks please, ask [REDACTED NAME] or [REDACTED NAME]"]
+
+    def test_iter_all_ballot_comments(self):
+        """
+        The comments are streamed page by page, in order, without the empty comments or those of uncounted ballots.
+        """
+        all_candidates = registry.get_all_candidates()
+        comments = ["First", "", "Third", "Fourth"]
+        for voter, comment in zip(all_voters, comments):
+            ballot_number = balloting.issue_ballot(voter.national_id)
+            balloting.count_ballot(Ballot(ballot_number, all_candidates[0].candidate_id, comment), voter.national_id)
+        balloting.issue_ballot(all_voters[4].national_id)
+
+        assert list(balloting.iter_all_ballot_comments(page_size=2)) == ["First", "Third", "Fourth"]
+        assert balloting.get_all_ballot_comments() == ["First", "Third", "Fourth"]
+
     def test_catch_fraud(self):
         """
         Checks to make sure that if someone is caught voting twice:
@@ -192,6 +304,37 @@ class TestBalloting:
         assert len(ballot_comments) == 1
         assert "first ballot" in ballot_comments
 
+    def test_resubmitted_ballot_stays_counted(self):
+        """
+        Resubmitting the ballot that was counted is fraud, but it must not un-count that ballot: the voter's next ballot
+        is fraud too, and the voter still has exactly one counted vote.
+        """
+        self.check_resubmitted_ballot_stays_counted()
+
+    def test_resubmitted_ballot_stays_counted_through_the_queue(self):
+        balloting.enable_ballot_ingestion_queue(max_batch_size=4)
+        try:
+            self.check_resubmitted_ballot_stays_counted()
+        finally:
+            balloting.disable_ballot_ingestion_queue()
+
+    @staticmethod
+    def check_resubmitted_ballot_stays_counted():
+        voter = all_voters[0]
+        all_candidates = registry.get_all_candidates()
+        ballot1 = Ballot(balloting.issue_ballot(voter.national_id), all_candidates[0].candidate_id, "first ballot")
+        ballot2 = Ballot(balloting.issue_ballot(voter.national_id), all_candidates[1].candidate_id, "second ballot")
+
+        assert balloting.count_ballot(ballot1, voter.national_id) == BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(ballot1, voter.national_id) == BallotStatus.FRAUD_COMMITTED
+        assert balloting.count_ballot(ballot2, voter.national_id) == BallotStatus.FRAUD_COMMITTED
+
+        store = VotingStore.get_instance()
+        assert store.get_most_voted() == [(all_candidates[0].candidate_id, 1)]
+        assert store.reconcile_tally()
+        assert balloting.get_all_ballot_comments() == ["first ballot"]
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.FRAUD_COMMITTED
+
     def test_de_register_fraudster(self):
         """
         Checks that fraudsters cannot be completely de-registered
@@ -324,6 +467,162 @@ class TestBalloting:
         assert winning_candidate.candidate_id == all_candidates[0].candidate_id
         assert winning_candidate.name == all_candidates[0].name
 
+    def test_election_standings_and_tally_reconciliation(self):
+        """
+        The standings come from the live tally, which must agree with a full count of the ballots.
+        """
+        all_candidates = registry.get_all_candidates()
+        for voter, candidate in zip(all_voters[0:3], [all_candidates[1], all_candidates[1], all_candidates[2]]):
+            ballot_number = balloting.issue_ballot(voter.national_id)
+            balloting.count_ballot(Ballot(ballot_number, candidate.candidate_id, ""), voter.national_id)
+        # A second ballot from the same voter is fraud, and must not be counted
+        ballot_number = balloting.issue_ballot(all_voters[0].national_id)
+        balloting.count_ballot(Ballot(ballot_number, all_candidates[0].candidate_id, ""), all_voters[0].national_id)
+
+        standings = balloting.get_election_standings()
+        assert [(candidate.candidate_id, votes) for candidate, votes in standings] == \
+               [(all_candidates[1].candidate_id, 2), (all_candidates[2].candidate_id, 1)]
+        assert standings[0][0].name == all_candidates[1].name
+
+        store = VotingStore.get_instance()
+        assert store.reconcile_tally()
+        # Corrupt the tally of every database - the shards of a sharded store each keep their own - behind its back
+        for database_store in getattr(store, "shards", [store]):
+            with database_store.connection as connection:
+                connection.execute("""UPDATE tally SET votes = 7""")
+        assert not store.reconcile_tally()
+        assert store.get_most_voted() == [(all_candidates[1].candidate_id, 2), (all_candidates[2].candidate_id, 1)]
+        assert store.reconcile_tally()
+
+    def test_ballot_ingestion_queue(self):
+        """
+        With the write-behind queue, ballots submitted concurrently are counted in batches, and each voter still gets
+        exactly one counted ballot: every other ballot of theirs is fraud.
+        """
+        all_candidates = registry.get_all_candidates()
+        submissions = []
+        for voter in all_voters:
+            for attempt in range(3):
+                ballot_number = balloting.issue_ballot(voter.national_id)
+                submissions.append((Ballot(ballot_number, all_candidates[0].candidate_id, "Vote"), voter.national_id))
+
+        balloting.enable_ballot_ingestion_queue(max_batch_size=4, max_delay=0.01)
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                statuses = list(executor.map(lambda submission: balloting.count_ballot(*submission), submissions))
+        finally:
+            balloting.disable_ballot_ingestion_queue()
+
+        for voter in all_voters:
+            voter_statuses = [status for status, (_, national_id) in zip(statuses, submissions)
+                              if national_id == voter.national_id]
+            assert sorted(status.value for status in voter_statuses) == sorted(
+                [BallotStatus.BALLOT_COUNTED.value] + [BallotStatus.FRAUD_COMMITTED.value] * 2)
+        assert VotingStore.get_instance().get_most_voted() == [(all_candidates[0].candidate_id, len(all_voters))]
+
+    def test_count_ballot_is_atomic(self):
+        """
+        If counting fails half-way through, nothing about the ballot or the voter should have changed.
+        """
+        voter = all_voters[0]
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        all_candidates = registry.get_all_candidates()
+        ballot = Ballot(ballot_number, all_candidates[0].candidate_id, "Comment")
+
+        def failing_redaction(voter, comment):
+            raise RuntimeError("redaction failed")
+
+        with pytest.raises(RuntimeError):
+            VotingStore.get_instance().cast_ballot(ballot, voter.national_id, failing_redaction)
+
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.REGISTERED_NOT_VOTED
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+    def test_national_id_normalized_at_the_edge(self):
+        """
+        However the voter writes their national ID, it reaches the same voter, and an ID that can't be valid is treated
+        as not registered without raising
+        """
+        registry.register_voter(Voter("Adam", "Smith", "123-45-6789"))
+        ballot_number = balloting.issue_ballot("123 45 6789")
+        assert ballot_number is not None
+        assert balloting.verify_ballot("123456789", ballot_number)
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), "123-45-6789") == BallotStatus.BALLOT_COUNTED
+        assert registry.get_voter_status(" 123-456789 ") == VoterStatus.BALLOT_COUNTED
+
+        assert balloting.issue_ballot("") is None
+        assert balloting.issue_ballots(["123-45-6789", "not/an id"])[1] is None
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), "--") == BallotStatus.VOTER_NOT_REGISTERED
+        assert registry.get_voter_status("x" * 40) == VoterStatus.NOT_REGISTERED
+        with pytest.raises(ValueError):
+            registry.register_voter(Voter("Eve", "Jones", "12/34"))
+
+    def test_unknown_ballot_rejected_without_a_query(self):
+        """
+        An authentic ballot number that the store never issued is rejected as invalid by the Bloom filter, without
+        touching the database.
+        """
+        ballot_number = balloting.issue_ballot(all_voters[0].national_id)
+        forged_ballot_number = generate_ballot_number(all_voters[0].national_id)
+        store = VotingStore.get_instance()
+        # Also loads the filter of every shard of a sharded store, which asks them all about a number none of them has
+        assert store.might_have_ballot(ballot_number) and not store.might_have_ballot(forged_ballot_number)
+        metrics = store.enable_instrumentation()
+
+        assert balloting.count_ballot(Ballot(forged_ballot_number, "1", ""), all_voters[0].national_id) == \
+            BallotStatus.INVALID_BALLOT
+        assert not balloting.verify_ballot(all_voters[0].national_id, forged_ballot_number)
+        assert not balloting.invalidate_ballot(forged_ballot_number)
+        assert metrics.snapshot()["statements"] == {}
+
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), all_voters[0].national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+    def test_ballot_numbers_are_authenticated(self):
+        """
+        Ballot numbers are 44 URL-safe characters that carry a tag: tampered, truncated and made-up numbers are
+        rejected as invalid before the store is asked, while numbers of the legacy format are still looked up.
+        """
+        national_id = all_voters[0].national_id
+        ballot_number = balloting.issue_ballot(national_id)
+        assert len(ballot_number) == 44
+        assert is_authentic_ballot_number(ballot_number)
+
+        tampered_ballot_number = ballot_number[:10] + ("A" if ballot_number[10] != "A" else "B") + ballot_number[11:]
+        forged_ballot_numbers = [tampered_ballot_number, ballot_number[:-1], "A" * 44, "b", None]
+        store = VotingStore.get_instance()
+        metrics = store.enable_instrumentation()
+        for forged_ballot_number in forged_ballot_numbers:
+            assert not is_authentic_ballot_number(forged_ballot_number)
+            assert balloting.count_ballot(Ballot(forged_ballot_number, "1", ""), national_id) == \
+                BallotStatus.INVALID_BALLOT
+            assert not balloting.verify_ballot(national_id, forged_ballot_number)
+        assert metrics.snapshot()["methods"] == {}
+        store.disable_instrumentation()
+
+        legacy_ballot_number = "aGVsbG8gd29ybGQsIHRoaXMgaXMgYSBsZWdhY3kgYmFsbG90IG51bWJlcg=="
+        store.add_ballot(NationalId.parse(national_id), legacy_ballot_number)
+        assert balloting.verify_ballot(national_id, legacy_ballot_number)
+        assert balloting.count_ballot(Ballot(legacy_ballot_number, "1", ""), national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+    def test_ballots_are_counted_after_a_restart(self, tmp_path, configured_keys, monkeypatch):
+        """
+        On a database file, a ballot issued before the process restarted is still verified and counted after, and a
+        process without the ballot number key configured refuses the database rather than reject every ballot in it.
+        """
+        database = str(tmp_path / "voting.db")
+        voter = all_voters[0]
+        ballot_number = run_in_new_process(issue_ballot_in_process, database, voter)
+        ballot = Ballot(ballot_number, registry.get_all_candidates()[0].candidate_id, "")
+        assert run_in_new_process(count_ballot_in_process, database, ballot, voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+        monkeypatch.delenv(BALLOT_NUMBER_KEY_SECRET_NAME)
+        with pytest.raises(ValueError, match=BALLOT_NUMBER_KEY_SECRET_NAME):
+            run_in_new_process(count_ballot_in_process, database, ballot, voter.national_id)
+
     @pytest.fixture(autouse=True)
     def run_around_tests(self):
         """
@@ -0,0 +1,14 @@
+import pytest
+
+from backend.main.store.data_registry import STORED_KEY_SECRET_NAMES
+from backend.main.store.secret_registry import KEY_RING, overwrite_secret_bytes
+
+
+@pytest.fixture
+def configured_keys():
+    """
+    Configures the keys that the test process generated, as an operator configures them in the secrets, so that stores
+    can be opened on database files
+    """
+    for name in STORED_KEY_SECRET_NAMES:
+        overwrite_secret_bytes(KEY_RING.secret_name(name, KEY_RING.current_version(name)), KEY_RING.get_key(name))
@@ -0,0 +1,298 @@
+import gc
+import sqlite3
+import threading
+
+import pytest
+
+from backend.main.objects.ballot import Ballot, ballot_number_lookup_key
+from backend.main.objects.voter import Voter, BallotStatus
+from backend.main.store.bloom_filter import BloomFilter
+from backend.main.objects.national_id import NATIONAL_ID_LOOKUP_KEY_SECRET_NAME
+from backend.main.store.data_registry import VotingStore, SCHEMA_VERSION, rekey_lookup_keys
+from backend.main.store.secret_registry import KEY_RING
+
+
+class TestDataRegistry:
+    def test_new_store_is_at_latest_schema_version(self):
+        """
+        A freshly created store should have every migration applied.
+        """
+        assert VotingStore.get_instance().get_schema_version() == SCHEMA_VERSION
+
+    def test_migrate_schema_from_original_tables(self):
+        """
+        A database created with the original, unindexed tables should be migrated up to the latest schema version,
+        keeping its data.
+        """
+        store = VotingStore.get_instance()
+        store.connection.execute("""INSERT INTO voter (first_name, last_name, national_id) VALUES ('A', 'S', '1')""")
+        for (index_name,) in store.connection.execute(
+                """SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL""").fetchall():
+            store.connection.execute("""DROP INDEX {0}""".format(index_name))
+        store.connection.execute("""PRAGMA user_version = 0""")
+        store.connection.commit()
+
+        store.migrate_schema()
+
+        assert store.get_schema_version() == SCHEMA_VERSION
+        assert store.get_voter("1") is not None
+        plan = store.connection.execute(
+            """EXPLAIN QUERY PLAN SELECT * FROM voter WHERE national_id=?""", ("1",)).fetchall()
+        assert "USING INDEX" in plan[0][3]
+
+    def test_migration_backfills_tally(self):
+        """
+        Votes cast before the tally existed should be in the tally once the database is migrated.
+        """
+        store = VotingStore.get_instance()
+        store.connection.executemany("""INSERT INTO ballot (ballot_number, chosen_candidate_id) VALUES (?, ?)""",
+                                     [("b1", "1"), ("b2", "2"), ("b3", "2"), ("b4", None)])
+        store.connection.execute("""DROP TABLE tally""")
+        store.connection.execute("""PRAGMA user_version = 1""")
+
+        store.migrate_schema()
+
+        assert store.get_most_voted() == [("2", 2), ("1", 1)]
+        assert store.reconcile_tally()
+
+    def test_cast_ballots_isolates_failures(self):
+        """
+        In a batch, a ballot that fails is rolled back on its own, and the rest of the batch is still counted.
+        """
+        store = VotingStore.get_instance()
+        store.add_voters([Voter("Adam", "Smith", "1"), Voter("Eve", "Jones", "2")])
+        store.add_ballots([("1", "b1"), ("2", "b2")])
+
+        def redact_comment(voter, comment):
+            if voter.national_id == "1":
+                raise RuntimeError("redaction failed")
+            return comment
+
+        results = store.cast_ballots([(Ballot("b1", "1", "x"), "1"), (Ballot("b2", "1", "y"), "2")], redact_comment)
+
+        assert isinstance(results[0], RuntimeError)
+        assert results[1] == BallotStatus.BALLOT_COUNTED
+        assert store.count_casted_ballot("1") == 0
+        assert store.count_casted_ballot("2") == 1
+
+    def test_instrumentation(self):
+        """
+        Once enabled, every store method and SQL statement is counted and timed, with the rows it returned, and the
+        statements that scan a whole table are flagged.
+        """
+        store = VotingStore.get_instance()
+        metrics = store.enable_instrumentation()
+        store.add_voters([Voter("Adam", "Smith", "1"), Voter("Eve", "Jones", "2")])
+        store.get_voter("1")
+        store.get_voter("2")
+        store.get_all_candidates()
+        list(store.iter_comments())
+
+        snapshot = metrics.snapshot()
+        assert snapshot["methods"]["get_voter"]["calls"] == 2
+        assert snapshot["methods"]["get_voter"]["rows_returned"] == 2
+        assert snapshot["methods"]["get_voter"]["latency_buckets"]["+Inf"] == 2
+        assert snapshot["methods"]["add_voters"]["calls"] == 1
+        assert snapshot["methods"]["iter_comments"]["calls"] == 1
+        voter_lookup = "SELECT first_name, last_name, national_id FROM voter WHERE lookup_key=?"
+        assert snapshot["statements"][voter_lookup]["calls"] == 2
+        assert snapshot["statements"][voter_lookup]["full_scan"] is False
+        assert snapshot["statements"]["SELECT * FROM candidates"]["full_scan"] is True
+
+        prometheus_text = metrics.to_prometheus()
+        assert 'voting_store_method_duration_seconds_count{method="get_voter"} 2' in prometheus_text
+        assert 'voting_store_sql_full_scan{{statement="{0}"}} 0'.format(voter_lookup) in prometheus_text
+
+        store.disable_instrumentation()
+        store.get_voter("1")
+        assert store.metrics is None
+        assert metrics.snapshot()["methods"]["get_voter"]["calls"] == 2
+
+    def test_lookup_keys_follow_the_key(self):
+        """
+        Voters are found through the index on their lookup key, and update_lookup_keys recomputes the lookup keys when
+        they were made with another key than the current one.
+        """
+        store = VotingStore.get_instance()
+        store.add_voters([Voter("Adam", "Smith", "1")])
+        store.add_ballots([("1", "b1")])
+        plan = store.connection.execute(
+            """EXPLAIN QUERY PLAN SELECT * FROM voter WHERE lookup_key=?""", (b"",)).fetchall()
+        assert "voter_lookup_key_idx" in plan[0][3]
+        assert not store.update_lookup_keys()
+
+        store.connection.execute("""UPDATE voter SET lookup_key = randomblob(16)""")
+        store.connection.execute("""UPDATE store_settings SET value = randomblob(16)""")
+        assert store.get_voter("1") is None
+        assert store.update_lookup_keys()
+        assert store.get_voter("1").last_name == "Smith"
+        assert store.count_specified_validated_ballot("1", "b1") == 1
+
+    def test_file_store_needs_configured_keys(self, tmp_path, monkeypatch):
+        """
+        A store on a database file refuses to open with a lookup key that the process generated, since the lookup keys
+        in the file would be unusable once it restarts; an in-memory store doesn't outlive the process anyway.
+        """
+        monkeypatch.setattr(KEY_RING, "is_generated", lambda name: name == NATIONAL_ID_LOOKUP_KEY_SECRET_NAME)
+        with pytest.raises(ValueError, match=NATIONAL_ID_LOOKUP_KEY_SECRET_NAME):
+            VotingStore(str(tmp_path / "voting.db"))
+        VotingStore().close()
+
+    def test_file_store_made_with_another_lookup_key_is_refused(self, tmp_path, configured_keys):
+        """
+        A database whose lookup keys were made with another key is refused as it is, rather than silently rekeyed, until
+        rekey_lookup_keys recomputes them.
+        """
+        database = str(tmp_path / "voting.db")
+        store = VotingStore(database)
+        store.add_voters([Voter("Adam", "Smith", "1")])
+        store.add_ballots([("1", "b1")])
+        # As a process with another key would have left the database
+        with store.connection as connection:
+            connection.execute("""UPDATE voter SET lookup_key = randomblob(16)""")
+            connection.execute("""UPDATE ballot SET voter_lookup_key = randomblob(16)""")
+            connection.execute("""UPDATE store_settings SET value = randomblob(16)""")
+        store.close()
+
+        with pytest.raises(ValueError, match="rekey_lookup_keys"):
+            VotingStore(database)
+        assert rekey_lookup_keys(database)
+        assert not rekey_lookup_keys(database)
+
+        reopened_store = VotingStore(database)
+        assert reopened_store.get_voter("1").last_name == "Smith"
+        assert reopened_store.count_specified_validated_ballot("1", "b1") == 1
+        reopened_store.close()
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """
+        Every key added is found, also once the filter has grown past its initial capacity, and most other keys aren't.
+        """
+        keys = [ballot_number_lookup_key(str(i)) for i in range(5000)]
+        ballot_filter = BloomFilter(initial_capacity=100)
+        ballot_filter.update(keys)
+        assert len(ballot_filter) == 5000
+        assert all(key in ballot_filter for key in keys)
+        false_positives = sum(ballot_number_lookup_key("other " + str(i)) in ballot_filter for i in range(5000))
+        assert false_positives < 5000 * 0.02
+
+    def test_ballot_keys_are_backfilled(self):
+        """
+        Ballots added before the ballot keys existed are found by their number once the database is migrated.
+        """
+        store = VotingStore.get_instance()
+        store.add_voters([Voter("Adam", "Smith", "1")])
+        store.add_ballots([("1", "b1")])
+        store.connection.execute("""DROP INDEX ballot_key_idx""")
+        store.connection.execute("""UPDATE ballot SET ballot_key = NULL""")
+        store.connection.execute("""PRAGMA user_version = 3""")
+
+        store.migrate_schema()
+
+        assert store.count_specified_validated_ballot("1", "b1") == 1
+        plan = store.connection.execute(
+            """EXPLAIN QUERY PLAN SELECT * FROM ballot WHERE ballot_key=?""", (b"",)).fetchall()
+        assert "ballot_key_idx" in plan[0][3]
+
+    def test_ballot_filter_sees_ballots_of_other_stores(self, tmp_path, configured_keys):
+        """
+        On a database file, a ballot issued through another store (e.g. another process) is found by a miss that reads
+        the ballots added since the filter was loaded.
+        """
+        database = str(tmp_path / "voting.db")
+        store = VotingStore(database)
+        other_store = VotingStore(database)
+        store.add_ballots([("1", "b1")])
+        assert store.might_have_ballot("b1")
+        assert not store.might_have_ballot("b2")
+
+        other_store.add_ballots([("1", "b2")])
+        assert store.might_have_ballot("b2")
+        store.close()
+        other_store.close()
+
+    def test_domain_objects_from_rows(self):
+        """
+        The objects built from rows carry no __dict__, and map the columns as the constructors did before
+        """
+        store = VotingStore.get_instance()
+        store.add_candidate("Kathryn Collins")
+        store.add_voter(Voter("Adam", "Smith", "111111111"))
+        candidate = store.get_all_candidates()[0]
+        voter = store.get_voter("111111111")
+        assert (candidate.candidate_id, candidate.name) == ("1", "Kathryn Collins")
+        assert (voter.first_name, voter.last_name, voter.national_id) == ("Adam", "Smith", "111111111")
+        for domain_object in (candidate, voter, voter.get_minimal_voter(), Ballot("number", "1", "")):
+            assert not hasattr(domain_object, "__dict__")
+
+    def test_file_backed_store_persists_in_wal_mode(self, tmp_path, configured_keys):
+        """
+        An on-disk store runs in WAL mode and keeps its data when the store is re-opened.
+        """
+        database = str(tmp_path / "voting.db")
+        store = VotingStore(database)
+        assert store.connection.execute("""PRAGMA journal_mode""").fetchone()[0] == "wal"
+        assert store.add_voter(Voter("Adam", "Smith", "111111111"))
+        store.close()
+
+        reopened_store = VotingStore(database)
+        assert reopened_store.get_voter("111111111").first_name == "Adam"
+        assert reopened_store.add_voter(Voter("Adam", "Smith", "111111111")) is False
+        reopened_store.close()
+
+    def test_file_backed_store_concurrent_threads(self, tmp_path, configured_keys):
+        """
+        Threads each get their own connection and can register voters concurrently without losing any writes.
+        """
+        store = VotingStore(str(tmp_path / "voting.db"))
+        errors = []
+
+        def register(thread_number):
+            try:
+                for i in range(50):
+                    store.add_voter(Voter("F", "L", "{0}-{1}".format(thread_number, i)))
+                    assert store.get_voter("{0}-{1}".format(thread_number, i)) is not None
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=register, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert store.connection.execute("""SELECT count(*) FROM voter""").fetchone()[0] == 8 * 50
+        store.close()
+
+    def test_connections_of_exited_threads_are_closed(self, tmp_path, configured_keys):
+        """
+        A short-lived thread's connection is closed once the thread exits, as with a server that starts a thread per
+        request, so the open connections stay bounded by the live threads.
+        """
+        store = VotingStore(str(tmp_path / "voting.db"))
+        store.add_voter(Voter("Adam", "Smith", "111111111"))
+        opened = []
+
+        def handle_request():
+            assert store.get_voter("111111111") is not None
+            opened.append(store.connections.get_connection())
+
+        for _ in range(10):
+            threads = [threading.Thread(target=handle_request) for _ in range(30)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        gc.collect()
+
+        assert len(opened) == 300
+        assert len(store.connections.get_all_connections()) <= 1
+        with pytest.raises(sqlite3.ProgrammingError):
+            opened[0].execute("""SELECT 1""")
+        assert store.get_voter("111111111").first_name == "Adam"
+        store.close()
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
@@ -1,4 +1,11 @@
-from backend.main.objects.voter import Voter, decrypt_name
+import multiprocessing
+from base64 import b64decode, b64encode
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from Cryptodome.Cipher import AES
+
+from backend.main.objects.voter import NameCipher, Voter, decrypt_name, encrypt_name, get_minimal_voters
 
 
 class TestMinimization:
@@ -48,4 +55,46 @@ class TestMinimization:
             assert voter.first_name == decrypted_first_name
             assert voter.last_name == decrypted_last_name
 
+    def test_name_decryption_in_another_process(self):
+        """
+        Checks that decryption needs no state from the process that encrypted the name
+        """
+        encrypted_names = [encrypt_name(name) for name in ["Adam", "Smith", "Chicata Farfán"]]
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            assert list(executor.map(decrypt_name, encrypted_names)) == ["Adam", "Smith", "Chicata Farfán"]
+
+    def test_tampered_name_is_rejected(self):
+        """
+        Checks that an encrypted name that was modified can't be decrypted
+        """
+        envelope = bytearray(b64decode(encrypt_name("Adam")))
+        envelope[-1] ^= 1
+        with pytest.raises(ValueError):
+            decrypt_name(b64encode(bytes(envelope)).decode("utf-8"))
+
+    def test_name_cipher_reads_eax_envelopes(self):
+        """
+        Checks that NameCipher decrypts the envelopes of pycryptodome's EAX mode, which names were encrypted into
+        before it
+        """
+        key = bytes(range(32))
+        name_cipher = NameCipher(key)
+        for name in ["", "Adam", "Chicata Farfán", "é" * 49]:
+            cipher = AES.new(key, AES.MODE_EAX)
+            ciphertext, tag = cipher.encrypt_and_digest(name.encode("utf-8"))
+            assert name_cipher.decrypt(b64encode(cipher.nonce + tag + ciphertext).decode("utf-8")) == name
+
+    def test_batch_name_encryption(self):
+        """
+        Checks that names encrypted in a batch decrypt back in order
+        """
+        names = ["Name{0}".format(i) for i in range(2500)]
+        name_cipher = NameCipher(bytes(32))
+        encrypted_names = name_cipher.encrypt_many(name for name in names)
+        assert len(set(encrypted_names)) == len(names)
+        assert name_cipher.decrypt_many(encrypted_names) == names
 
+        voters = [Voter(" Adam ", "Smith", "123-45-6789"), Voter("Eve", "Chicata Farfán", "987654321")]
+        minimal_voters = get_minimal_voters(voters)
+        assert [(decrypt_name(minimal_voter.obfuscated_first_name), decrypt_name(minimal_voter.obfuscated_last_name))
+                for minimal_voter in minimal_voters] == [("Adam", "Smith"), ("Eve", "Chicata Farfán")]
@@ -0,0 +1,68 @@
+from backend.main.detection.name_dictionary import NameDictionary
+from backend.main.detection.pii_detection import redact_free_text
+
+
+class TestNameDictionary:
+    def test_finds_whole_words_case_insensitively(self):
+        """
+        Names are found regardless of case, but not inside other words
+        """
+        name_dictionary = NameDictionary()
+        for name in ["Qi", "Smith", "Linda"]:
+            name_dictionary.add(name)
+
+        text = "LINDA and smith, but not Smithson or equipment. Qi!"
+        assert [text[start:end] for start, end in name_dictionary.find_all(text)] == ["LINDA", "smith", "Qi"]
+
+    def test_multi_word_names(self):
+        """
+        A multi-word name is found as a whole, and each of its words on its own
+        """
+        name_dictionary = NameDictionary()
+        name_dictionary.add("Chicata Farfán")
+
+        text = "Chicata Farfán wrote this, or maybe just FARFÁN"
+        assert [text[start:end] for start, end in name_dictionary.find_all(text)] == ["Chicata Farfán", "FARFÁN"]
+
+    def test_name_particles_are_only_matched_within_the_name(self):
+        """
+        The particles of compound names are ordinary words: only the whole name, and its other words, are redacted
+        """
+        name_dictionary = NameDictionary()
+        for name in ["De La Cruz", "Van Der Berg", "Maria"]:
+            name_dictionary.add(name)
+
+        text = "We parked in the van, may de la sol shine on der Platz"
+        assert redact_free_text(text, "", "", "", name_dictionary) == text
+        text = "Ask Maria De La Cruz or Mr. Berg"
+        assert [text[start:end] for start, end in name_dictionary.find_all(text)] == ["Maria", "De La Cruz", "Berg"]
+
+    def test_incremental_updates(self):
+        """
+        Names added after matching are found, and removal is reference counted
+        """
+        name_dictionary = NameDictionary()
+        name_dictionary.add("Adam")
+        assert name_dictionary.find_all("Adam and Neel") == [(0, 4)]
+
+        name_dictionary.add("Neel")
+        name_dictionary.add("Neel")
+        assert name_dictionary.find_all("Adam and Neel") == [(0, 4), (9, 13)]
+
+        name_dictionary.remove("Neel")
+        name_dictionary.remove("Adam")
+        assert name_dictionary.find_all("Adam and Neel") == [(9, 13)]
+        name_dictionary.remove("Neel")
+        assert name_dictionary.find_all("Adam and Neel") == []
+        assert len(name_dictionary) == 0
+
+    def test_overlapping_names(self):
+        """
+        Of overlapping names, the one that starts first wins, then the longest
+        """
+        name_dictionary = NameDictionary()
+        for name in ["Ann", "Ann Lee", "Lee Roy"]:
+            name_dictionary.add(name)
+
+        text = "Ann Lee Roy"
+        assert [text[start:end] for start, end in name_dictionary.find_all(text)] == ["Ann Lee", "Roy"]
@@ -0,0 +1,47 @@
+from backend.main.detection.pii_detection import redact_free_text, redact_many
+
+
+class TestPiiDetection:
+    def test_redaction_of_every_kind(self):
+        """
+        Checks that names, emails, phone numbers and national IDs are all redacted in a single comment
+        """
+        comment = "I'm adam SMITH, call (839) 838-1627 or mail adam.smith@atlantisnet.co.atlantis\nId: 345-23-2334"
+        assert redact_free_text(comment, "Adam", "Smith", "345232334") == \
+            "I'm [REDACTED NAME] [REDACTED NAME], call [REDACTED PHONE NUMBER] or mail [REDACTED EMAIL]" \
+            "\nId: [REDACTED NATIONAL ID]"
+
+    def test_names_are_literals(self):
+        """
+        Names with regex metacharacters are matched literally
+        """
+        assert redact_free_text("J.R. wrote this, not JXRX", "J.R.", "O'Brien (Jr)", "1") == \
+            "[REDACTED NAME] wrote this, not JXRX"
+        assert redact_free_text("Sincerely, O'Brien (Jr)", "J.R.", "O'Brien (Jr)", "1") == \
+            "Sincerely, [REDACTED NAME]"
+
+    def test_empty_names_are_ignored(self):
+        """
+        An empty name shouldn't redact anything, or everything
+        """
+        assert redact_free_text("Vote for parks", "", "", "1") == "Vote for parks"
+
+    def test_non_ascii_names(self):
+        """
+        Non-ASCII names are redacted case-insensitively, including when lower-casing changes the text length
+        """
+        assert redact_free_text("Saludos, CHICATA FARFÁN", "Carlos", "Chicata Farfán", "1") == \
+            "Saludos, [REDACTED NAME]"
+        assert redact_free_text("İstanbul greetings from Ayşe", "Ayşe", "Yılmaz", "1") == \
+            "İstanbul greetings from [REDACTED NAME]"
+
+    def test_redact_many_keeps_order(self):
+        """
+        Batch redaction, in this process or on a process pool, returns the same texts as redact_free_text, in order
+        """
+        records = [("Call {0} at 839-838-{1:04d}".format(name, i), name, "Smith", "1")
+                   for i, name in enumerate(["Adam", "Linda", "Neel"] * 50)]
+        expected = [redact_free_text(*record) for record in records]
+
+        assert list(redact_many(iter(records), chunk_size=7)) == expected
+        assert list(redact_many((record for record in records), chunk_size=7, processes=2)) == expected
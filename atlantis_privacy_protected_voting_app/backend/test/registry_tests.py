@@ -1,7 +1,11 @@
+import bcrypt
+import jsons
 import pytest
 
+import backend.main.api.balloting as balloting
 import backend.main.api.registry as registry
-from backend.main.objects.voter import Voter, VoterStatus
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
 from backend.main.store.data_registry import VotingStore
 
 
@@ -65,6 +69,78 @@ class TestRegistry:
             voter.first_name, voter.last_name)
         assert registry.get_voter_status(voter.national_id) == VoterStatus.NOT_REGISTERED
 
+    def test_bulk_voter_registration(self):
+        """
+        Checks that bulk registration registers every new voter once, and reports duplicates in the same input or in the
+        registry as not registered.
+        """
+        assert registry.register_voter(Voter("Linda", "Qi", "444444444"))
+
+        voters = (voter for voter in [
+            Voter("Adam", "Smith", "111111111"),
+            Voter("Thien", "Huynh", "222222222"),
+            Voter("Adam", "Smith", "111-11-1111"),
+            Voter("Linda", "Qi", "444 44 4444"),
+            Voter("Neel", "Banerjee", "333333333"),
+        ])
+        assert registry.register_voters(voters, chunk_size=2) == [True, True, False, False, True]
+
+        for national_id in ["111111111", "222222222", "333333333", "444444444"]:
+            assert registry.get_voter_status(national_id) == VoterStatus.REGISTERED_NOT_VOTED
+
+    def test_candidate_list_cache(self):
+        """
+        The candidate list and its JSON are read from the database once, until a candidate is added.
+        """
+        store = VotingStore.get_instance()
+        registry.register_candidate("Kathryn Collins")
+        metrics = store.enable_instrumentation()
+        body, etag = registry.get_all_candidates_json()
+        assert registry.get_all_candidates_json() == (body, etag)
+        assert [candidate.name for candidate in registry.get_all_candidates()] == ["Kathryn Collins"]
+        assert metrics.snapshot()["statements"]["SELECT * FROM candidates"]["calls"] == 1
+
+        registry.register_candidate("Aditya Guha")
+        new_body, new_etag = registry.get_all_candidates_json()
+        assert new_etag != etag
+        assert new_body == jsons.dumps(registry.get_all_candidates())
+        assert [candidate.name for candidate in registry.get_all_candidates()] == ["Kathryn Collins", "Aditya Guha"]
+        assert metrics.snapshot()["statements"]["SELECT * FROM candidates"]["calls"] == 2
+        store.disable_instrumentation()
+
+    def test_national_id_hashing(self, monkeypatch):
+        """
+        With national ID hashing enabled, every new voter is stored with a bcrypt hash of their national ID - hashed on
+        a process pool in bulk, and once per national ID - while counting a ballot never runs bcrypt.
+        """
+        hasher = registry.enable_national_id_hashing(rounds=4, processes=2)
+        try:
+            hasher.chunk_size = 4
+            voters = [Voter("F", "L", "{0:09d}".format(i)) for i in range(12)]
+            assert registry.register_voter(voters[0])
+            assert registry.register_voters(voters + [Voter("F", "L", "000-000-011")]) == \
+                [False] + [True] * 11 + [False]
+
+            store = VotingStore.get_instance()
+            hashes = [store.get_national_id_hash(voter.national_id) for voter in voters]
+            assert all(national_id_hash.startswith(b"$2b$04$") for national_id_hash in hashes)
+            assert len(set(hashes)) == 12
+            assert hasher.verify("000-000-003", hashes[3])
+            assert not hasher.verify("000000004", hashes[3])
+        finally:
+            registry.disable_national_id_hashing()
+
+        def no_bcrypt(*args):
+            raise AssertionError("bcrypt called on the voting path")
+
+        monkeypatch.setattr(bcrypt, "hashpw", no_bcrypt)
+        monkeypatch.setattr(bcrypt, "checkpw", no_bcrypt)
+        ballot_number = balloting.issue_ballot(voters[5].national_id)
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), voters[5].national_id) == \
+            BallotStatus.BALLOT_COUNTED
+        assert registry.register_voter(Voter("F", "L", "999999999"))
+        assert store.get_national_id_hash("999999999") is None
+
     @pytest.fixture(autouse=True)
     def clear_store_between_tests(self):
         VotingStore.refresh_instance()
@@ -0,0 +1,86 @@
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot, BALLOT_NUMBER_KEY_SECRET_NAME, is_authentic_ballot_number
+from backend.main.objects.voter import Voter, BallotStatus, NAME_ENCRYPTION_KEY_SECRET_NAME, decrypt_name, \
+    encrypt_name, name_key_version
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.secret_registry import KEY_RING, KEY_VERSION_SUFFIX, overwrite_secret_bytes, \
+    overwrite_secret_str
+
+TEST_KEY_NAME = "KEY_RING_TEST_KEY"
+
+
+class TestKeyRing:
+    def test_keys_and_objects_are_cached_until_overwritten(self):
+        """
+        A key is decoded, and the objects built from it, once; overwriting the secret drops both.
+        """
+        key = KEY_RING.get_or_create_key(TEST_KEY_NAME)
+        built = []
+
+        def factory(key: bytes, version: int):
+            built.append((key, version))
+            return object()
+
+        first_object = KEY_RING.get_object(TEST_KEY_NAME, None, factory)
+        assert KEY_RING.get_key(TEST_KEY_NAME) is key
+        assert KEY_RING.get_object(TEST_KEY_NAME, 1, factory) is first_object
+        assert built == [(key, 1)]
+
+        overwrite_secret_bytes(TEST_KEY_NAME, b"k" * 32)
+        assert KEY_RING.get_key(TEST_KEY_NAME) == b"k" * 32
+        assert KEY_RING.get_object(TEST_KEY_NAME, None, factory) is not first_object
+        assert KEY_RING.get_key(TEST_KEY_NAME, 9) is None
+        assert KEY_RING.get_object(TEST_KEY_NAME, 9, factory) is None
+
+    def test_generated_keys_are_told_from_configured_ones(self):
+        """
+        A key generated by the process is only in its own secrets, until it's configured by overwriting the secret.
+        """
+        KEY_RING.get_or_create_key(TEST_KEY_NAME + "_GENERATED")
+        assert KEY_RING.is_generated(TEST_KEY_NAME + "_GENERATED")
+        overwrite_secret_bytes(TEST_KEY_NAME + "_GENERATED", b"k" * 32)
+        assert not KEY_RING.is_generated(TEST_KEY_NAME + "_GENERATED")
+        assert not KEY_RING.is_generated(TEST_KEY_NAME + "_MISSING")
+
+    def test_rotation_keeps_older_versions(self):
+        """
+        Rotating a key makes a new version current, and the older ones can still be read.
+        """
+        first_key = KEY_RING.get_or_create_key(TEST_KEY_NAME)
+        assert KEY_RING.rotate(TEST_KEY_NAME) == 2
+        assert KEY_RING.current_version(TEST_KEY_NAME) == 2
+        assert KEY_RING.get_key(TEST_KEY_NAME) != first_key
+        assert KEY_RING.get_key(TEST_KEY_NAME, 1) == first_key
+
+    def test_names_and_ballots_survive_rotation(self):
+        """
+        Names encrypted and ballots issued before the keys are rotated are still decrypted, verified and counted after.
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        encrypted_name = encrypt_name("Adam")
+        ballot_number = balloting.issue_ballot(voter.national_id)
+
+        KEY_RING.rotate(NAME_ENCRYPTION_KEY_SECRET_NAME)
+        KEY_RING.rotate(BALLOT_NUMBER_KEY_SECRET_NAME)
+
+        rotated_encrypted_name = encrypt_name("Adam")
+        assert (name_key_version(encrypted_name), name_key_version(rotated_encrypted_name)) == (1, 2)
+        assert decrypt_name(encrypted_name) == decrypt_name(rotated_encrypted_name) == "Adam"
+        rotated_ballot_number = balloting.issue_ballot(voter.national_id)
+        assert len(rotated_ballot_number) == 44
+        assert is_authentic_ballot_number(ballot_number) and is_authentic_ballot_number(rotated_ballot_number)
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+        with pytest.raises(ValueError):
+            decrypt_name("3:" + rotated_encrypted_name[2:])
+
+    @pytest.fixture(autouse=True)
+    def restore_key_versions(self):
+        VotingStore.refresh_instance()
+        yield
+        for name in (TEST_KEY_NAME, NAME_ENCRYPTION_KEY_SECRET_NAME, BALLOT_NUMBER_KEY_SECRET_NAME):
+            overwrite_secret_str(name + KEY_VERSION_SUFFIX, "1")
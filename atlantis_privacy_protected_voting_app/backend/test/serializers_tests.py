@@ -0,0 +1,39 @@
+import json
+
+import jsons
+
+from backend.main.api.serializers import serialize_ballot_status, serialize_candidates, serialize_comment_line, \
+    serialize_count_ballot_response
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import BallotStatus
+
+
+class TestSerializers:
+    def test_candidates_match_jsons(self):
+        """
+        The candidate serializer writes the same bytes as jsons, whatever the names hold
+        """
+        candidate_lists = [
+            [],
+            [Candidate("1", "Joseph Klimek")],
+            [Candidate("2", "Carlos Fernando Chicata Farfán"), Candidate("3", "Yeong Qi 榮琪 \U0001F5F3")],
+            [Candidate("4", 'Quote " backslash \\ tab \t newline \n nul \x00 separator  '), Candidate("5", None)],
+        ]
+        for candidates in candidate_lists:
+            assert serialize_candidates(candidates) == jsons.dumps(candidates)
+
+    def test_candidate_fields_are_strings(self):
+        """
+        Like jsons did when it cast the fields to their declared type, ids that aren't strings are written as strings
+        """
+        assert serialize_candidates([Candidate(2, "Rina Harvey")]) == '[{"candidate_id": "2", "name": "Rina Harvey"}]'
+
+    def test_ballot_status_match_jsons(self):
+        for status in BallotStatus:
+            assert serialize_ballot_status(status) == jsons.dumps(status.value)
+            assert json.loads(serialize_count_ballot_response(status)) == {"status": jsons.dumps(status.value)}
+            assert serialize_count_ballot_response(status) == json.dumps({"status": jsons.dumps(status.value)})
+
+    def test_comment_line_match_json(self):
+        for comment in ["", "Public transportation matters to me.", "Ça va \"bien\"\n\U0001F5F3"]:
+            assert serialize_comment_line(comment) == json.dumps(comment) + "\n"
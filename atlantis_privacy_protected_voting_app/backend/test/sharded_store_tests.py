@@ -0,0 +1,77 @@
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
+from backend.main.store.data_registry import VotingStore, SHARDS_ENV_VARIABLE
+from backend.main.store.sharded_store import ShardedVotingStore, shard_of
+
+
+class TestShardedStore:
+    def test_election_across_shards(self):
+        """
+        The API works unchanged on a sharded store: voters are spread over the shards, and the aggregates merge them
+        """
+        store = VotingStore.get_instance()
+        assert isinstance(store, ShardedVotingStore)
+        for candidate_name in ["Kathryn Collins", "Aditya Guha"]:
+            registry.register_candidate(candidate_name)
+        voters = [Voter("First{0}".format(i), "Last{0}".format(i), "{0:09d}".format(i)) for i in range(40)]
+        assert registry.register_voters(voters) == [True] * 40
+        assert not registry.register_voter(Voter("First0", "Last0", "000-000-000"))
+        assert {shard_of(voter.national_id, 4) for voter in voters} == {0, 1, 2, 3}
+        assert all(shard.get_fraudulent_voters() == [] for shard in store.shards)
+
+        ballot_numbers = balloting.issue_ballots([voter.national_id for voter in voters])
+        for i, (voter, ballot_number) in enumerate(zip(voters, ballot_numbers)):
+            candidate_id = "1" if i < 25 else "2"
+            assert balloting.count_ballot(Ballot(ballot_number, candidate_id, "Comment {0}".format(i)),
+                                          voter.national_id) == BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(Ballot(ballot_numbers[1], "2", ""), voters[0].national_id) == \
+            BallotStatus.VOTER_BALLOT_MISMATCH
+
+        fraud_ballot = balloting.issue_ballot(voters[3].national_id)
+        assert balloting.count_ballot(Ballot(fraud_ballot, "2", ""), voters[3].national_id) == \
+            BallotStatus.FRAUD_COMMITTED
+        assert balloting.get_all_fraudulent_voters() == ["First3 Last3"]
+        assert registry.get_voter_status(voters[3].national_id) == VoterStatus.FRAUD_COMMITTED
+
+        unused_ballot = balloting.issue_ballot(voters[5].national_id)
+        assert balloting.invalidate_ballot(unused_ballot)
+        assert not balloting.invalidate_ballot(ballot_numbers[5])
+
+        assert store.get_most_voted() == [("1", 25), ("2", 15)]
+        assert [(candidate.name, votes) for candidate, votes in balloting.get_election_standings()] == \
+            [("Kathryn Collins", 25), ("Aditya Guha", 15)]
+        assert balloting.compute_election_winner().name == "Kathryn Collins"
+        assert store.reconcile_tally()
+        assert sorted(balloting.get_all_ballot_comments()) == sorted("Comment {0}".format(i) for i in range(40))
+
+    def test_comment_records_are_unique_across_shards(self):
+        store = VotingStore.get_instance()
+        voters = [Voter("Adam", "Smith{0}".format(i), "{0:09d}".format(i)) for i in range(12)]
+        store.add_voters(voters)
+        store.add_ballots([(voter.national_id, "b{0}".format(i)) for i, voter in enumerate(voters)])
+        for i, voter in enumerate(voters):
+            store.cast_ballots([(Ballot("b{0}".format(i), "1", "Call Adam"), voter.national_id)])
+
+        records = list(store.iter_comment_records(page_size=2))
+        assert len({record[0] for record in records}) == 12
+        store.update_comments([("Call [REDACTED]", record[0]) for record in records[:5]])
+        assert sorted(store.get_comments()) == ["Call Adam"] * 7 + ["Call [REDACTED]"] * 5
+
+    def test_shard_count_is_checked(self, tmp_path, configured_keys):
+        database = str(tmp_path / "voting.db")
+        ShardedVotingStore(2, database).close()
+        assert (tmp_path / "voting.shard1.db").exists()
+        with pytest.raises(ValueError):
+            ShardedVotingStore(3, database)
+
+    @pytest.fixture(autouse=True)
+    def sharded_store(self, monkeypatch):
+        monkeypatch.setenv(SHARDS_ENV_VARIABLE, "4")
+        VotingStore.refresh_instance()
+        yield
+        monkeypatch.delenv(SHARDS_ENV_VARIABLE)
+        VotingStore.refresh_instance()